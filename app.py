@@ -5,16 +5,14 @@ Calibrado para R$ 9.000 base
 """
 
 import streamlit as st
-import pandas as pd
-import json
 from datetime import datetime
-import plotly.express as px
-import plotly.graph_objects as go
 
-# Importar módulos locais
-from auth_manager import AuthManager
-from file_analyzer import FileAnalyzer
+# Importar módulos locais (pandas, plotly e o analisador são
+# importados sob demanda, só quando a tela que os usa é exibida)
+from auth_manager import COTA_ESGOTADA, obter_auth_manager
 from orcamento_engine import OrcamentoEngineFabricaFinal
+from exportacao import exportar, mime_exportacao, nome_arquivo_exportacao
+from catalogo_precos import obter_catalogo
 
 # Configuração da página
 st.set_page_config(
@@ -155,7 +153,21 @@ def main():
     """Função principal da aplicação"""
     
     # Inicializar gerenciadores
-    auth_manager = AuthManager()
+    auth_manager = obter_auth_manager()
+    
+    # Restaurar sessão pelo token da URL (sobrevive a recarregar a página).
+    # O token da URL vaza por histórico, links e Referer: a cada restauração
+    # ele é trocado por um novo, e o antigo deixa de valer
+    if 'usuario_logado' not in st.session_state:
+        token = st.query_params.get('sessao')
+        renovada = auth_manager.renovar_sessao(token) if token else None
+        if renovada:
+            usuario, token = renovada
+            st.session_state.usuario_logado = usuario
+            st.session_state.token_sessao = token
+            st.query_params['sessao'] = token
+        elif token:
+            st.query_params.pop('sessao', None)
     
     # Verificar autenticação
     if 'usuario_logado' not in st.session_state:
@@ -200,6 +212,10 @@ def mostrar_tela_login(auth_manager):
                 usuario = auth_manager.fazer_login(email, senha)
                 if usuario:
                     st.session_state.usuario_logado = usuario
+                    token = auth_manager.criar_sessao(usuario)
+                    if token:
+                        st.session_state.token_sessao = token
+                        st.query_params['sessao'] = token
                     st.success("✅ Login realizado com sucesso!")
                     st.rerun()
                 else:
@@ -265,6 +281,10 @@ def mostrar_aplicacao_principal(auth_manager, usuario):
         
         # Logout
         if st.button("🚪 Sair", use_container_width=True):
+            token = st.session_state.pop('token_sessao', None)
+            if token:
+                auth_manager.encerrar_sessao(token)
+            st.query_params.pop('sessao', None)
             del st.session_state.usuario_logado
             st.rerun()
         
@@ -273,22 +293,28 @@ def mostrar_aplicacao_principal(auth_manager, usuario):
         # Configurações de orçamento
         st.markdown("### 🔧 Configurações do Orçamento")
         
+        # Opções vindas do catálogo de preços em vigor
+        catalogo = obter_catalogo()
+        materiais = list(catalogo.materiais)
+        complexidades = list(catalogo.complexidades)
+        
         material = st.selectbox(
             "📦 Material",
-            ["mdf_18mm", "mdf_15mm", "compensado_18mm", "compensado_15mm", "melamina_18mm", "melamina_15mm"],
+            materiais,
+            index=materiais.index("mdf_18mm") if "mdf_18mm" in materiais else 0,
             format_func=lambda x: x.replace("_", " ").title()
         )
         
         complexidade = st.selectbox(
             "⚙️ Complexidade",
-            ["simples", "media", "complexa", "premium"],
-            index=1,
+            complexidades,
+            index=complexidades.index("media") if "media" in complexidades else 0,
             format_func=lambda x: x.title()
         )
         
         qualidade_acessorios = st.selectbox(
             "🔩 Qualidade dos Acessórios",
-            ["comum", "premium"],
+            list(catalogo.qualidades_acessorios),
             format_func=lambda x: x.title()
         )
         
@@ -312,12 +338,18 @@ def mostrar_aplicacao_principal(auth_manager, usuario):
         
         🎯 **Resultado:** Máxima competitividade
         """)
+        st.caption(f"📚 Catálogo de preços: versão {catalogo.versao}")
     
     # Área principal
-    tab1, tab2, tab3, tab4 = st.tabs(["📤 Upload", "📊 Resultados", "📈 Gráficos", "📄 Relatório"])
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["📤 Upload", "📊 Resultados", "📈 Gráficos", "📄 Relatório", "🗂️ Histórico"])
     
     with tab1:
-        mostrar_area_upload()
+        mostrar_area_upload(auth_manager, usuario, {
+            'material': material,
+            'complexidade': complexidade,
+            'qualidade_acessorios': qualidade_acessorios,
+            'margem_lucro': margem_lucro
+        })
     
     with tab2:
         if 'analise' in st.session_state and 'orcamento' in st.session_state:
@@ -336,9 +368,16 @@ def mostrar_aplicacao_principal(auth_manager, usuario):
             mostrar_relatorio(st.session_state.orcamento)
         else:
             st.info("📄 Faça upload de um arquivo 3D para gerar o relatório")
+    
+    with tab5:
+        mostrar_historico(auth_manager, usuario)
 
-def mostrar_area_upload():
-    """Área de upload de arquivos"""
+def mostrar_area_upload(auth_manager, usuario, configuracoes):
+    """Área de upload de arquivos
+    
+    configuracoes: escolhas da barra lateral (material, complexidade,
+    acessórios e margem) com que o orçamento é cobrado e salvo
+    """
     
     st.markdown("### 📤 Upload de Arquivo 3D")
     
@@ -399,6 +438,7 @@ def mostrar_area_upload():
                         f.write(arquivo_upload.getbuffer())
                     
                     # Analisar arquivo
+                    from file_analyzer import FileAnalyzer
                     analyzer = FileAnalyzer()
                     analise = analyzer.analisar_arquivo_3d(f"temp_{arquivo_upload.name}")
                     
@@ -407,17 +447,32 @@ def mostrar_area_upload():
                         
                         # Calcular orçamento
                         engine = OrcamentoEngineFabricaFinal()
-                        configuracoes = {
-                            'material': st.session_state.get('material', 'mdf_18mm'),
-                            'complexidade': st.session_state.get('complexidade', 'media'),
-                            'qualidade_acessorios': st.session_state.get('qualidade_acessorios', 'comum'),
-                            'margem_lucro': st.session_state.get('margem_lucro', 30)
-                        }
+                        configuracoes = dict(configuracoes)
+                        
+                        base = engine.calcular_custo_base(analise, configuracoes)
                         
-                        orcamento = engine.calcular_orcamento_completo(analise, configuracoes)
+                        orcamento = base.orcamento(configuracoes) if base else None
                         
-                        if orcamento:
+                        # Cota do mês consumida na hora; o histórico é gravado em segundo plano
+                        restantes = auth_manager.consumir_orcamento(usuario['id']) if orcamento else None
+                        
+                        if orcamento and restantes == COTA_ESGOTADA:
+                            st.error("❌ Limite de orçamentos do mês atingido. Faça upgrade do seu plano.")
+                        elif orcamento and restantes is None:
+                            st.error("❌ Erro ao registrar o orçamento. Tente novamente.")
+                        elif orcamento:
+                            auth_manager.enfileirar_orcamento(usuario['id'], arquivo_upload.name, orcamento)
+                            st.session_state.base_orcamento = base
+                            st.session_state.chave_base = (
+                                configuracoes['material'],
+                                configuracoes['complexidade'],
+                                configuracoes['qualidade_acessorios'],
+                                base.versao_catalogo
+                            )
                             st.session_state.orcamento = orcamento
+                            st.session_state.pop('valor_alvo_cliente', None)
+                            
+                            usuario['orcamentos_mes'] = usuario['limite_orcamentos'] - restantes
                             
                             st.markdown("""
                             <div class="alert-success">
@@ -429,28 +484,33 @@ def mostrar_area_upload():
                             st.error("❌ Erro ao calcular orçamento")
                     else:
                         st.error("❌ Erro ao analisar arquivo")
-                        
+                
                 except Exception as e:
                     st.error(f"❌ Erro: {str(e)}")
 
 def mostrar_resultados(analise, orcamento, material, complexidade, qualidade_acessorios, margem_lucro):
     """Mostra resultados do orçamento"""
     
-    # Recalcular se configurações mudaram
+    # Recalcular componentes só se material/complexidade/acessórios ou o
+    # catálogo mudaram; a margem é aplicada sobre a base já calculada (O(1))
     configuracoes_atuais = {
         'material': material,
         'complexidade': complexidade,
         'qualidade_acessorios': qualidade_acessorios,
         'margem_lucro': margem_lucro
     }
+    chave_base = (material, complexidade, qualidade_acessorios, obter_catalogo().versao)
     
-    if (not hasattr(st.session_state, 'configuracoes_anteriores') or 
-        st.session_state.configuracoes_anteriores != configuracoes_atuais):
+    if (st.session_state.get('chave_base') != chave_base or
+        'base_orcamento' not in st.session_state):
         
         engine = OrcamentoEngineFabricaFinal()
-        orcamento = engine.calcular_orcamento_completo(analise, configuracoes_atuais)
-        st.session_state.orcamento = orcamento
-        st.session_state.configuracoes_anteriores = configuracoes_atuais
+        st.session_state.base_orcamento = engine.calcular_custo_base(analise, configuracoes_atuais)
+        st.session_state.chave_base = chave_base
+    
+    base = st.session_state.base_orcamento
+    orcamento = base.orcamento(configuracoes_atuais) if base else None
+    st.session_state.orcamento = orcamento
     
     if not orcamento:
         st.error("❌ Erro ao calcular orçamento")
@@ -518,6 +578,64 @@ def mostrar_resultados(analise, orcamento, material, complexidade, qualidade_ace
             st.markdown(f"**Preço Mercado:** R$ {resumo['valor_mercado_estimado']:,.2f}")
             st.markdown(f"**Economia Cliente:** R$ {economia:,.2f}")
     
+    # Preço-alvo: margem exata por combinação, sem recalcular componentes
+    with st.expander("🎯 Partir do orçamento do cliente"):
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            # Chave estável e sem value: mexer na margem não descarta o valor digitado
+            if 'valor_alvo_cliente' not in st.session_state:
+                st.session_state.valor_alvo_cliente = float(round(resumo['valor_final'], -2))
+            
+            valor_alvo = st.number_input(
+                "💵 Valor desejado (R$)",
+                min_value=0.0,
+                step=500.0,
+                key='valor_alvo_cliente'
+            )
+        
+        with col2:
+            margem_minima = st.number_input("📉 Margem mínima (%)", min_value=0.0, value=20.0, step=5.0)
+        
+        solucao = OrcamentoEngineFabricaFinal().resolver_preco_alvo(base, valor_alvo, margem_minima)
+        
+        if solucao and solucao['pareto']:
+            st.markdown("**Melhores combinações (padrão x margem):**")
+            
+            import pandas as pd
+            df_alvo = pd.DataFrame([
+                {
+                    'Material': c['material'].replace('_', ' ').title(),
+                    'Complexidade': c['complexidade'].title(),
+                    'Acessórios': c['qualidade_acessorios'].title(),
+                    'Base Fábrica': f"R$ {c['custo_base_fabrica']:,.2f}",
+                    'Margem': f"{c['margem_lucro_pct']:.1f}%"
+                }
+                for c in solucao['pareto']
+            ])
+            st.dataframe(df_alvo, use_container_width=True)
+        else:
+            st.warning("⚠️ Nenhuma combinação atinge esse valor com a margem mínima")
+    
+    # Resumo por tipo (agregado junto com o orçamento)
+    por_tipo = orcamento.get('agregacoes', {}).get('por_tipo', [])
+    if por_tipo:
+        st.markdown("### 🗂️ Resumo por Tipo")
+        
+        import pandas as pd
+        df_tipos = pd.DataFrame([
+            {
+                'Tipo': grupo['tipo'].title(),
+                'Quantidade': grupo['quantidade'],
+                'Área (m²)': f"{grupo['area_m2']:.2f}",
+                'Custo': f"R$ {grupo['custo_total']:,.2f}",
+                '% do Custo': f"{grupo['percentual_custo']:.1f}%",
+                'IA Confiança': f"{grupo['confianca_media']:.1%}" if grupo['confianca_media'] is not None else "N/A"
+            }
+            for grupo in por_tipo
+        ])
+        st.dataframe(df_tipos, use_container_width=True)
+    
     # Componentes detalhados
     st.markdown("### 📦 Componentes Detalhados")
     
@@ -533,6 +651,7 @@ def mostrar_resultados(analise, orcamento, material, complexidade, qualidade_ace
         })
     
     if componentes_df:
+        import pandas as pd
         df = pd.DataFrame(componentes_df)
         st.dataframe(df, use_container_width=True)
 
@@ -541,50 +660,159 @@ def mostrar_graficos(orcamento):
     
     st.markdown("### 📊 Análise Visual")
     
+    # Só o gráfico selecionado é construído (ou lido do cache)
+    visao = st.radio(
+        "Visualização",
+        ["distribuicao", "comparacao", "componentes"],
+        format_func=lambda x: {
+            'distribuicao': "🥧 Distribuição de Custos",
+            'comparacao': "📊 Fábrica vs Mercado",
+            'componentes': "📦 Custo por Componente"
+        }[x],
+        horizontal=True,
+        label_visibility="collapsed"
+    )
+    
     engine = OrcamentoEngineFabricaFinal()
-    graficos = engine.gerar_graficos(orcamento)
+    grafico = engine.gerar_grafico(orcamento, visao)
     
-    if graficos:
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            if 'distribuicao' in graficos:
-                st.plotly_chart(graficos['distribuicao'], use_container_width=True)
-        
-        with col2:
-            if 'comparacao' in graficos:
-                st.plotly_chart(graficos['comparacao'], use_container_width=True)
-        
-        if 'componentes' in graficos:
-            st.plotly_chart(graficos['componentes'], use_container_width=True)
+    if grafico is not None:
+        st.plotly_chart(grafico, use_container_width=True)
+    else:
+        st.info("📊 Sem dados para este gráfico")
 
 def mostrar_relatorio(orcamento):
     """Mostra relatório detalhado"""
     
     st.markdown("### 📄 Relatório Detalhado")
     
-    engine = OrcamentoEngineFabricaFinal()
-    relatorio = engine.gerar_relatorio_detalhado(orcamento)
+    # Arquivos gerados uma vez por orçamento (cache por hash)
+    relatorio = exportar(orcamento, 'txt').decode('utf-8')
     
     # Mostrar relatório
     st.text_area("Relatório Completo", relatorio, height=400)
     
-    # Botão de download
-    st.download_button(
-        label="📥 Baixar Relatório",
-        data=relatorio,
-        file_name=f"orcamento_orca_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
-        mime="text/plain"
-    )
+    # Exportação: só o formato escolhido é gerado
+    col1, col2 = st.columns([2, 1])
+    
+    with col1:
+        formato = st.selectbox(
+            "📁 Formato de exportação",
+            ["txt", "html", "csv", "xlsx", "json"],
+            format_func=lambda x: {
+                'txt': "📄 Relatório (TXT)",
+                'html': "🖨️ Orçamento para impressão (HTML)",
+                'csv': "✂️ Lista de corte (CSV)",
+                'xlsx': "📊 Planilha (XLSX)",
+                'json': "🧾 Dados completos (JSON)"
+            }[x]
+        )
+    
+    with col2:
+        st.download_button(
+            label="📥 Baixar",
+            data=exportar(orcamento, formato),
+            file_name=nome_arquivo_exportacao(formato, datetime.now().strftime('%Y%m%d_%H%M%S')),
+            mime=mime_exportacao(formato),
+            use_container_width=True
+        )
+
+def mostrar_historico(auth_manager, usuario):
+    """Histórico de orçamentos salvos, paginado por cursor, com busca"""
+    
+    st.markdown("### 🗂️ Histórico de Orçamentos")
+    
+    busca = st.text_input("🔎 Buscar", placeholder="Ex.: cozinha despenseiro", key="busca_historico")
+    
+    if busca.strip():
+        # Busca: páginas numeradas, voltando à primeira quando o texto muda
+        if st.session_state.get('texto_busca_historico') != busca:
+            st.session_state.texto_busca_historico = busca
+            st.session_state.pagina_busca_historico = 1
+        numero = st.session_state.pagina_busca_historico
+        
+        pagina = auth_manager.buscar_orcamentos(usuario['id'], busca, numero, 20)
+        anterior_desabilitado = numero == 1
+        proxima_desabilitada = not pagina['tem_mais']
+    else:
+        # Pilha de cursores: a página atual é o último; voltar é desempilhar
+        if 'cursores_historico' not in st.session_state:
+            st.session_state.cursores_historico = [None]
+        cursores = st.session_state.cursores_historico
+        numero = len(cursores)
+        
+        pagina = auth_manager.obter_pagina_historico(usuario['id'], 20, cursores[-1])
+        anterior_desabilitado = numero == 1
+        proxima_desabilitada = pagina['proximo_cursor'] is None
+    
+    if not pagina['itens']:
+        st.info("🔎 Nenhum orçamento encontrado" if busca.strip() else "🗂️ Nenhum orçamento salvo ainda")
+        return
+    
+    import pandas as pd
+    df = pd.DataFrame([
+        {
+            'Data': item['data_criacao'],
+            'Arquivo': item['nome_arquivo'],
+            'Área (m²)': f"{item['area_total'] or 0:.2f}",
+            'Valor Final': f"R$ {item['valor_final'] or 0:,.2f}"
+        }
+        for item in pagina['itens']
+    ])
+    if busca.strip():
+        df['Componentes'] = [item['trecho'] for item in pagina['itens']]
+    st.dataframe(df, use_container_width=True)
     
-    # Exportar JSON
-    json_data = json.dumps(orcamento, indent=2, ensure_ascii=False, default=str)
-    st.download_button(
-        label="📥 Baixar JSON",
-        data=json_data,
-        file_name=f"orcamento_orca_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
-        mime="application/json"
+    col1, col2, col3 = st.columns([1, 2, 1])
+    
+    with col1:
+        if st.button("⬅️ Anteriores", disabled=anterior_desabilitado, use_container_width=True):
+            if busca.strip():
+                st.session_state.pagina_busca_historico -= 1
+            else:
+                cursores.pop()
+            st.rerun()
+    
+    with col2:
+        st.caption(f"Página {numero}")
+    
+    with col3:
+        rotulo = "Próximos ➡️" if busca.strip() else "Mais antigos ➡️"
+        if st.button(rotulo, disabled=proxima_desabilitada, use_container_width=True):
+            if busca.strip():
+                st.session_state.pagina_busca_historico += 1
+            else:
+                cursores.append(pagina['proximo_cursor'])
+            st.rerun()
+    
+    # Baixar um orçamento da página: o payload só é lido quando o usuário
+    # escolhe um, e fica em session_state (reruns não decodificam de novo)
+    itens = {item['id']: item for item in pagina['itens']}
+    orcamento_id = st.selectbox(
+        "📁 Orçamento",
+        [None] + list(itens),
+        format_func=lambda i: "Selecione um orçamento..." if i is None
+                              else f"{itens[i]['data_criacao']} - {itens[i]['nome_arquivo']}"
     )
+    
+    if orcamento_id is None:
+        return
+    
+    aberto = st.session_state.get('orcamento_aberto_historico')
+    if not aberto or aberto[0] != orcamento_id:
+        orcamento_salvo = auth_manager.obter_orcamento(orcamento_id, usuario['id'])
+        aberto = (orcamento_id, exportar(orcamento_salvo, 'txt') if orcamento_salvo else None)
+        st.session_state.orcamento_aberto_historico = aberto
+    
+    if aberto[1]:
+        st.download_button(
+            label="📥 Baixar relatório",
+            data=aberto[1],
+            file_name=nome_arquivo_exportacao('txt', str(orcamento_id)),
+            mime=mime_exportacao('txt')
+        )
+    else:
+        st.error("❌ Erro ao carregar orçamento")
 
 if __name__ == "__main__":
     main()
@@ -3,70 +3,262 @@ Sistema de Autenticação - Orca Interiores
 Versão 5.0 - Sistema limpo e profissional
 """
 
+import atexit
+import queue
 import sqlite3
-import hashlib
+import json
 import os
-from datetime import datetime, timedelta
-from typing import Optional, Dict
+import secrets
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Iterable, List, Tuple
+
+from busca import consulta_fts, textos_busca, token_usuario
+from migracoes import aplicar_migracoes, reconstruir_estatisticas
+from senhas import ServicoSenhas, obter_servico_senhas
+from sharding import arquivos_orcamentos, ler_configuracao, nome_shard_hash, resolver_shard
+from serializacao import hash_conteudo, orcamento_canonico, serializar_orcamento, desserializar_orcamento
+
+# Espera máxima por um lock do banco antes de "database is locked" (segundos)
+TIMEOUT_BANCO = 5.0
+
+# Configuração de cada conexão do pool
+PRAGMAS_CONEXAO = (
+    "PRAGMA journal_mode=WAL",        # leitores não bloqueiam o escritor
+    "PRAGMA synchronous=NORMAL",      # seguro em WAL; fsync só no checkpoint
+    "PRAGMA cache_size=-16000",       # 16 MB de cache de páginas
+    "PRAGMA mmap_size=67108864",      # 64 MB lidos via mmap
+    "PRAGMA temp_store=MEMORY",
+    f"PRAGMA busy_timeout={int(TIMEOUT_BANCO * 1000)}"
+)
+
+# Sessões: validade do token (curta: o token vai na URL e é trocado a cada
+# restauração), tempo máximo no cache em memória (um logout feito em outro
+# processo vale aqui no máximo após esse tempo) e tamanho do cache
+DURACAO_SESSAO = timedelta(days=1)
+TTL_CACHE_SESSAO = 300.0
+TAMANHO_CACHE_SESSOES = 10000
+
+# Limite mensal de orçamentos de cada plano
+LIMITES_PLANOS = {
+    'basico': 10,
+    'profissional': 50,
+    'empresarial': 999999
+}
+
+# Cache de planos (plano e limite de cada usuário): tempo máximo de uma
+# entrada, tamanho do cache e intervalo entre consultas à versão gravada no
+# banco (uma troca de plano feita em outro processo vale aqui após esse tempo)
+TTL_CACHE_PLANOS = 60.0
+TAMANHO_CACHE_PLANOS = 10000
+INTERVALO_VERSAO_PLANOS = 1.0
+
+# Tempo que as trocas de plano ficam registradas (segundos); maior que os
+# TTLs dos caches, então nenhum processo perde uma invalidação
+RETENCAO_ALTERACOES_PLANOS = 3600
+
+# Intervalo mínimo entre limpezas de sessões vencidas (segundos)
+INTERVALO_LIMPEZA_SESSOES = 3600.0
+
+# Gravação assíncrona de orçamentos: capacidade da fila, linhas por commit
+# e espera máxima do chamador com a fila cheia antes de gravar direto (segundos)
+TAMANHO_FILA_GRAVACAO = 1000
+TAMANHO_LOTE_GRAVACAO = 64
+TIMEOUT_FILA_GRAVACAO = 2.0
+
+# Retorno de consumir_orcamento quando o limite do mês já foi atingido
+# (None fica para erro no banco, como no resto do AuthManager)
+COTA_ESGOTADA = -1
+
+def periodo_cobranca(momento: Optional[datetime] = None) -> str:
+    """Chave do período de cobrança (mês UTC, 'AAAA-MM')"""
+    return (momento or datetime.now(timezone.utc)).strftime('%Y-%m')
+
+class _SentinelaThread:
+    """Objeto guardado no threading.local: é coletado quando a thread termina"""
+    __slots__ = ('__weakref__',)
+
+def _fechar_conexoes_thread(ref_auth: 'weakref.ref', conexoes: Dict[str, sqlite3.Connection]):
+    """Fecha as conexões de uma thread que terminou e tira-as do pool"""
+    
+    auth = ref_auth()
+    for conn in conexoes.values():
+        if auth is not None:
+            with auth._lock_conexoes:
+                auth._conexoes.discard(conn)
+        try:
+            conn.close()
+        except Exception as e:
+            print(f"Erro ao fechar conexão: {e}")
+
+# Bancos já migrados neste processo (caminho absoluto)
+_bancos_inicializados = set()
+_lock_inicializacao = threading.Lock()
 
 class AuthManager:
     """Gerenciador de autenticação e usuários"""
     
-    def __init__(self, db_path: str = "usuarios.db"):
-        """Inicializa o gerenciador de autenticação"""
+    def __init__(self, db_path: str = "usuarios.db", servico_senhas: Optional[ServicoSenhas] = None,
+                 pasta_shards: Optional[str] = None, num_shards: Optional[int] = None):
+        """Inicializa o gerenciador de autenticação
+        
+        servico_senhas: pool de hash de senhas; por padrão o compartilhado do processo
+        pasta_shards/num_shards: sharding dos orçamentos; por padrão o gravado no
+        banco central por sharding.py (0 shards = tudo no banco central)
+        """
         self.db_path = db_path
-        self._criar_tabelas()
-        self._criar_usuarios_demo()
+        self.senhas = servico_senhas or obter_servico_senhas()
+        
+        # Pool: uma conexão persistente por thread e por arquivo, fechada
+        # quando a thread termina (o Streamlit cria uma thread por rerun)
+        self._local = threading.local()
+        self._conexoes: set = set()
+        self._lock_conexoes = threading.Lock()
+        
+        # Cache de sessões: token -> (usuário, expira_em, válido_no_cache_até)
+        self._cache_sessoes: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock_sessoes = threading.Lock()
+        self._ultima_limpeza_sessoes = 0.0
+        
+        # Cache de planos: usuário -> (plano, limite, válido_no_cache_até).
+        # A geração muda a cada invalidação: leitura feita antes dela não entra no cache
+        self._cache_planos: 'OrderedDict[int, tuple]' = OrderedDict()
+        self._lock_planos = threading.Lock()
+        self._geracao_planos = 0
+        self._versao_planos = 0
+        self._proxima_versao_planos = 0.0
+        self._metricas_planos = {'acertos': 0, 'faltas': 0, 'invalidacoes': 0}
+        
+        self._gravador: Optional['GravadorOrcamentos'] = None
+        self._lock_gravador = threading.Lock()
+        
+        self._inicializar_banco()
+        
+        # Roteamento: usuário -> arquivo dos seus orçamentos (o diretório só
+        # muda com sharding.py, rodado com o app parado)
+        with self._conectar() as conn:
+            pasta, num = ler_configuracao(conn)
+            self._versao_planos = conn.execute("SELECT COALESCE(MAX(versao), 0) FROM alteracoes_planos").fetchone()[0]
+        self.pasta_shards = pasta_shards or pasta
+        self.num_shards = num if num_shards is None else num_shards
+        self._shards: Dict[int, str] = {}
     
-    def _criar_tabelas(self):
-        """Cria as tabelas necessárias no banco de dados"""
+    def _conectar(self, caminho: Optional[str] = None) -> sqlite3.Connection:
+        """Conexão persistente da thread atual com o banco (central por padrão)
         
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # Tabela de usuários
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS usuarios (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    email TEXT UNIQUE NOT NULL,
-                    senha_hash TEXT NOT NULL,
-                    plano TEXT DEFAULT 'basico',
-                    data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    data_ultimo_login TIMESTAMP,
-                    ativo BOOLEAN DEFAULT 1,
-                    orcamentos_mes INTEGER DEFAULT 0,
-                    limite_orcamentos INTEGER DEFAULT 10
-                )
-            """)
-            
-            # Tabela de sessões
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS sessoes (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    usuario_id INTEGER,
-                    token TEXT UNIQUE NOT NULL,
-                    data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    data_expiracao TIMESTAMP NOT NULL,
-                    ativo BOOLEAN DEFAULT 1,
-                    FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
-                )
-            """)
-            
-            # Tabela de orçamentos
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS orcamentos (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    usuario_id INTEGER,
-                    nome_arquivo TEXT,
-                    valor_final REAL,
-                    area_total REAL,
-                    data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    dados_json TEXT,
-                    FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
-                )
-            """)
+        Criada e configurada no primeiro uso. Usada como `with
+        self._conectar() as conn:` - o bloco faz commit ou rollback, mas a
+        conexão continua aberta para a próxima chamada. Quando a thread
+        termina, a sentinela dela é coletada e as conexões são fechadas.
+        """
+        
+        caminho = caminho or self.db_path
+        conexoes = getattr(self._local, 'conexoes', None)
+        if conexoes is None:
+            conexoes = self._local.conexoes = {}
+            self._local.sentinela = _SentinelaThread()
+            weakref.finalize(self._local.sentinela, _fechar_conexoes_thread, weakref.ref(self), conexoes)
+        
+        conn = conexoes.get(caminho)
+        if conn is not None:
+            return conn
+        
+        # check_same_thread=False só para que fechar() possa encerrar conexões
+        # de outras threads; no uso normal cada conexão fica na sua thread
+        conn = sqlite3.connect(caminho, timeout=TIMEOUT_BANCO, check_same_thread=False)
+        for pragma in PRAGMAS_CONEXAO:
+            conn.execute(pragma)
+        
+        conexoes[caminho] = conn
+        with self._lock_conexoes:
+            self._conexoes.add(conn)
+        return conn
+    
+    def _shard_usuario(self, usuario_id: int) -> str:
+        """Arquivo dos orçamentos do usuário, pelo diretório do banco central
+        
+        Com sharding ligado, o primeiro acesso de um usuário sem shard grava o
+        do hash no diretório; depois disso mudar num_shards não o move. Quem
+        já tem orçamentos no banco central continua nele até sharding.py
+        dividir movê-los (atribuir antes esconderia o histórico).
+        """
+        
+        caminho = self._shards.get(usuario_id)
+        if caminho is not None:
+            return caminho
+        
+        with self._conectar() as conn:
+            linha = conn.execute("SELECT shard FROM usuarios WHERE id = ?", (usuario_id,)).fetchone()
+            shard = linha[0] if linha else None
             
+            if linha and shard is None and self.num_shards:
+                conn.execute("""
+                    UPDATE usuarios SET shard = ?1
+                    WHERE id = ?2 AND shard IS NULL
+                      AND NOT EXISTS (SELECT 1 FROM orcamentos WHERE usuario_id = ?2)
+                """, (nome_shard_hash(usuario_id, self.num_shards, self.pasta_shards), usuario_id))
+                # Outro processo pode ter atribuído antes: vale o que ficou gravado
+                shard = conn.execute("SELECT shard FROM usuarios WHERE id = ?", (usuario_id,)).fetchone()[0]
+            conn.commit()
+        
+        caminho = resolver_shard(self.db_path, shard)
+        if shard:
+            self._inicializar_banco(caminho)
+        if linha:
+            self._shards[usuario_id] = caminho
+        return caminho
+    
+    def _shards_existentes(self) -> List[str]:
+        """Todos os arquivos com orçamentos: o banco central e os shards do diretório"""
+        
+        with self._conectar() as conn:
+            caminhos = arquivos_orcamentos(conn, self.db_path)
             conn.commit()
+        
+        return caminhos
+    
+    def fechar(self):
+        """Grava o que estiver na fila e fecha todas as conexões do pool"""
+        
+        if self._gravador is not None:
+            self._gravador.fechar()
+            self._gravador = None
+        
+        with self._lock_conexoes:
+            conexoes, self._conexoes = self._conexoes, set()
+        
+        for conn in conexoes:
+            try:
+                conn.close()
+            except Exception as e:
+                print(f"Erro ao fechar conexão: {e}")
+        
+        self._local = threading.local()
+    
+    def _inicializar_banco(self, caminho: Optional[str] = None):
+        """Migrações (e usuários demo, no banco central) uma única vez por banco em cada processo"""
+        
+        caminho = caminho or self.db_path
+        chave = os.path.abspath(caminho)
+        if chave in _bancos_inicializados:
+            return
+        
+        with _lock_inicializacao:
+            if chave in _bancos_inicializados:
+                return
+            
+            if caminho != self.db_path:
+                os.makedirs(os.path.dirname(chave), exist_ok=True)
+            
+            with self._conectar(caminho) as conn:
+                aplicar_migracoes(conn)
+            if caminho == self.db_path:
+                self._criar_usuarios_demo()
+            
+            _bancos_inicializados.add(chave)
     
     def _criar_usuarios_demo(self):
         """Cria usuários demo se não existirem"""
@@ -76,50 +268,65 @@ class AuthManager:
                 'email': 'demo@orcainteriores.com',
                 'senha': 'demo123',
                 'plano': 'profissional',
-                'limite': 50
+                'limite': LIMITES_PLANOS['profissional']
             },
             {
                 'email': 'arquiteto@teste.com',
                 'senha': 'arq123',
                 'plano': 'basico',
-                'limite': 10
+                'limite': LIMITES_PLANOS['basico']
             },
             {
                 'email': 'marceneiro@teste.com',
                 'senha': 'marc123',
                 'plano': 'empresarial',
-                'limite': 999999
+                'limite': LIMITES_PLANOS['empresarial']
             }
         ]
         
-        for usuario in usuarios_demo:
-            if not self._usuario_existe(usuario['email']):
-                self._criar_usuario_interno(
-                    usuario['email'],
-                    usuario['senha'],
-                    usuario['plano'],
-                    usuario['limite']
-                )
+        # Um único INSERT em lote; e-mail é UNIQUE, então os existentes ficam como estão.
+        # O hash (caro) só é calculado para quem ainda não existe
+        try:
+            with self._conectar() as conn:
+                emails = [usuario['email'] for usuario in usuarios_demo]
+                existentes = {linha[0] for linha in conn.execute(
+                    f"SELECT email FROM usuarios WHERE email IN ({', '.join('?' * len(emails))})", emails
+                )}
+                novos = [usuario for usuario in usuarios_demo if usuario['email'] not in existentes]
+                hashes = [self.senhas.gerar_hash_async(usuario['senha']) for usuario in novos]
+                
+                conn.executemany("""
+                    INSERT OR IGNORE INTO usuarios (email, senha_hash, plano, limite_orcamentos)
+                    VALUES (?, ?, ?, ?)
+                """, [
+                    (usuario['email'], senha_hash.result(), usuario['plano'], usuario['limite'])
+                    for usuario, senha_hash in zip(novos, hashes)
+                ])
+                conn.commit()
+        
+        except Exception as e:
+            print(f"Erro ao criar usuários demo: {e}")
     
     def _hash_senha(self, senha: str) -> str:
-        """Gera hash da senha"""
-        return hashlib.sha256(senha.encode()).hexdigest()
+        """Gera hash da senha (KDF com sal, no pool do serviço de senhas)"""
+        return self.senhas.gerar_hash(senha)
     
     def _usuario_existe(self, email: str) -> bool:
         """Verifica se usuário já existe"""
         
-        with sqlite3.connect(self.db_path) as conn:
+        with self._conectar() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT id FROM usuarios WHERE email = ?", (email,))
             return cursor.fetchone() is not None
     
-    def _criar_usuario_interno(self, email: str, senha: str, plano: str = 'basico', limite: int = 10) -> bool:
+    def _criar_usuario_interno(self, email: str, senha: str, plano: str = 'basico',
+                               limite: int = LIMITES_PLANOS['basico']) -> bool:
         """Cria usuário interno (sem validações)"""
         
         try:
             senha_hash = self._hash_senha(senha)
             
-            with sqlite3.connect(self.db_path) as conn:
+            with self._conectar() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
                     INSERT INTO usuarios (email, senha_hash, plano, limite_orcamentos)
@@ -127,7 +334,7 @@ class AuthManager:
                 """, (email, senha_hash, plano, limite))
                 conn.commit()
                 return True
-                
+        
         except Exception as e:
             print(f"Erro ao criar usuário interno: {e}")
             return False
@@ -147,16 +354,10 @@ class AuthManager:
                 return False
             
             # Definir limite baseado no plano
-            limites = {
-                'basico': 10,
-                'profissional': 50,
-                'empresarial': 999999
-            }
-            
-            limite = limites.get(plano, 10)
+            limite = LIMITES_PLANOS.get(plano, LIMITES_PLANOS['basico'])
             
             return self._criar_usuario_interno(email, senha, plano, limite)
-            
+        
         except Exception as e:
             print(f"Erro ao criar usuário: {e}")
             return False
@@ -168,62 +369,356 @@ class AuthManager:
             if not email or not senha:
                 return None
             
-            senha_hash = self._hash_senha(senha)
-            
-            with sqlite3.connect(self.db_path) as conn:
+            geracao = self._geracao_planos
+            with self._conectar() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
-                    SELECT id, email, plano, orcamentos_mes, limite_orcamentos, ativo
+                    SELECT id, email, plano,
+                           CASE WHEN periodo_uso = ? THEN orcamentos_mes ELSE 0 END,
+                           limite_orcamentos, ativo, senha_hash
                     FROM usuarios 
-                    WHERE email = ? AND senha_hash = ? AND ativo = 1
-                """, (email, senha_hash))
+                    WHERE email = ? AND ativo = 1
+                """, (periodo_cobranca(), email))
                 
                 resultado = cursor.fetchone()
+                conn.commit()
+            
+            # KDF fora de qualquer transação; e-mail inexistente também paga o KDF
+            senha_hash = resultado[6] if resultado else None
+            if not self.senhas.verificar(senha, senha_hash):
+                return None
+            
+            # Hash legado (SHA-256) ou de custo antigo: regravar com o atual
+            novo_hash = self._hash_senha(senha) if self.senhas.precisa_atualizar(senha_hash) else None
+            
+            with self._conectar() as conn:
+                cursor = conn.cursor()
                 
-                if resultado:
-                    # Atualizar último login
-                    cursor.execute("""
-                        UPDATE usuarios 
-                        SET data_ultimo_login = CURRENT_TIMESTAMP 
-                        WHERE id = ?
-                    """, (resultado[0],))
-                    conn.commit()
-                    
-                    return {
-                        'id': resultado[0],
-                        'email': resultado[1],
-                        'plano': resultado[2],
-                        'orcamentos_mes': resultado[3],
-                        'limite_orcamentos': resultado[4],
-                        'ativo': resultado[5]
-                    }
+                # Atualizar último login
+                cursor.execute("""
+                    UPDATE usuarios 
+                    SET data_ultimo_login = CURRENT_TIMESTAMP 
+                    WHERE id = ?
+                """, (resultado[0],))
                 
-                return None
+                # Só se ninguém trocou a senha nesse meio tempo
+                if novo_hash:
+                    cursor.execute("""
+                        UPDATE usuarios SET senha_hash = ? WHERE id = ? AND senha_hash = ?
+                    """, (novo_hash, resultado[0], senha_hash))
                 
+                conn.commit()
+            
+            self._guardar_plano(resultado[0], resultado[2], resultado[4], geracao)
+            
+            return {
+                'id': resultado[0],
+                'email': resultado[1],
+                'plano': resultado[2],
+                'orcamentos_mes': resultado[3],
+                'limite_orcamentos': resultado[4],
+                'ativo': resultado[5]
+            }
+        
         except Exception as e:
             print(f"Erro no login: {e}")
             return None
     
+    def criar_sessao(self, usuario: Dict) -> Optional[str]:
+        """Emite um token de sessão para o usuário (retornado por fazer_login)"""
+        
+        try:
+            token = secrets.token_urlsafe(32)
+            expira_em = datetime.now(timezone.utc) + DURACAO_SESSAO
+            
+            with self._conectar() as conn:
+                conn.execute("""
+                    INSERT INTO sessoes (usuario_id, token, data_expiracao)
+                    VALUES (?, ?, ?)
+                """, (usuario['id'], token, expira_em.strftime('%Y-%m-%d %H:%M:%S')))
+                conn.commit()
+            
+            self._guardar_sessao(token, usuario, expira_em.timestamp())
+            
+            if time.monotonic() - self._ultima_limpeza_sessoes > INTERVALO_LIMPEZA_SESSOES:
+                self.limpar_sessoes_expiradas()
+            
+            return token
+        
+        except Exception as e:
+            print(f"Erro ao criar sessão: {e}")
+            return None
+    
+    def renovar_sessao(self, token: str) -> Optional[Tuple[Dict, str]]:
+        """Troca um token válido por um novo: (usuário, token novo), ou None
+        
+        O token antigo é encerrado. Usado ao restaurar a sessão pela URL: um
+        link que vazou (histórico do navegador, link compartilhado, Referer)
+        deixa de valer quando o dono volta a abrir o app.
+        """
+        
+        usuario = self.validar_sessao(token)
+        if not usuario:
+            return None
+        
+        novo_token = self.criar_sessao(usuario)
+        if not novo_token:
+            return None
+        
+        self.encerrar_sessao(token)
+        return usuario, novo_token
+    
+    def validar_sessao(self, token: str) -> Optional[Dict]:
+        """Usuário dono do token, ou None se inválido/expirado
+        
+        Tokens vistos há menos de TTL_CACHE_SESSAO segundos são validados
+        só pelo cache em memória, sem consultar o banco.
+        """
+        
+        if not token:
+            return None
+        
+        self._verificar_versao_planos()
+        
+        agora = time.time()
+        with self._lock_sessoes:
+            entrada = self._cache_sessoes.get(token)
+            if entrada:
+                usuario, expira_em, valido_ate = entrada
+                if agora < expira_em and time.monotonic() < valido_ate:
+                    self._cache_sessoes.move_to_end(token)
+                    return dict(usuario)
+                del self._cache_sessoes[token]
+        
+        try:
+            geracao = self._geracao_planos
+            with self._conectar() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT u.id, u.email, u.plano,
+                           CASE WHEN u.periodo_uso = ? THEN u.orcamentos_mes ELSE 0 END,
+                           u.limite_orcamentos, u.ativo, s.data_expiracao
+                    FROM sessoes s
+                    JOIN usuarios u ON u.id = s.usuario_id
+                    WHERE s.token = ? AND s.ativo = 1 AND u.ativo = 1
+                      AND s.data_expiracao > datetime('now')
+                """, (periodo_cobranca(), token))
+                
+                resultado = cursor.fetchone()
+                
+                if not resultado:
+                    return None
+                
+                usuario = {
+                    'id': resultado[0],
+                    'email': resultado[1],
+                    'plano': resultado[2],
+                    'orcamentos_mes': resultado[3],
+                    'limite_orcamentos': resultado[4],
+                    'ativo': resultado[5]
+                }
+                expira_em = datetime.strptime(resultado[6], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+            
+            self._guardar_sessao(token, usuario, expira_em.timestamp())
+            self._guardar_plano(usuario['id'], usuario['plano'], usuario['limite_orcamentos'], geracao)
+            return usuario
+        
+        except Exception as e:
+            print(f"Erro ao validar sessão: {e}")
+            return None
+    
+    def encerrar_sessao(self, token: str) -> bool:
+        """Logout: invalida o token no cache e no banco"""
+        
+        with self._lock_sessoes:
+            self._cache_sessoes.pop(token, None)
+        
+        try:
+            with self._conectar() as conn:
+                # Vencida agora: a próxima limpeza em lote remove a linha
+                conn.execute("""
+                    UPDATE sessoes 
+                    SET ativo = 0, data_expiracao = datetime('now')
+                    WHERE token = ?
+                """, (token,))
+                conn.commit()
+                return True
+        
+        except Exception as e:
+            print(f"Erro ao encerrar sessão: {e}")
+            return False
+    
+    def limpar_sessoes_expiradas(self) -> int:
+        """Remove em lote as sessões vencidas (faixa do índice de expiração)"""
+        
+        self._ultima_limpeza_sessoes = time.monotonic()
+        
+        agora = time.time()
+        with self._lock_sessoes:
+            for token in [t for t, entrada in self._cache_sessoes.items() if entrada[1] <= agora]:
+                del self._cache_sessoes[token]
+        
+        try:
+            with self._conectar() as conn:
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM sessoes WHERE data_expiracao <= datetime('now')")
+                conn.commit()
+                return cursor.rowcount
+        
+        except Exception as e:
+            print(f"Erro ao limpar sessões: {e}")
+            return 0
+    
+    def _esquecer_sessoes_usuario(self, usuario_id: int):
+        """Tira do cache as sessões de um usuário cujos dados mudaram"""
+        
+        with self._lock_sessoes:
+            for token in [t for t, entrada in self._cache_sessoes.items() if entrada[0]['id'] == usuario_id]:
+                del self._cache_sessoes[token]
+    
+    def _guardar_sessao(self, token: str, usuario: Dict, expira_em: float):
+        """Coloca a sessão no cache LRU
+        
+        Guarda uma cópia (e validar_sessao devolve cópias): quem altera o
+        dicionário recebido não muda o usuário visto pelas outras abas.
+        """
+        
+        with self._lock_sessoes:
+            self._cache_sessoes[token] = (dict(usuario), expira_em, time.monotonic() + TTL_CACHE_SESSAO)
+            self._cache_sessoes.move_to_end(token)
+            while len(self._cache_sessoes) > TAMANHO_CACHE_SESSOES:
+                self._cache_sessoes.popitem(last=False)
+    
+    def obter_plano(self, usuario_id: int) -> Optional[Dict]:
+        """Plano e limite mensal do usuário ({'plano', 'limite_orcamentos'})
+        
+        Lido do cache em memória (LRU, até TTL_CACHE_PLANOS segundos); na
+        falta, do banco, e guardado. None se o usuário não existe.
+        """
+        
+        self._verificar_versao_planos()
+        
+        with self._lock_planos:
+            entrada = self._cache_planos.get(usuario_id)
+            if entrada and time.monotonic() < entrada[2]:
+                self._cache_planos.move_to_end(usuario_id)
+                self._metricas_planos['acertos'] += 1
+                return {'plano': entrada[0], 'limite_orcamentos': entrada[1]}
+            
+            self._metricas_planos['faltas'] += 1
+            geracao = self._geracao_planos
+        
+        try:
+            with self._conectar() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT plano, limite_orcamentos FROM usuarios WHERE id = ?", (usuario_id,))
+                resultado = cursor.fetchone()
+                conn.commit()
+            
+            if not resultado:
+                return None
+            
+            self._guardar_plano(usuario_id, resultado[0], resultado[1], geracao)
+            return {'plano': resultado[0], 'limite_orcamentos': resultado[1]}
+        
+        except Exception as e:
+            print(f"Erro ao obter plano: {e}")
+            return None
+    
+    def obter_metricas_cache_planos(self) -> Dict:
+        """Acertos, faltas, invalidações, entradas e taxa de acerto do cache de planos"""
+        
+        with self._lock_planos:
+            metricas = dict(self._metricas_planos, entradas=len(self._cache_planos))
+        
+        consultas = metricas['acertos'] + metricas['faltas']
+        metricas['taxa_acerto'] = round(metricas['acertos'] / consultas, 3) if consultas else 0.0
+        return metricas
+    
+    def _guardar_plano(self, usuario_id: int, plano: str, limite: int, geracao: int):
+        """Coloca o plano no cache LRU, se nada foi invalidado desde a leitura"""
+        
+        with self._lock_planos:
+            if geracao != self._geracao_planos:
+                return
+            
+            self._cache_planos[usuario_id] = (plano, limite, time.monotonic() + TTL_CACHE_PLANOS)
+            self._cache_planos.move_to_end(usuario_id)
+            while len(self._cache_planos) > TAMANHO_CACHE_PLANOS:
+                self._cache_planos.popitem(last=False)
+    
+    def _esquecer_planos(self, usuario_ids: Iterable[int]):
+        """Tira do cache os planos e as sessões de usuários cujo plano mudou"""
+        
+        usuario_ids = set(usuario_ids)
+        with self._lock_planos:
+            self._geracao_planos += 1
+            for usuario_id in usuario_ids:
+                self._cache_planos.pop(usuario_id, None)
+            self._metricas_planos['invalidacoes'] += len(usuario_ids)
+        
+        for usuario_id in usuario_ids:
+            self._esquecer_sessoes_usuario(usuario_id)
+    
+    def _verificar_versao_planos(self):
+        """Descarta planos trocados por outros processos (versão em alteracoes_planos)
+        
+        Consulta o banco no máximo uma vez a cada INTERVALO_VERSAO_PLANOS.
+        """
+        
+        agora = time.monotonic()
+        with self._lock_planos:
+            if agora < self._proxima_versao_planos:
+                return
+            self._proxima_versao_planos = agora + INTERVALO_VERSAO_PLANOS
+            versao = self._versao_planos
+        
+        try:
+            with self._conectar() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT versao, usuario_id FROM alteracoes_planos
+                    WHERE versao > ? ORDER BY versao
+                """, (versao,))
+                alteracoes = cursor.fetchall()
+                conn.commit()
+        
+        except Exception as e:
+            print(f"Erro ao verificar versão dos planos: {e}")
+            return
+        
+        if alteracoes:
+            with self._lock_planos:
+                self._versao_planos = max(self._versao_planos, alteracoes[-1][0])
+            self._esquecer_planos(usuario_id for _, usuario_id in alteracoes)
+    
     def verificar_limite_orcamentos(self, usuario_id: int) -> bool:
-        """Verifica se usuário pode fazer mais orçamentos"""
+        """Verifica se usuário pode fazer mais orçamentos
+        
+        O limite vem do cache de planos; o contador do mês (muda a cada
+        orçamento) é sempre lido do banco.
+        """
         
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            plano = self.obter_plano(usuario_id)
+            if plano is None:
+                return False
+            
+            with self._conectar() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
-                    SELECT orcamentos_mes, limite_orcamentos 
+                    SELECT CASE WHEN periodo_uso = ? THEN orcamentos_mes ELSE 0 END
                     FROM usuarios 
                     WHERE id = ?
-                """, (usuario_id,))
+                """, (periodo_cobranca(), usuario_id))
                 
                 resultado = cursor.fetchone()
                 
                 if resultado:
-                    orcamentos_mes, limite = resultado
-                    return orcamentos_mes < limite
+                    return resultado[0] < plano['limite_orcamentos']
                 
                 return False
-                
+        
         except Exception as e:
             print(f"Erro ao verificar limite: {e}")
             return False
@@ -232,49 +727,249 @@ class AuthManager:
         """Incrementa contador de orçamentos do usuário"""
         
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._conectar() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
                     UPDATE usuarios 
-                    SET orcamentos_mes = orcamentos_mes + 1 
-                    WHERE id = ?
-                """, (usuario_id,))
+                    SET orcamentos_mes = CASE WHEN periodo_uso = ?1 THEN orcamentos_mes + 1 ELSE 1 END,
+                        periodo_uso = ?1
+                    WHERE id = ?2
+                """, (periodo_cobranca(), usuario_id))
                 conn.commit()
                 return True
-                
+        
         except Exception as e:
             print(f"Erro ao incrementar orçamentos: {e}")
             return False
     
     def salvar_orcamento(self, usuario_id: int, nome_arquivo: str, 
                         valor_final: float, area_total: float, dados_json: str) -> bool:
-        """Salva orçamento no histórico"""
+        """Salva orçamento no histórico (JSON legado; gravado no formato binário)"""
         
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    INSERT INTO orcamentos (usuario_id, nome_arquivo, valor_final, area_total, dados_json)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (usuario_id, nome_arquivo, valor_final, area_total, dados_json))
+            linha = self._linha_orcamento(usuario_id, nome_arquivo, json.loads(dados_json))
+            linha = (usuario_id, nome_arquivo, valor_final, area_total) + linha[4:]
+            
+            with self._conectar(self._shard_usuario(usuario_id)) as conn:
+                self._inserir_orcamento(conn.cursor(), linha)
                 conn.commit()
                 return True
-                
+        
         except Exception as e:
             print(f"Erro ao salvar orçamento: {e}")
             return False
     
+    def consumir_orcamento(self, usuario_id: int) -> Optional[int]:
+        """Consome um orçamento da cota do mês, se houver; retorna quantos restam
+        
+        Verificação e incremento num único UPDATE condicional: duas análises
+        simultâneas nunca passam juntas do limite. COTA_ESGOTADA = limite
+        atingido; None = erro (nada foi consumido).
+        """
+        
+        try:
+            with self._conectar() as conn:
+                restantes = self._consumir_cota(conn.cursor(), usuario_id)
+                conn.commit()
+                return COTA_ESGOTADA if restantes is None else restantes
+        
+        except Exception as e:
+            print(f"Erro ao consumir orçamento: {e}")
+            return None
+    
+    def registrar_orcamento(self, usuario_id: int, nome_arquivo: str, orcamento: Dict) -> Optional[Dict]:
+        """Consome a cota e salva o orçamento numa única transação
+        
+        Retorna {'salvo', 'orcamento_id', 'restantes'}; 'salvo' é False se o
+        limite do mês já foi atingido (nada é gravado). None em caso de erro.
+        Com o orçamento num shard (outro arquivo), a cota é confirmada antes
+        e devolvida se a gravação no shard falhar.
+        """
+        
+        try:
+            # Serializar antes de abrir a transação (lock de escrita mais curto)
+            linha = self._linha_orcamento(usuario_id, nome_arquivo, orcamento)
+            conn_shard = self._conectar(self._shard_usuario(usuario_id))
+            
+            with self._conectar() as conn:
+                cursor = conn.cursor()
+                
+                restantes = self._consumir_cota(cursor, usuario_id)
+                if restantes is None:
+                    conn.rollback()
+                    return {'salvo': False, 'orcamento_id': None, 'restantes': 0}
+                
+                if conn_shard is conn:
+                    orcamento_id = self._inserir_orcamento(cursor, linha)
+                    conn.commit()
+                    return {'salvo': True, 'orcamento_id': orcamento_id, 'restantes': restantes}
+                
+                conn.commit()
+            
+            try:
+                with conn_shard:
+                    orcamento_id = self._inserir_orcamento(conn_shard.cursor(), linha)
+                    conn_shard.commit()
+            except Exception:
+                self._devolver_cota(usuario_id)
+                raise
+            
+            return {'salvo': True, 'orcamento_id': orcamento_id, 'restantes': restantes}
+        
+        except Exception as e:
+            print(f"Erro ao registrar orçamento: {e}")
+            return None
+    
+    def salvar_orcamento_completo(self, usuario_id: int, nome_arquivo: str, orcamento: Dict) -> Optional[int]:
+        """Salva orçamento no histórico no formato binário compacto"""
+        
+        try:
+            linha = self._linha_orcamento(usuario_id, nome_arquivo, orcamento)
+            
+            with self._conectar(self._shard_usuario(usuario_id)) as conn:
+                orcamento_id = self._inserir_orcamento(conn.cursor(), linha)
+                conn.commit()
+                return orcamento_id
+        
+        except Exception as e:
+            print(f"Erro ao salvar orçamento: {e}")
+            return None
+    
+    def enfileirar_orcamento(self, usuario_id: int, nome_arquivo: str, orcamento: Dict) -> bool:
+        """Salva o orçamento em segundo plano (write-behind, commit em grupo)
+        
+        Retorna assim que o orçamento entra na fila. A cota não passa por
+        aqui: consuma-a antes com consumir_orcamento (síncrono e atômico).
+        """
+        
+        if self._gravador is None:
+            with self._lock_gravador:
+                if self._gravador is None:
+                    self._gravador = GravadorOrcamentos(self)
+        
+        return self._gravador.enfileirar(usuario_id, nome_arquivo, orcamento)
+    
+    def _consumir_cota(self, cursor: sqlite3.Cursor, usuario_id: int) -> Optional[int]:
+        """UPDATE condicional da cota; None se o limite já foi atingido"""
+        
+        # Primeira ação num período novo: o contador recomeça (reset preguiçoso)
+        cursor.execute("""
+            UPDATE usuarios 
+            SET orcamentos_mes = CASE WHEN periodo_uso = ?1 THEN orcamentos_mes + 1 ELSE 1 END,
+                periodo_uso = ?1
+            WHERE id = ?2
+              AND CASE WHEN periodo_uso = ?1 THEN orcamentos_mes ELSE 0 END < limite_orcamentos
+            RETURNING limite_orcamentos - orcamentos_mes
+        """, (periodo_cobranca(), usuario_id))
+        
+        # fetchall: o UPDATE com RETURNING só termina ao esgotar o cursor
+        resultado = cursor.fetchall()
+        return resultado[0][0] if resultado else None
+    
+    def _devolver_cota(self, usuario_id: int):
+        """Desfaz um consumo de cota do período atual (gravação no shard falhou)
+        
+        O gatilho trg_uso_periodo só soma; o uso do período é descontado aqui,
+        na mesma transação.
+        """
+        
+        periodo = periodo_cobranca()
+        with self._conectar() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE usuarios SET orcamentos_mes = orcamentos_mes - 1
+                WHERE id = ? AND periodo_uso = ? AND orcamentos_mes > 0
+            """, (usuario_id, periodo))
+            
+            if cursor.rowcount:
+                cursor.execute("""
+                    UPDATE uso_periodo SET orcamentos = orcamentos - 1
+                    WHERE usuario_id = ? AND periodo = ? AND orcamentos > 0
+                """, (usuario_id, periodo))
+            conn.commit()
+    
+    def _linha_orcamento(self, usuario_id: int, nome_arquivo: str, orcamento: Dict) -> tuple:
+        """Valores da linha de orcamentos + payload binário, seu hash e textos de busca
+        
+        O payload é o canônico (sem timestamp): orçar de novo o mesmo projeto
+        reaproveita o blob. obter_orcamento repõe o timestamp pela data_criacao.
+        """
+        
+        resumo = orcamento.get('resumo', {})
+        dados = serializar_orcamento(orcamento_canonico(orcamento))
+        return (usuario_id, nome_arquivo, resumo.get('valor_final'), resumo.get('area_total_m2'),
+                hash_conteudo(dados), dados) + textos_busca(orcamento)
+    
+    def _inserir_orcamento(self, cursor: sqlite3.Cursor, linha: tuple) -> int:
+        """INSERT de uma linha montada por _linha_orcamento; retorna o id
+        
+        O payload vai para blobs_orcamento pelo hash: se já existe um idêntico,
+        nada é regravado e a linha só aponta para ele. Nome do arquivo, nomes
+        e tipos dos componentes entram no índice de busca.
+        """
+        
+        cursor.execute("INSERT OR IGNORE INTO blobs_orcamento (hash, dados) VALUES (?, ?)", linha[4:6])
+        cursor.execute("""
+            INSERT INTO orcamentos (usuario_id, nome_arquivo, valor_final, area_total, dados_hash)
+            VALUES (?, ?, ?, ?, ?)
+        """, linha[:5])
+        orcamento_id = cursor.lastrowid
+        
+        # Índice de busca atualizado na mesma transação
+        cursor.execute("""
+            INSERT INTO busca_orcamentos (rowid, nome_arquivo, componentes, tipos, usuario)
+            VALUES (?, ?, ?, ?, ?)
+        """, (orcamento_id, linha[1] or '', linha[6], linha[7], token_usuario(linha[0])))
+        return orcamento_id
+    
+    def _inserir_orcamentos(self, cursor: sqlite3.Cursor, linhas: List[tuple]):
+        """Versão em lote de _inserir_orcamento (commit em grupo do gravador)"""
+        
+        for linha in linhas:
+            self._inserir_orcamento(cursor, linha)
+    
+    def obter_orcamento(self, orcamento_id: int, usuario_id: int) -> Optional[Dict]:
+        """Carrega um orçamento salvo (único ponto que lê o payload)"""
+        
+        try:
+            with self._conectar(self._shard_usuario(usuario_id)) as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT COALESCE(b.dados, o.dados_bin, o.dados_json), o.data_criacao
+                    FROM orcamentos o
+                    LEFT JOIN blobs_orcamento b ON b.hash = o.dados_hash
+                    WHERE o.id = ? AND o.usuario_id = ?
+                """, (orcamento_id, usuario_id))
+                
+                resultado = cursor.fetchone()
+                
+                if not resultado or not resultado[0]:
+                    return None
+                
+                orcamento = desserializar_orcamento(resultado[0])
+                
+                # Payload canônico: o momento do orçamento é o da gravação (UTC)
+                if 'timestamp' not in orcamento and resultado[1]:
+                    momento = datetime.fromisoformat(resultado[1]).replace(tzinfo=timezone.utc)
+                    orcamento['timestamp'] = momento.isoformat()
+                
+                return orcamento
+        
+        except Exception as e:
+            print(f"Erro ao carregar orçamento: {e}")
+            return None
+    
     def obter_historico_orcamentos(self, usuario_id: int, limite: int = 10) -> list:
         """Obtém histórico de orçamentos do usuário"""
         
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._conectar(self._shard_usuario(usuario_id)) as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
-                    SELECT nome_arquivo, valor_final, area_total, data_criacao
+                    SELECT id, nome_arquivo, valor_final, area_total, data_criacao
                     FROM orcamentos 
                     WHERE usuario_id = ?
-                    ORDER BY data_criacao DESC
+                    ORDER BY data_criacao DESC, id DESC
                     LIMIT ?
                 """, (usuario_id, limite))
                 
@@ -283,109 +978,480 @@ class AuthManager:
                 historico = []
                 for resultado in resultados:
                     historico.append({
-                        'nome_arquivo': resultado[0],
-                        'valor_final': resultado[1],
-                        'area_total': resultado[2],
-                        'data_criacao': resultado[3]
+                        'id': resultado[0],
+                        'nome_arquivo': resultado[1],
+                        'valor_final': resultado[2],
+                        'area_total': resultado[3],
+                        'data_criacao': resultado[4]
                     })
                 
                 return historico
-                
+        
         except Exception as e:
             print(f"Erro ao obter histórico: {e}")
             return []
     
-    def obter_estatisticas_usuario(self, usuario_id: int) -> Dict:
-        """Obtém estatísticas do usuário"""
+    def obter_pagina_historico(self, usuario_id: int, tamanho_pagina: int = 20,
+                               cursor_pagina: Optional[Tuple[str, int]] = None) -> Dict:
+        """Uma página do histórico, do mais recente para o mais antigo
+        
+        Paginação por chave (keyset): cursor_pagina é o 'proximo_cursor' da
+        página anterior, a posição (data_criacao, id) do último item. A
+        consulta continua de onde parou no índice (usuario_id, data_criacao),
+        então qualquer página custa o mesmo, sem OFFSET.
+        """
         
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._conectar(self._shard_usuario(usuario_id)) as conn:
                 cursor = conn.cursor()
                 
-                # Dados do usuário
+                if cursor_pagina:
+                    cursor.execute("""
+                        SELECT id, nome_arquivo, valor_final, area_total, data_criacao
+                        FROM orcamentos 
+                        WHERE usuario_id = ? AND (data_criacao, id) < (?, ?)
+                        ORDER BY data_criacao DESC, id DESC
+                        LIMIT ?
+                    """, (usuario_id, cursor_pagina[0], cursor_pagina[1], tamanho_pagina + 1))
+                else:
+                    cursor.execute("""
+                        SELECT id, nome_arquivo, valor_final, area_total, data_criacao
+                        FROM orcamentos 
+                        WHERE usuario_id = ?
+                        ORDER BY data_criacao DESC, id DESC
+                        LIMIT ?
+                    """, (usuario_id, tamanho_pagina + 1))
+                
+                resultados = cursor.fetchall()
+                
+                # Uma linha a mais só para saber se existe próxima página
+                tem_mais = len(resultados) > tamanho_pagina
+                resultados = resultados[:tamanho_pagina]
+                
+                itens = [
+                    {
+                        'id': resultado[0],
+                        'nome_arquivo': resultado[1],
+                        'valor_final': resultado[2],
+                        'area_total': resultado[3],
+                        'data_criacao': resultado[4]
+                    }
+                    for resultado in resultados
+                ]
+                
+                return {
+                    'itens': itens,
+                    'proximo_cursor': (resultados[-1][4], resultados[-1][0]) if tem_mais else None
+                }
+        
+        except Exception as e:
+            print(f"Erro ao obter página do histórico: {e}")
+            return {'itens': [], 'proximo_cursor': None}
+    
+    def buscar_orcamentos(self, usuario_id: int, texto: str, pagina: int = 1,
+                          tamanho_pagina: int = 20) -> Dict:
+        """Busca no histórico por nome do arquivo, nomes e tipos de componentes
+        
+        Todos os termos precisam aparecer, sem diferenciar acentos; o último
+        vale como prefixo ("cozinha despens" acha "despenseiro"); resultados ordenados por
+        relevância (bm25). Paginação por número de página: o FTS5 já ordena
+        todos os resultados, então OFFSET não encarece as páginas seguintes.
+        """
+        
+        vazio = {'itens': [], 'pagina': pagina, 'tem_mais': False}
+        consulta = consulta_fts(texto, usuario_id)
+        if consulta is None:
+            return vazio
+        
+        try:
+            with self._conectar(self._shard_usuario(usuario_id)) as conn:
+                cursor = conn.cursor()
                 cursor.execute("""
-                    SELECT email, plano, orcamentos_mes, limite_orcamentos, data_criacao
-                    FROM usuarios 
-                    WHERE id = ?
-                """, (usuario_id,))
+                    SELECT o.id, o.nome_arquivo, o.valor_final, o.area_total, o.data_criacao,
+                           snippet(busca_orcamentos, 1, '[', ']', '…', 8)
+                    FROM busca_orcamentos b
+                    JOIN orcamentos o ON o.id = b.rowid
+                    WHERE busca_orcamentos MATCH ?
+                    ORDER BY b.rank
+                    LIMIT ? OFFSET ?
+                """, (consulta, tamanho_pagina + 1, (max(pagina, 1) - 1) * tamanho_pagina))
                 
-                usuario = cursor.fetchone()
+                resultados = cursor.fetchall()
                 
-                if not usuario:
-                    return {}
+                itens = [
+                    {
+                        'id': resultado[0],
+                        'nome_arquivo': resultado[1],
+                        'valor_final': resultado[2],
+                        'area_total': resultado[3],
+                        'data_criacao': resultado[4],
+                        'trecho': resultado[5]
+                    }
+                    for resultado in resultados[:tamanho_pagina]
+                ]
                 
-                # Estatísticas de orçamentos
+                return {'itens': itens, 'pagina': pagina, 'tem_mais': len(resultados) > tamanho_pagina}
+        
+        except Exception as e:
+            print(f"Erro ao buscar orçamentos: {e}")
+            return vazio
+    
+    def obter_uso_periodos(self, usuario_id: int, limite: int = 12) -> List[Dict]:
+        """Orçamentos consumidos por período de cobrança, do mais recente ao mais antigo"""
+        
+        try:
+            with self._conectar() as conn:
+                cursor = conn.cursor()
                 cursor.execute("""
-                    SELECT 
-                        COUNT(*) as total_orcamentos,
-                        AVG(valor_final) as valor_medio,
-                        SUM(area_total) as area_total,
-                        MAX(data_criacao) as ultimo_orcamento
-                    FROM orcamentos 
+                    SELECT periodo, orcamentos
+                    FROM uso_periodo 
                     WHERE usuario_id = ?
-                """, (usuario_id,))
+                    ORDER BY periodo DESC
+                    LIMIT ?
+                """, (usuario_id, limite))
                 
-                stats = cursor.fetchone()
+                return [{'periodo': periodo, 'orcamentos': orcamentos} for periodo, orcamentos in cursor.fetchall()]
+        
+        except Exception as e:
+            print(f"Erro ao obter uso por período: {e}")
+            return []
+    
+    def reconstruir_estatisticas(self) -> bool:
+        """Recalcula a tabela estatisticas_usuario a partir dos orçamentos (reparo, em todos os shards)"""
+        
+        try:
+            for caminho in self._shards_existentes():
+                with self._conectar(caminho) as conn:
+                    reconstruir_estatisticas(conn.cursor())
+                    conn.commit()
+            return True
+        
+        except Exception as e:
+            print(f"Erro ao reconstruir estatísticas: {e}")
+            return False
+    
+    def obter_estatisticas_usuario(self, usuario_id: int) -> Dict:
+        """Obtém estatísticas do usuário"""
+        
+        try:
+            with self._conectar() as conn:
+                cursor = conn.cursor()
                 
-                return {
-                    'email': usuario[0],
-                    'plano': usuario[1],
-                    'orcamentos_mes': usuario[2],
-                    'limite_orcamentos': usuario[3],
-                    'data_criacao': usuario[4],
-                    'total_orcamentos': stats[0] if stats[0] else 0,
-                    'valor_medio': stats[1] if stats[1] else 0,
-                    'area_total': stats[2] if stats[2] else 0,
-                    'ultimo_orcamento': stats[3] if stats[3] else None
-                }
+                # Dados do usuário no banco central
+                cursor.execute("""
+                    SELECT email, plano,
+                           CASE WHEN periodo_uso = ? THEN orcamentos_mes ELSE 0 END,
+                           limite_orcamentos, data_criacao
+                    FROM usuarios
+                    WHERE id = ?
+                """, (periodo_cobranca(), usuario_id))
                 
+                usuario = cursor.fetchone()
+                conn.commit()
+            
+            if not usuario:
+                return {}
+            
+            # Estatísticas materializadas (O(1)) no arquivo dos orçamentos do usuário
+            with self._conectar(self._shard_usuario(usuario_id)) as conn:
+                stats = conn.execute("""
+                    SELECT total_orcamentos, soma_valor / NULLIF(qtd_valor, 0), soma_area, ultimo_orcamento
+                    FROM estatisticas_usuario
+                    WHERE usuario_id = ?
+                """, (usuario_id,)).fetchone() or (None, None, None, None)
+                conn.commit()
+            
+            return {
+                'email': usuario[0],
+                'plano': usuario[1],
+                'orcamentos_mes': usuario[2],
+                'limite_orcamentos': usuario[3],
+                'data_criacao': usuario[4],
+                'total_orcamentos': stats[0] if stats[0] else 0,
+                'valor_medio': stats[1] if stats[1] else 0,
+                'area_total': stats[2] if stats[2] else 0,
+                'ultimo_orcamento': stats[3] if stats[3] else None
+            }
+        
         except Exception as e:
             print(f"Erro ao obter estatísticas: {e}")
             return {}
     
+    def obter_estatisticas_globais(self, maiores: int = 10) -> Dict:
+        """Totais de todos os shards para a administração
+        
+        Lê as estatísticas materializadas de cada arquivo (uma linha por
+        usuário, sem varrer orcamentos) e cruza com os planos do banco central.
+        """
+        
+        try:
+            with self._conectar() as conn:
+                usuarios = {
+                    usuario_id: (email, plano, shard)
+                    for usuario_id, email, plano, shard in conn.execute("SELECT id, email, plano, shard FROM usuarios")
+                }
+                conn.commit()
+            
+            total = {'orcamentos': 0, 'qtd_valor': 0, 'valor_total': 0.0, 'area_total': 0.0}
+            por_plano: Dict[str, Dict] = {}
+            por_shard: Dict[str, Dict] = {}
+            ranking = []
+            
+            for caminho in self._shards_existentes():
+                nome = os.path.basename(caminho) if caminho != self.db_path else '(central)'
+                shard = por_shard.setdefault(nome, {'usuarios': 0, 'orcamentos': 0, 'valor_total': 0.0})
+                
+                with self._conectar(caminho) as conn:
+                    linhas = conn.execute("""
+                        SELECT usuario_id, total_orcamentos, qtd_valor, soma_valor, soma_area
+                        FROM estatisticas_usuario
+                        WHERE total_orcamentos > 0
+                    """).fetchall()
+                    conn.commit()
+                
+                for usuario_id, orcamentos, qtd_valor, soma_valor, soma_area in linhas:
+                    email, plano, _ = usuarios.get(usuario_id, (None, 'desconhecido', None))
+                    
+                    total['orcamentos'] += orcamentos
+                    total['qtd_valor'] += qtd_valor
+                    total['valor_total'] += soma_valor
+                    total['area_total'] += soma_area
+                    
+                    grupo = por_plano.setdefault(plano, {'usuarios': 0, 'orcamentos': 0, 'valor_total': 0.0})
+                    for agregado in (grupo, shard):
+                        agregado['usuarios'] += 1
+                        agregado['orcamentos'] += orcamentos
+                        agregado['valor_total'] += soma_valor
+                    
+                    ranking.append({'usuario_id': usuario_id, 'email': email, 'plano': plano,
+                                    'orcamentos': orcamentos, 'valor_total': soma_valor})
+            
+            ranking.sort(key=lambda u: u['valor_total'], reverse=True)
+            
+            return {
+                'usuarios': len(usuarios),
+                'usuarios_ativos': len(ranking),
+                'orcamentos': total['orcamentos'],
+                'valor_total': total['valor_total'],
+                'valor_medio': total['valor_total'] / total['qtd_valor'] if total['qtd_valor'] else 0,
+                'area_total': total['area_total'],
+                'por_plano': por_plano,
+                'por_shard': por_shard,
+                'maiores_usuarios': ranking[:maiores]
+            }
+        
+        except Exception as e:
+            print(f"Erro ao obter estatísticas globais: {e}")
+            return {}
+    
     def resetar_contador_mensal(self):
-        """Reseta contador mensal de orçamentos (para ser executado mensalmente)"""
+        """Reseta contador mensal de orçamentos de todos os usuários
+        
+        Desnecessário no uso normal: o contador já recomeça sozinho na
+        primeira ação do usuário em cada período (periodo_uso).
+        """
         
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._conectar() as conn:
                 cursor = conn.cursor()
                 cursor.execute("UPDATE usuarios SET orcamentos_mes = 0")
                 conn.commit()
                 return True
-                
+        
         except Exception as e:
             print(f"Erro ao resetar contador: {e}")
             return False
     
     def alterar_plano(self, usuario_id: int, novo_plano: str) -> bool:
-        """Altera plano do usuário"""
+        """Altera plano do usuário
+        
+        A troca fica registrada em alteracoes_planos na mesma transação: os
+        outros processos descartam o plano em cache em até INTERVALO_VERSAO_PLANOS.
+        """
         
         try:
-            limites = {
-                'basico': 10,
-                'profissional': 50,
-                'empresarial': 999999
-            }
-            
-            if novo_plano not in limites:
+            if novo_plano not in LIMITES_PLANOS:
                 return False
             
-            limite = limites[novo_plano]
+            limite = LIMITES_PLANOS[novo_plano]
             
-            with sqlite3.connect(self.db_path) as conn:
+            with self._conectar() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
                     UPDATE usuarios 
                     SET plano = ?, limite_orcamentos = ?
                     WHERE id = ?
                 """, (novo_plano, limite, usuario_id))
-                conn.commit()
-                return True
                 
+                if cursor.rowcount:
+                    cursor.execute("INSERT INTO alteracoes_planos (usuario_id) VALUES (?)", (usuario_id,))
+                    cursor.execute("DELETE FROM alteracoes_planos WHERE data_alteracao < datetime('now', ?)",
+                                   (f'-{RETENCAO_ALTERACOES_PLANOS} seconds',))
+                conn.commit()
+            
+            self._esquecer_planos([usuario_id])
+            return True
+        
         except Exception as e:
             print(f"Erro ao alterar plano: {e}")
             return False
 
+class GravadorOrcamentos:
+    """Fila limitada de orçamentos gravada por uma thread em commits de grupo
+    
+    - enfileirar() volta na hora; com a fila cheia o chamador espera
+      (contrapressão) e, passado TIMEOUT_FILA_GRAVACAO, grava ele mesmo.
+    - A thread junta até TAMANHO_LOTE_GRAVACAO orçamentos por transação.
+    - fechar() (também registrado no atexit) grava o que restar na fila.
+    """
+    
+    _FIM = object()
+    
+    def __init__(self, auth: AuthManager, tamanho_fila: int = TAMANHO_FILA_GRAVACAO,
+                 tamanho_lote: int = TAMANHO_LOTE_GRAVACAO):
+        """Cria a fila e inicia a thread de gravação"""
+        self.auth = auth
+        self.tamanho_lote = tamanho_lote
+        self.fila: queue.Queue = queue.Queue(maxsize=tamanho_fila)
+        self.estatisticas = {'enfileirados': 0, 'gravados': 0, 'lotes': 0, 'diretos': 0, 'falhas': 0}
+        self._fechado = False
+        
+        self._thread = threading.Thread(target=self._executar, name='gravador-orcamentos', daemon=True)
+        self._thread.start()
+        atexit.register(self.fechar)
+    
+    def enfileirar(self, usuario_id: int, nome_arquivo: str, orcamento: Dict) -> bool:
+        """Coloca o orçamento na fila (bloqueia se cheia; grava direto após o timeout)"""
+        
+        if self._fechado:
+            return self.auth.salvar_orcamento_completo(usuario_id, nome_arquivo, orcamento) is not None
+        
+        try:
+            self.fila.put((usuario_id, nome_arquivo, orcamento), timeout=TIMEOUT_FILA_GRAVACAO)
+            self.estatisticas['enfileirados'] += 1
+            return True
+        
+        except queue.Full:
+            self.estatisticas['diretos'] += 1
+            return self.auth.salvar_orcamento_completo(usuario_id, nome_arquivo, orcamento) is not None
+    
+    def aguardar(self):
+        """Bloqueia até tudo o que já foi enfileirado estar gravado"""
+        self.fila.join()
+    
+    def fechar(self):
+        """Grava o restante da fila e encerra a thread (idempotente)"""
+        
+        if self._fechado:
+            return
+        self._fechado = True
+        
+        self.fila.put(self._FIM)
+        self._thread.join()
+        
+        # Algo enfileirado durante o fechamento: gravar direto
+        while True:
+            try:
+                orcamento = self.fila.get_nowait()
+            except queue.Empty:
+                break
+            if orcamento is not self._FIM:
+                self.auth.salvar_orcamento_completo(*orcamento)
+        
+        try:
+            atexit.unregister(self.fechar)
+        except Exception:
+            pass
+    
+    def _executar(self):
+        """Laço da thread: espera um item e leva junto o que já estiver na fila"""
+        
+        while True:
+            item = self.fila.get()
+            lote = [item]
+            
+            while item is not self._FIM and len(lote) < self.tamanho_lote:
+                try:
+                    item = self.fila.get_nowait()
+                except queue.Empty:
+                    break
+                lote.append(item)
+            
+            # Nenhum erro derruba a thread nem deixa a fila sem task_done (aguardar() travaria)
+            try:
+                orcamentos = [i for i in lote if i is not self._FIM]
+                if orcamentos:
+                    self._gravar_lote(orcamentos)
+            
+            except Exception as e:
+                print(f"Erro no gravador de orçamentos: {e}")
+            
+            finally:
+                for _ in lote:
+                    self.fila.task_done()
+            
+            if item is self._FIM:
+                return
+    
+    def _gravar_lote(self, orcamentos: List[Tuple]):
+        """Um commit por shard do lote (um só, sem sharding)"""
+        
+        try:
+            por_shard: Dict[str, List[Tuple]] = {}
+            for orcamento in orcamentos:
+                por_shard.setdefault(self.auth._shard_usuario(orcamento[0]), []).append(orcamento)
+        
+        except Exception as e:
+            print(f"Erro ao rotear lote de orçamentos ({len(orcamentos)}), gravando um a um: {e}")
+            self._gravar_um_a_um(orcamentos)
+            return
+        
+        for caminho, grupo in por_shard.items():
+            self._gravar_grupo(caminho, grupo)
+    
+    def _gravar_grupo(self, caminho: str, orcamentos: List[Tuple]):
+        """Um único commit para o grupo; se falhar, regrava um a um"""
+        
+        try:
+            linhas = [self.auth._linha_orcamento(*orcamento) for orcamento in orcamentos]
+            
+            with self.auth._conectar(caminho) as conn:
+                self.auth._inserir_orcamentos(conn.cursor(), linhas)
+                conn.commit()
+            
+            self.estatisticas['gravados'] += len(orcamentos)
+            self.estatisticas['lotes'] += 1
+        
+        except Exception as e:
+            print(f"Erro ao gravar lote de orçamentos ({len(orcamentos)}), gravando um a um: {e}")
+            self._gravar_um_a_um(orcamentos)
+    
+    def _gravar_um_a_um(self, orcamentos: List[Tuple]):
+        """Caminho de recuperação: cada orçamento na sua própria transação"""
+        
+        for orcamento in orcamentos:
+            if self.auth.salvar_orcamento_completo(*orcamento) is not None:
+                self.estatisticas['gravados'] += 1
+            else:
+                self.estatisticas['falhas'] += 1
+
+# Instâncias compartilhadas pelo processo: caminho do banco -> AuthManager
+_instancias: Dict[str, AuthManager] = {}
+_lock_instancias = threading.Lock()
+
+def obter_auth_manager(db_path: str = "usuarios.db") -> AuthManager:
+    """AuthManager único por banco no processo (reruns do Streamlit reaproveitam o pool)"""
+    
+    chave = os.path.abspath(db_path)
+    auth = _instancias.get(chave)
+    if auth is not None:
+        return auth
+    
+    with _lock_instancias:
+        if chave not in _instancias:
+            _instancias[chave] = AuthManager(db_path)
+        return _instancias[chave]
+
 # Teste do sistema
 if __name__ == "__main__":
     auth = AuthManager()
@@ -406,6 +1472,12 @@ if __name__ == "__main__":
         stats = auth.obter_estatisticas_usuario(usuario['id'])
         print(f"📈 Total de orçamentos: {stats.get('total_orcamentos', 0)}")
         
+        # Teste do cache de planos
+        for _ in range(3):
+            auth.verificar_limite_orcamentos(usuario['id'])
+        metricas = auth.obter_metricas_cache_planos()
+        print(f"🗃️ Cache de planos: {metricas['acertos']} acertos, {metricas['faltas']} faltas")
+    
     else:
         print("❌ Erro no login")
     
@@ -0,0 +1,328 @@
+"""
+Teste de Carga Local - Orca Interiores
+Simula N usuários simultâneos fazendo o ciclo de uma sessão do Streamlit
+(login, análise do arquivo, orçamento, salvar, histórico) direto sobre
+AuthManager, FileAnalyzer e OrcamentoEngine, em threads e/ou processos,
+contra um SQLite temporário - sem rede
+
+Cada nível de concorrência roda pelo tempo pedido; o relatório mostra
+vazão, latência por ação, erros de "database is locked" e memória por
+sessão, para achar o teto de concorrência de um servidor.
+
+Uso:
+    python benchmarks/bench_carga.py                         # 1, 4, 16 e 64 usuários em threads
+    python benchmarks/bench_carga.py -u 8,32 -p 4            # 4 processos dividindo os usuários
+    python benchmarks/bench_carga.py --pausa 500 -d 20       # 0,5 s de "leitura" entre ações
+    python benchmarks/bench_carga.py --json                  # uma linha JSON
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from auth_manager import COTA_ESGOTADA, AuthManager
+from catalogo_precos import obter_catalogo
+from file_analyzer import FileAnalyzer
+from orcamento_engine import OrcamentoEngineFabricaFinal
+from senhas import ServicoSenhas
+
+ACOES = ('login', 'analisar', 'orcar', 'salvar', 'historico')
+
+SENHA_CARGA = 'senha-carga-123'
+
+# Peças e cômodos dos arquivos OBJ gerados (nomes que o FileAnalyzer classifica)
+PECAS = ['Armario', 'Despenseiro', 'Balcao', 'Gaveteiro', 'Prateleira', 'Porta']
+COMODOS = ['Cozinha', 'Quarto', 'Sala', 'Banheiro', 'Lavanderia']
+
+# Materiais sorteados nos orçamentos simulados (os do catálogo de preços)
+MATERIAIS = list(obter_catalogo().materiais)
+
+def gerar_obj(caminho: str, componentes: int, semente: int):
+    """Arquivo OBJ com `componentes` caixas nomeadas (dimensões de marcenaria)"""
+    
+    rng = random.Random(semente)
+    linhas, base = [], 0
+    
+    for i in range(componentes):
+        largura, altura, profundidade = rng.uniform(0.4, 2.0), rng.uniform(0.4, 2.2), rng.uniform(0.3, 0.6)
+        linhas.append(f"o {rng.choice(PECAS)}_{rng.choice(COMODOS)}_{i}")
+        
+        for x in (0, largura):
+            for y in (0, altura):
+                for z in (0, profundidade):
+                    linhas.append(f"v {x:.3f} {y:.3f} {z:.3f}")
+        
+        for face in ((1, 2, 4, 3), (5, 6, 8, 7), (1, 2, 6, 5), (3, 4, 8, 7), (1, 3, 7, 5), (2, 4, 8, 6)):
+            linhas.append("f " + " ".join(str(base + v) for v in face))
+        base += 8
+    
+    with open(caminho, 'w', encoding='utf-8') as f:
+        f.write("\n".join(linhas) + "\n")
+
+def preparar_banco(db_path: str, usuarios: int, custo_senha: str) -> List[str]:
+    """Cria os usuários da simulação (plano empresarial: a cota não interfere)"""
+    
+    servico = ServicoSenhas(custo=custo_senha)
+    auth = AuthManager(db_path, servico_senhas=servico)
+    
+    try:
+        emails = [f'carga{i}@teste.com' for i in range(usuarios)]
+        for email in emails:
+            auth._criar_usuario_interno(email, SENHA_CARGA, 'empresarial', 999999)
+        return emails
+    finally:
+        auth.fechar()
+        servico.fechar()
+
+def _rss_kb() -> int:
+    """Memória residente atual do processo (KB); pico se /proc não existir"""
+    
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def simular(db_path: str, emails: List[str], arquivos: List[str], duracao: float,
+            pausa: float, custo_senha: str, semente: int) -> Dict:
+    """Uma leva de sessões, uma thread por usuário, neste processo
+    
+    Cada sessão guarda análise e orçamento como o st.session_state faria,
+    então a memória medida inclui o estado retido por sessão.
+    """
+    
+    servico = ServicoSenhas(custo=custo_senha)
+    auth = AuthManager(db_path, servico_senhas=servico)
+    analyzer = FileAnalyzer()
+    engine = OrcamentoEngineFabricaFinal()
+    
+    # Aquecimento (catálogo, caches, pool do banco) fora da memória por sessão
+    configuracoes_aquecimento = {'material': MATERIAIS[0], 'margem_lucro': 30}
+    engine.calcular_custo_base(analyzer.analisar_arquivo_3d(arquivos[0]), configuracoes_aquecimento)
+    auth.obter_pagina_historico(0, 20)
+    rss_inicial = _rss_kb()
+    
+    latencias = {acao: [] for acao in ACOES}
+    falhas = {acao: 0 for acao in ACOES}
+    sessoes: Dict[int, Dict] = {}
+    lock = threading.Lock()
+    inicio_sinal = threading.Event()
+    
+    def sessao(indice: int):
+        rng = random.Random(semente * 1000 + indice)
+        email = emails[indice]
+        estado = sessoes.setdefault(indice, {})
+        minhas = {acao: [] for acao in ACOES}
+        erros = {acao: 0 for acao in ACOES}
+        
+        def medir(acao: str, funcao):
+            t0 = time.perf_counter()
+            resultado = funcao()
+            minhas[acao].append(time.perf_counter() - t0)
+            erros[acao] += resultado is None or resultado is False
+            if pausa:
+                time.sleep(rng.uniform(0.5, 1.5) * pausa)
+            return resultado
+        
+        inicio_sinal.wait()
+        fim = time.perf_counter() + duracao
+        
+        while time.perf_counter() < fim:
+            # Login e, nos reruns seguintes, validação do token da URL
+            if 'token' not in estado:
+                usuario = medir('login', lambda: auth.fazer_login(email, SENHA_CARGA))
+                if not usuario:
+                    continue
+                estado['usuario'] = usuario
+                estado['token'] = auth.criar_sessao(usuario)
+            else:
+                medir('login', lambda: auth.validar_sessao(estado['token']))
+            usuario = estado['usuario']
+            
+            arquivo = rng.choice(arquivos)
+            analise = medir('analisar', lambda: analyzer.analisar_arquivo_3d(arquivo))
+            if not analise:
+                continue
+            
+            configuracoes = {
+                'material': rng.choice(MATERIAIS),
+                'complexidade': 'media',
+                'qualidade_acessorios': 'comum',
+                'margem_lucro': rng.choice((20, 30, 40))
+            }
+            
+            def orcar():
+                base = engine.calcular_custo_base(analise, configuracoes)
+                return base.orcamento(configuracoes) if base else None
+            
+            orcamento = medir('orcar', orcar)
+            if not orcamento:
+                continue
+            
+            def salvar():
+                if auth.consumir_orcamento(usuario['id']) in (None, COTA_ESGOTADA):
+                    return None
+                return auth.enfileirar_orcamento(usuario['id'], os.path.basename(arquivo), orcamento)
+            
+            medir('salvar', salvar)
+            
+            def historico():
+                pagina = auth.obter_pagina_historico(usuario['id'], 20)
+                return bool(auth.obter_estatisticas_usuario(usuario['id'])) and pagina
+            
+            medir('historico', historico)
+            
+            estado['analise'], estado['orcamento'] = analise, orcamento
+        
+        with lock:
+            for acao in ACOES:
+                latencias[acao].extend(minhas[acao])
+                falhas[acao] += erros[acao]
+    
+    workers = [threading.Thread(target=sessao, args=(i,)) for i in range(len(emails))]
+    for worker in workers:
+        worker.start()
+    
+    # Erros do banco são impressos pelo AuthManager: contar em vez de mostrar
+    saida = io.StringIO()
+    with contextlib.redirect_stdout(saida):
+        inicio = time.perf_counter()
+        inicio_sinal.set()
+        for worker in workers:
+            worker.join()
+        decorrido = time.perf_counter() - inicio
+        
+        rss_sessoes = _rss_kb()
+        auth.fechar()
+        servico.fechar()
+    
+    return {
+        'latencias': latencias,
+        'falhas': falhas,
+        'decorrido': decorrido,
+        'bloqueios': saida.getvalue().count('database is locked'),
+        'erros_impressos': saida.getvalue().count('Erro'),
+        'memoria_kb': max(rss_sessoes - rss_inicial, 0),
+        'sessoes': len(emails)
+    }
+
+def _percentil(valores: List[float], fracao: float) -> float:
+    return valores[max(int(len(valores) * fracao) - 1, 0)] * 1000 if valores else 0.0
+
+def executar_nivel(db_path: str, emails: List[str], arquivos: List[str], duracao: float,
+                   pausa: float, processos: int, custo_senha: str, semente: int) -> Dict:
+    """Um nível de concorrência: usuários divididos entre processos (threads em cada um)"""
+    
+    grupos = [emails[i::processos] for i in range(processos)]
+    grupos = [grupo for grupo in grupos if grupo]
+    argumentos = [(db_path, grupo, arquivos, duracao, pausa, custo_senha, semente + i) for i, grupo in enumerate(grupos)]
+    
+    if len(grupos) == 1:
+        parciais = [simular(*argumentos[0])]
+    else:
+        # spawn: processos limpos, sem conexões SQLite herdadas do pai
+        with multiprocessing.get_context('spawn').Pool(len(grupos)) as pool:
+            parciais = pool.starmap(simular, argumentos)
+    
+    decorrido = max(p['decorrido'] for p in parciais)
+    por_acao = {}
+    total = 0
+    
+    for acao in ACOES:
+        latencias = sorted(l for p in parciais for l in p['latencias'][acao])
+        total += len(latencias)
+        por_acao[acao] = {
+            'n': len(latencias),
+            'falhas': sum(p['falhas'][acao] for p in parciais),
+            'p50_ms': round(_percentil(latencias, 0.50), 2),
+            'p95_ms': round(_percentil(latencias, 0.95), 2),
+            'p99_ms': round(_percentil(latencias, 0.99), 2)
+        }
+    
+    return {
+        'usuarios': len(emails),
+        'processos': len(grupos),
+        'acoes_por_s': round(total / decorrido, 1),
+        'orcamentos_por_s': round(por_acao['salvar']['n'] / decorrido, 1),
+        'bloqueios': sum(p['bloqueios'] for p in parciais),
+        'erros': sum(p['erros_impressos'] for p in parciais),
+        'memoria_por_sessao_kb': round(sum(p['memoria_kb'] for p in parciais) / len(emails), 1),
+        'acoes': por_acao
+    }
+
+def executar(niveis: List[int], duracao: float, pausa: float, processos: int,
+             componentes: int, custo_senha: str) -> Dict:
+    """Prepara banco e arquivos temporários e roda os níveis em ordem crescente"""
+    
+    with tempfile.TemporaryDirectory() as pasta:
+        db_path = os.path.join(pasta, 'carga.db')
+        emails = preparar_banco(db_path, max(niveis), custo_senha)
+        
+        arquivos = []
+        for i in range(4):
+            arquivo = os.path.join(pasta, f'projeto_{i}.obj')
+            gerar_obj(arquivo, componentes, i)
+            arquivos.append(arquivo)
+        
+        resultados = [
+            executar_nivel(db_path, emails[:n], arquivos, duracao, pausa, processos, custo_senha, n)
+            for n in sorted(niveis)
+        ]
+    
+    # Teto: primeiro nível em que a vazão cresce menos de 10% sobre o anterior
+    teto = None
+    for anterior, atual in zip(resultados, resultados[1:]):
+        if atual['acoes_por_s'] < anterior['acoes_por_s'] * 1.1:
+            teto = anterior['usuarios']
+            break
+    
+    return {'niveis': resultados, 'teto_usuarios': teto}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Teste de carga local: sessões simultâneas contra o SQLite")
+    parser.add_argument('-u', '--usuarios', default='1,4,16,64', help="Níveis de usuários simultâneos (vírgulas)")
+    parser.add_argument('-d', '--duracao', type=float, default=5.0, help="Segundos por nível")
+    parser.add_argument('-p', '--processos', type=int, default=1, help="Processos dividindo os usuários")
+    parser.add_argument('--pausa', type=float, default=0.0, help="Pausa média entre ações (ms)")
+    parser.add_argument('--componentes', type=int, default=40, help="Componentes por arquivo OBJ")
+    parser.add_argument('--custo-senha', default='padrao', choices=('baixo', 'padrao', 'alto'), help="Custo do KDF de senhas")
+    parser.add_argument('--json', action='store_true', help="Saída em uma linha JSON")
+    args = parser.parse_args()
+    
+    niveis = [int(n) for n in args.usuarios.split(',') if n.strip()]
+    resultados = executar(niveis, args.duracao, args.pausa / 1000, args.processos, args.componentes, args.custo_senha)
+    
+    if args.json:
+        print(json.dumps({
+            'duracao_s': args.duracao,
+            'pausa_ms': args.pausa,
+            'componentes': args.componentes,
+            **resultados
+        }, ensure_ascii=False))
+    else:
+        print(f"🏋️ Teste de carga ({args.duracao:.0f} s por nível, {args.processos} processo(s), "
+              f"pausa {args.pausa:.0f} ms, {args.componentes} componentes)")
+        print("=" * 90)
+        for r in resultados['niveis']:
+            print(f"👥 {r['usuarios']:>4} usuários | {r['acoes_por_s']:>8.1f} ações/s | "
+                  f"{r['orcamentos_por_s']:>7.1f} orçamentos/s | locked {r['bloqueios']} | "
+                  f"erros {r['erros']} | {r['memoria_por_sessao_kb']:>8.1f} KB/sessão")
+            for acao, a in r['acoes'].items():
+                print(f"     {acao:<10} n={a['n']:<6} p50 {a['p50_ms']:>8.2f} ms | p95 {a['p95_ms']:>8.2f} ms | "
+                      f"p99 {a['p99_ms']:>8.2f} ms | falhas {a['falhas']}")
+        
+        teto = resultados['teto_usuarios']
+        print(f"\n📈 Teto de concorrência: {f'~{teto} usuários' if teto else 'não atingido nos níveis testados'}")
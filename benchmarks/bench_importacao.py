@@ -0,0 +1,105 @@
+"""
+Benchmark de Tempo de Importação - Orca Interiores
+Mede o custo de importar cada módulo a frio com `python -X importtime`
+
+Uso:
+    python benchmarks/bench_importacao.py            # tabela legível
+    python benchmarks/bench_importacao.py --json     # uma linha JSON (para comparar entre commits)
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULOS = ['catalogo_precos', 'orcamento_engine', 'file_analyzer', 'auth_manager', 'reprecificacao']
+
+# Bibliotecas pesadas que não devem ser carregadas só por importar o cálculo
+PESADAS = ['plotly', 'pandas', 'streamlit']
+
+def medir_importacao(modulo: str) -> Dict:
+    """Importa o módulo num processo novo e lê o relatório do -X importtime"""
+    
+    resultado = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {modulo}'],
+        cwd=RAIZ, capture_output=True, text=True
+    )
+    
+    if resultado.returncode != 0:
+        raise RuntimeError(f"Falha ao importar {modulo}: {resultado.stderr.strip().splitlines()[-1]}")
+    
+    total_us = 0
+    carregados = set()
+    
+    for linha in resultado.stderr.splitlines():
+        if not linha.startswith('import time:') or 'self [us]' in linha:
+            continue
+        
+        _, cumulativo, nome = linha[len('import time:'):].split('|')
+        nome = nome.strip()
+        carregados.add(nome.split('.')[0])
+        
+        if nome == modulo:
+            total_us = int(cumulativo)
+    
+    return {
+        'total_ms': total_us / 1000,
+        'pesadas': sorted(carregados.intersection(PESADAS))
+    }
+
+def executar(modulos: List[str], repeticoes: int) -> Dict:
+    """Mediana de várias importações a frio por módulo"""
+    
+    resultados = {}
+    
+    for modulo in modulos:
+        # Primeira execução descartada: gera os .pyc
+        medir_importacao(modulo)
+        
+        medicoes = [medir_importacao(modulo) for _ in range(repeticoes)]
+        resultados[modulo] = {
+            'mediana_ms': round(statistics.median(m['total_ms'] for m in medicoes), 1),
+            'minimo_ms': round(min(m['total_ms'] for m in medicoes), 1),
+            'pesadas': medicoes[-1]['pesadas']
+        }
+    
+    return resultados
+
+def _commit_atual() -> str:
+    """Hash curto do commit atual (se for um repositório git)"""
+    
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=RAIZ, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return ''
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tempo de importação a frio dos módulos")
+    parser.add_argument('modulos', nargs='*', default=MODULOS, help="Módulos a medir")
+    parser.add_argument('-n', '--repeticoes', type=int, default=5, help="Importações por módulo")
+    parser.add_argument('--json', action='store_true', help="Saída em uma linha JSON")
+    args = parser.parse_args()
+    
+    resultados = executar(args.modulos, args.repeticoes)
+    
+    if args.json:
+        print(json.dumps({
+            'commit': _commit_atual(),
+            'python': sys.version.split()[0],
+            'repeticoes': args.repeticoes,
+            'modulos': resultados
+        }, ensure_ascii=False))
+    else:
+        print("⏱️ Tempo de importação a frio (-X importtime)")
+        print("=" * 60)
+        for modulo, r in resultados.items():
+            pesadas = f"  ⚠️ carrega {', '.join(r['pesadas'])}" if r['pesadas'] else ""
+            print(f"{modulo:<20} {r['mediana_ms']:>8.1f} ms (mín {r['minimo_ms']:.1f}){pesadas}")
@@ -0,0 +1,130 @@
+"""
+Benchmark de Hash de Senhas - Orca Interiores
+Logins por segundo do AuthManager em cada custo do KDF (scrypt e PBKDF2),
+com o hash rodando no pool de threads ou de processos do ServicoSenhas
+
+Uso:
+    python benchmarks/bench_senhas.py                      # scrypt, todos os custos
+    python benchmarks/bench_senhas.py -a pbkdf2_sha256     # PBKDF2
+    python benchmarks/bench_senhas.py -t 32 -w 8 --processos
+    python benchmarks/bench_senhas.py --json               # uma linha JSON
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from auth_manager import AuthManager
+from senhas import CUSTOS_PBKDF2, CUSTOS_SCRYPT, TRABALHADORES_SENHA, ServicoSenhas
+
+USUARIOS_BENCH = 20
+SENHA_BENCH = 'senha-bench-123'
+
+def medir_custo(algoritmo: str, custo: str, threads: int, duracao: float,
+                trabalhadores: int, processos: bool) -> Dict:
+    """Logins simultâneos num banco temporário, com um custo de KDF"""
+    
+    servico = ServicoSenhas(algoritmo, custo, trabalhadores=trabalhadores, processos=processos)
+    
+    with tempfile.TemporaryDirectory() as pasta:
+        auth = AuthManager(os.path.join(pasta, 'bench.db'), servico_senhas=servico)
+        
+        try:
+            emails = [f'bench{i}@teste.com' for i in range(USUARIOS_BENCH)]
+            for email in emails:
+                auth.criar_usuario(email, SENHA_BENCH)
+            
+            # Custo de um hash isolado (sem concorrência)
+            inicio = time.perf_counter()
+            servico.gerar_hash(SENHA_BENCH)
+            hash_ms = (time.perf_counter() - inicio) * 1000
+            
+            inicio_sinal = threading.Event()
+            latencias, falhas = [], []
+            lock = threading.Lock()
+            
+            def trabalhador(indice: int):
+                minhas, erros = [], 0
+                inicio_sinal.wait()
+                fim = time.perf_counter() + duracao
+                
+                i = indice
+                while time.perf_counter() < fim:
+                    t0 = time.perf_counter()
+                    erros += auth.fazer_login(emails[i % len(emails)], SENHA_BENCH) is None
+                    minhas.append(time.perf_counter() - t0)
+                    i += threads
+                
+                with lock:
+                    latencias.extend(minhas)
+                    falhas.append(erros)
+            
+            workers = [threading.Thread(target=trabalhador, args=(i,)) for i in range(threads)]
+            for worker in workers:
+                worker.start()
+            
+            inicio = time.perf_counter()
+            inicio_sinal.set()
+            for worker in workers:
+                worker.join()
+            decorrido = time.perf_counter() - inicio
+        
+        finally:
+            auth.fechar()
+            servico.fechar()
+    
+    latencias.sort()
+    return {
+        'hash_ms': round(hash_ms, 1),
+        'logins_por_s': round(len(latencias) / decorrido, 1),
+        'falhas': sum(falhas),
+        'latencia_p50_ms': round(statistics.median(latencias) * 1000, 1) if latencias else 0,
+        'latencia_p99_ms': round(latencias[int(len(latencias) * 0.99) - 1] * 1000, 1) if latencias else 0
+    }
+
+def executar(algoritmo: str, threads: int, duracao: float, trabalhadores: int, processos: bool) -> Dict:
+    """Mede todos os custos nomeados do algoritmo"""
+    
+    custos = CUSTOS_SCRYPT if algoritmo == 'scrypt' else CUSTOS_PBKDF2
+    return {
+        custo: medir_custo(algoritmo, custo, threads, duracao, trabalhadores, processos)
+        for custo in custos
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Logins por segundo em cada custo do KDF de senhas")
+    parser.add_argument('-a', '--algoritmo', choices=('scrypt', 'pbkdf2_sha256'), default='scrypt')
+    parser.add_argument('-t', '--threads', type=int, default=16, help="Threads fazendo login")
+    parser.add_argument('-d', '--duracao', type=float, default=3.0, help="Segundos por custo")
+    parser.add_argument('-w', '--trabalhadores', type=int, default=TRABALHADORES_SENHA, help="KDFs simultâneos no pool")
+    parser.add_argument('--processos', action='store_true', help="Pool de processos em vez de threads")
+    parser.add_argument('--json', action='store_true', help="Saída em uma linha JSON")
+    args = parser.parse_args()
+    
+    resultados = executar(args.algoritmo, args.threads, args.duracao, args.trabalhadores, args.processos)
+    
+    if args.json:
+        print(json.dumps({
+            'algoritmo': args.algoritmo,
+            'threads': args.threads,
+            'trabalhadores': args.trabalhadores,
+            'processos': args.processos,
+            'duracao_s': args.duracao,
+            'custos': resultados
+        }, ensure_ascii=False))
+    else:
+        pool = 'processos' if args.processos else 'threads'
+        print(f"🔑 Logins por segundo - {args.algoritmo} ({args.threads} threads, pool de {args.trabalhadores} {pool})")
+        print("=" * 70)
+        for custo, r in resultados.items():
+            print(f"{custo:<8} hash {r['hash_ms']:>7.1f} ms | {r['logins_por_s']:>7.1f} logins/s | "
+                  f"p50 {r['latencia_p50_ms']:>7.1f} ms | p99 {r['latencia_p99_ms']:>7.1f} ms | falhas {r['falhas']}")
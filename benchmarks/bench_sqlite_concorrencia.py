@@ -0,0 +1,160 @@
+"""
+Benchmark de Concorrência no SQLite - Orca Interiores
+Leituras e escritas por segundo do AuthManager com várias threads,
+comparando conexão nova por chamada (modo antigo) com o pool WAL
+
+Uso:
+    python benchmarks/bench_sqlite_concorrencia.py                 # 16 threads, 3 s por modo
+    python benchmarks/bench_sqlite_concorrencia.py -t 32 -d 5      # mais carga
+    python benchmarks/bench_sqlite_concorrencia.py --json          # uma linha JSON
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, Optional
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from auth_manager import AuthManager
+from senhas import ServicoSenhas
+
+USUARIOS_DEMO = [
+    ('demo@orcainteriores.com', 'demo123'),
+    ('arquiteto@teste.com', 'arq123'),
+    ('marceneiro@teste.com', 'marc123')
+]
+
+ORCAMENTO_EXEMPLO = {
+    'resumo': {'valor_final': 9000.0, 'area_total_m2': 21.0},
+    'componentes': [
+        {'nome': f'Componente_{i}', 'tipo': 'armario', 'area_m2': 1.0 + i % 5, 'custo_total': 300.0 + i}
+        for i in range(20)
+    ],
+    'configuracoes': {'material': 'mdf_18mm', 'margem_lucro': 30}
+}
+
+class AuthManagerSemPool(AuthManager):
+    """Comportamento anterior: conexão nova a cada chamada, journal padrão"""
+    
+    def _conectar(self, caminho: Optional[str] = None) -> sqlite3.Connection:
+        return sqlite3.connect(caminho or self.db_path)
+
+def executar_carga(auth: AuthManager, threads: int, duracao: float, fracao_escrita: float) -> Dict:
+    """Dispara threads misturando leituras e escritas até o fim da duração"""
+    
+    ids = [auth.fazer_login(email, senha)['id'] for email, senha in USUARIOS_DEMO]
+    inicio_sinal = threading.Event()
+    resultados = []
+    lock = threading.Lock()
+    
+    def trabalhador(semente: int):
+        rng = random.Random(semente)
+        leituras = escritas = falhas = 0
+        latencias = []
+        
+        inicio_sinal.wait()
+        fim = time.perf_counter() + duracao
+        
+        while time.perf_counter() < fim:
+            usuario_id = rng.choice(ids)
+            t0 = time.perf_counter()
+            
+            if rng.random() < fracao_escrita:
+                # Escrita em usuarios sem KDF (o login passou a ser dominado pelo hash da senha)
+                if rng.random() < 0.5:
+                    ok = auth.incrementar_orcamentos(usuario_id)
+                else:
+                    ok = auth.salvar_orcamento_completo(usuario_id, 'bench.obj', ORCAMENTO_EXEMPLO) is not None
+                escritas += 1
+            else:
+                if rng.random() < 0.5:
+                    ok = bool(auth.obter_estatisticas_usuario(usuario_id))
+                else:
+                    auth.obter_historico_orcamentos(usuario_id)
+                    ok = True
+                leituras += 1
+            
+            latencias.append(time.perf_counter() - t0)
+            falhas += not ok
+        
+        with lock:
+            resultados.append((leituras, escritas, falhas, latencias))
+    
+    workers = [threading.Thread(target=trabalhador, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    
+    # Erros de "database is locked" são impressos pelo AuthManager: contar em vez de mostrar
+    saida = io.StringIO()
+    with contextlib.redirect_stdout(saida):
+        inicio_sinal.set()
+        for worker in workers:
+            worker.join()
+    
+    latencias = sorted(l for r in resultados for l in r[3])
+    return {
+        'leituras_por_s': round(sum(r[0] for r in resultados) / duracao, 1),
+        'escritas_por_s': round(sum(r[1] for r in resultados) / duracao, 1),
+        'falhas': sum(r[2] for r in resultados),
+        'bloqueios': saida.getvalue().count('database is locked'),
+        'latencia_p50_ms': round(statistics.median(latencias) * 1000, 2) if latencias else 0,
+        'latencia_p99_ms': round(latencias[int(len(latencias) * 0.99) - 1] * 1000, 2) if latencias else 0
+    }
+
+def executar(threads: int, duracao: float, fracao_escrita: float) -> Dict:
+    """Mede os dois modos, cada um num banco temporário novo
+    
+    KDF de senhas no custo 'baixo' só para os logins iniciais; a carga não faz
+    login, para medir o banco e não o hash (esse tem bench_senhas.py).
+    """
+    
+    resultados = {}
+    servico = ServicoSenhas(custo='baixo')
+    
+    try:
+        for modo, classe in (('antes', AuthManagerSemPool), ('depois', AuthManager)):
+            with tempfile.TemporaryDirectory() as pasta:
+                auth = classe(os.path.join(pasta, 'bench.db'), servico_senhas=servico)
+                try:
+                    resultados[modo] = executar_carga(auth, threads, duracao, fracao_escrita)
+                finally:
+                    auth.fechar()
+    finally:
+        servico.fechar()
+    
+    return resultados
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Leituras/escritas por segundo do AuthManager sob concorrência")
+    parser.add_argument('-t', '--threads', type=int, default=16, help="Threads simultâneas")
+    parser.add_argument('-d', '--duracao', type=float, default=3.0, help="Segundos por modo")
+    parser.add_argument('-e', '--escrita', type=float, default=0.2, help="Fração de operações de escrita")
+    parser.add_argument('--json', action='store_true', help="Saída em uma linha JSON")
+    args = parser.parse_args()
+    
+    resultados = executar(args.threads, args.duracao, args.escrita)
+    
+    if args.json:
+        print(json.dumps({
+            'threads': args.threads,
+            'duracao_s': args.duracao,
+            'fracao_escrita': args.escrita,
+            'modos': resultados
+        }, ensure_ascii=False))
+    else:
+        print(f"🗄️ SQLite sob concorrência ({args.threads} threads, {args.duracao:.0f} s, {args.escrita:.0%} escritas)")
+        print("=" * 70)
+        for modo, r in resultados.items():
+            print(f"{modo:<8} leituras {r['leituras_por_s']:>9.1f}/s | escritas {r['escritas_por_s']:>8.1f}/s | "
+                  f"p99 {r['latencia_p99_ms']:>7.2f} ms | falhas {r['falhas']} (locked: {r['bloqueios']})")
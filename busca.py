@@ -0,0 +1,97 @@
+"""
+Busca no Histórico - Orca Interiores
+Textos indexados (FTS5) de cada orçamento - nome do arquivo, nomes e tipos
+dos componentes - e tradução da busca do usuário para uma consulta FTS5
+"""
+
+import re
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+from serializacao import MAGICO, decodificar_colunas, desserializar_orcamento
+
+# Termos considerados por busca (o resto é ignorado)
+MAXIMO_TERMOS_BUSCA = 8
+
+# Palavras de ligação ignoradas na busca ("cozinha com despenseiro")
+PALAVRAS_IGNORADAS = frozenset({
+    'a', 'as', 'o', 'os', 'e', 'de', 'da', 'das', 'do', 'dos',
+    'em', 'na', 'nas', 'no', 'nos', 'com', 'para', 'um', 'uma'
+})
+
+# Separa nomes em CamelCase ("DespenseiroCozinha" -> "Despenseiro Cozinha")
+_CAMEL_CASE = re.compile(r'(?<=[a-zà-ÿ])(?=[A-ZÀ-Þ])')
+_TERMO = re.compile(r'\w+', re.UNICODE)
+
+def _juntar(valores: Iterable) -> str:
+    """Valores distintos, na ordem, num texto só (repetição não ajuda o ranking)"""
+    
+    distintos = dict.fromkeys(str(v) for v in valores if v not in (None, ''))
+    return ' '.join(_CAMEL_CASE.sub(' ', v) for v in distintos)
+
+def textos_busca(orcamento: Dict) -> Tuple[str, str]:
+    """(nomes, tipos) dos componentes para o índice de busca"""
+    
+    componentes = orcamento.get('componentes', []) or []
+    return (
+        _juntar(comp.get('nome') for comp in componentes),
+        _juntar(comp.get('tipo') for comp in componentes)
+    )
+
+def _valores_coluna(coluna) -> list:
+    """Valores distintos de uma coluna decodificada por decodificar_colunas"""
+    
+    if isinstance(coluna, tuple):  # categórica: as categorias já são os valores distintos
+        return coluna[1]
+    return coluna if isinstance(coluna, list) else coluna.tolist()
+
+def textos_busca_payload(dados: Union[bytes, str]) -> Tuple[str, str]:
+    """(nomes, tipos) direto do payload salvo, sem montar os componentes"""
+    
+    if isinstance(dados, bytes) and dados[:len(MAGICO)] == MAGICO:
+        cabecalho, colunas = decodificar_colunas(dados)
+        if not cabecalho['n_componentes']:
+            return '', ''
+        
+        # Chaves fora das colunas (componentes heterogêneos): caminho completo
+        if 'nome' in colunas and 'tipo' in colunas:
+            return _juntar(_valores_coluna(colunas['nome'])), _juntar(_valores_coluna(colunas['tipo']))
+    
+    return textos_busca(desserializar_orcamento(dados))
+
+def token_usuario(usuario_id: Optional[int]) -> Optional[str]:
+    """Token da coluna usuario do índice ('u<id>'), que restringe a busca ao dono"""
+    
+    return None if usuario_id is None else f"u{usuario_id}"
+
+def consulta_fts(texto: str, usuario_id: int) -> Optional[str]:
+    """Traduz a busca digitada para FTS5: todos os termos, só nos orçamentos
+    do usuário; o último vale como prefixo (busca enquanto digita)
+    
+    Só o último é prefixo porque prefixos longos varrem e juntam várias
+    listas do índice (~3x mais lentos que o termo exato). Os termos vão entre
+    aspas: operadores e aspas digitados nunca viram sintaxe FTS5.
+    None se não sobrar termo algum.
+    """
+    
+    termos = [t for t in _TERMO.findall(texto or '') if t.lower() not in PALAVRAS_IGNORADAS]
+    termos = termos[:MAXIMO_TERMOS_BUSCA]
+    if not termos:
+        return None
+    
+    termos = ' '.join(f'"{termo}"' for termo in termos) + '*'
+    return f'usuario : "{token_usuario(usuario_id)}" AND {{nome_arquivo componentes tipos}} : ({termos})'
+
+if __name__ == "__main__":
+    orcamento = {
+        'componentes': [
+            {'nome': 'DespenseiroCozinha_01', 'tipo': 'armario'},
+            {'nome': 'Gaveta_Talheres', 'tipo': 'gaveta'},
+            {'nome': 'Gaveta_Talheres', 'tipo': 'gaveta'}
+        ]
+    }
+    
+    print("🔎 Busca no Histórico - Orca Interiores")
+    print("=" * 50)
+    print(f"📝 Textos: {textos_busca(orcamento)}")
+    busca = 'cozinha com despenseiro "talher'
+    print(f"🔤 Consulta para {busca!r}: {consulta_fts(busca, 1)}")
@@ -0,0 +1,178 @@
+"""
+Catálogo de Preços Versionado - Orca Interiores
+Preços de fábrica externos (JSON), compilados uma vez por versão e
+compartilhados pelo processo, com recarga automática quando o arquivo muda
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from types import MappingProxyType
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+CAMINHO_PADRAO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalogo_precos.json')
+
+# Intervalo mínimo entre verificações do arquivo (segundos)
+INTERVALO_VERIFICACAO = 2.0
+
+# Fatores de config lidos diretamente pelo engine (números obrigatórios)
+CHAVES_CONFIG_OBRIGATORIAS = (
+    'fator_desperdicio', 'percentual_paineis_extras', 'fator_calibracao_geral',
+    'fator_preco_mercado', 'incerteza_area_base', 'incerteza_area_confianca',
+    'fator_incerteza_dimensao_invalida'
+)
+
+def _numero(valor, nome: str) -> float:
+    """Valor numérico finito do catálogo, ou ValueError com o nome do campo"""
+    
+    if isinstance(valor, bool) or not isinstance(valor, (int, float)) or not math.isfinite(valor):
+        raise ValueError(f"Catálogo de preços: '{nome}' deve ser um número (recebido {valor!r})")
+    return float(valor)
+
+def _tabela(valores: Iterable[float]) -> np.ndarray:
+    """Cria array float64 somente leitura"""
+    tabela = np.array(list(valores), dtype=float)
+    tabela.setflags(write=False)
+    return tabela
+
+class CatalogoPrecos:
+    """Versão compilada e imutável do catálogo de preços"""
+    
+    def __init__(self, dados: Dict, origem: str = ''):
+        """Valida os dados do catálogo e compila as tabelas de consulta"""
+        
+        for chave in ('versao', 'precos_materiais', 'multiplicadores_tipo',
+                      'multiplicadores_complexidade', 'config'):
+            if chave not in dados:
+                raise ValueError(f"Catálogo de preços sem '{chave}'")
+        
+        # Inválido aqui = a recarga mantém a versão anterior (em vez de todo
+        # orçamento falhar depois, no engine)
+        for chave in ('precos_materiais', 'multiplicadores_tipo', 'multiplicadores_complexidade'):
+            if not isinstance(dados[chave], dict) or not dados[chave]:
+                raise ValueError(f"Catálogo de preços: '{chave}' deve ser um objeto não vazio")
+        
+        if not isinstance(dados['config'], dict):
+            raise ValueError("Catálogo de preços: 'config' deve ser um objeto")
+        for chave in CHAVES_CONFIG_OBRIGATORIAS:
+            if chave not in dados['config']:
+                raise ValueError(f"Catálogo de preços sem 'config.{chave}'")
+        
+        acessorios = dados['config'].get('custo_acessorios_por_m2')
+        if not isinstance(acessorios, dict) or not acessorios:
+            raise ValueError("Catálogo de preços: 'config.custo_acessorios_por_m2' deve ser um objeto não vazio")
+        
+        self._dados = dados
+        self.origem = origem
+        self.versao = str(dados['versao'])
+        
+        # Dicionários somente leitura (mesma interface dos antigos atributos do engine)
+        self.precos_materiais = MappingProxyType(
+            {k: _numero(v, f'precos_materiais.{k}') for k, v in dados['precos_materiais'].items()}
+        )
+        self.multiplicadores_tipo = MappingProxyType(
+            {k: _numero(v, f'multiplicadores_tipo.{k}') for k, v in dados['multiplicadores_tipo'].items()}
+        )
+        self.multiplicadores_complexidade = MappingProxyType(
+            {k: _numero(v, f'multiplicadores_complexidade.{k}') for k, v in dados['multiplicadores_complexidade'].items()}
+        )
+        
+        config = dict(dados['config'])
+        for chave in CHAVES_CONFIG_OBRIGATORIAS:
+            config[chave] = _numero(config[chave], f'config.{chave}')
+        config['custo_acessorios_por_m2'] = MappingProxyType(
+            {k: _numero(v, f'config.custo_acessorios_por_m2.{k}') for k, v in acessorios.items()}
+        )
+        self.config = MappingProxyType(config)
+        
+        # Tabelas compiladas: código inteiro -> valor
+        self.materiais = tuple(self.precos_materiais)
+        self.tipos = tuple(self.multiplicadores_tipo)
+        self.complexidades = tuple(self.multiplicadores_complexidade)
+        self.qualidades_acessorios = tuple(self.config['custo_acessorios_por_m2'])
+        
+        self.indice_material = MappingProxyType({nome: i for i, nome in enumerate(self.materiais)})
+        self.indice_tipo = MappingProxyType({nome: i for i, nome in enumerate(self.tipos)})
+        self.indice_complexidade = MappingProxyType({nome: i for i, nome in enumerate(self.complexidades)})
+        self.indice_acessorios = MappingProxyType({nome: i for i, nome in enumerate(self.qualidades_acessorios)})
+        
+        self.tabela_precos_materiais = _tabela(self.precos_materiais.values())
+        # Última posição: tipo desconhecido (multiplicador 1.0)
+        self.tabela_multiplicadores_tipo = _tabela(list(self.multiplicadores_tipo.values()) + [1.0])
+        self.tabela_multiplicadores_complexidade = _tabela(self.multiplicadores_complexidade.values())
+        self.tabela_acessorios = _tabela(self.config['custo_acessorios_por_m2'].values())
+    
+    def __reduce__(self):
+        """Permite enviar o catálogo para processos (MappingProxyType não é serializável)"""
+        return (CatalogoPrecos, (self._dados, self.origem))
+    
+    def __repr__(self) -> str:
+        return f"CatalogoPrecos(versao={self.versao!r}, origem={self.origem!r})"
+    
+    def codificar_tipos(self, tipos: Iterable[str]) -> np.ndarray:
+        """Converte nomes de tipo em códigos (tipos desconhecidos -> len(self.tipos))"""
+        desconhecido = len(self.tipos)
+        return np.array([self.indice_tipo.get(tipo, desconhecido) for tipo in tipos], dtype=np.intp)
+
+def carregar_catalogo(caminho: str) -> CatalogoPrecos:
+    """Lê e compila um catálogo de preços JSON"""
+    
+    with open(caminho, 'r', encoding='utf-8') as f:
+        dados = json.load(f)
+    
+    return CatalogoPrecos(dados, origem=os.path.abspath(caminho))
+
+# Catálogos compilados compartilhados pelo processo: caminho -> entrada
+_catalogos: Dict[str, Dict] = {}
+_lock = threading.Lock()
+
+def obter_catalogo(caminho: Optional[str] = None) -> CatalogoPrecos:
+    """Retorna o catálogo compilado, recarregando se o arquivo mudou
+    
+    O caminho padrão pode ser trocado pela variável ORCA_CATALOGO_PRECOS.
+    O arquivo é verificado no máximo a cada INTERVALO_VERIFICACAO segundos;
+    se a nova versão for inválida, a anterior continua em uso.
+    """
+    
+    caminho = os.path.abspath(caminho or os.environ.get('ORCA_CATALOGO_PRECOS', CAMINHO_PADRAO))
+    agora = time.monotonic()
+    
+    entrada = _catalogos.get(caminho)
+    if entrada and agora - entrada['verificado_em'] < INTERVALO_VERIFICACAO:
+        return entrada['catalogo']
+    
+    with _lock:
+        entrada = _catalogos.get(caminho)
+        if entrada and agora - entrada['verificado_em'] < INTERVALO_VERIFICACAO:
+            return entrada['catalogo']
+        
+        assinatura = None
+        try:
+            stat = os.stat(caminho)
+            assinatura = (stat.st_mtime_ns, stat.st_size)
+            
+            if entrada and entrada['assinatura'] == assinatura:
+                entrada['verificado_em'] = agora
+                return entrada['catalogo']
+            
+            catalogo = carregar_catalogo(caminho)
+        
+        except Exception as e:
+            if not entrada:
+                raise
+            # Não tentar de novo até o arquivo mudar outra vez
+            print(f"Erro ao recarregar catálogo de preços (mantendo versão {entrada['catalogo'].versao}): {e}")
+            entrada['assinatura'] = assinatura
+            entrada['verificado_em'] = agora
+            return entrada['catalogo']
+        
+        _catalogos[caminho] = {
+            'catalogo': catalogo,
+            'assinatura': assinatura,
+            'verificado_em': agora
+        }
+        return catalogo
@@ -0,0 +1,322 @@
+"""
+Exportação de Orçamentos - Orca Interiores
+Escritores em fluxo (TXT, JSON, CSV de corte, XLSX e HTML para impressão)
+com cache por hash do orçamento
+"""
+
+import csv
+import html
+import io
+import json
+import math
+import threading
+import zipfile
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, List, Tuple
+from xml.sax.saxutils import escape
+
+from orcamento_engine import OrcamentoEngineFabricaFinal, chave_orcamento
+
+# Limite do cache de arquivos exportados (bytes somados)
+TAMANHO_MAXIMO_CACHE = 64 * 1024 * 1024
+
+# Colunas da lista de corte (CSV/XLSX): (título, chave do componente)
+COLUNAS_COMPONENTES: List[Tuple[str, str]] = [
+    ('Nome', 'nome'),
+    ('Tipo', 'tipo'),
+    ('Área (m²)', 'area_m2'),
+    ('Material', 'material_usado'),
+    ('Acessórios', 'qualidade_acessorios'),
+    ('Preço/m² (R$)', 'preco_por_m2'),
+    ('Custo Material (R$)', 'custo_material'),
+    ('Custo Acessórios (R$)', 'custo_acessorios'),
+    ('Custo Total (R$)', 'custo_total'),
+    ('IA Confiança', 'ia_confianca')
+]
+
+# Linhas do resumo: (título, chave do resumo)
+LINHAS_RESUMO: List[Tuple[str, str]] = [
+    ('Valor Final (R$)', 'valor_final'),
+    ('Base Fábrica (R$)', 'custo_base_fabrica'),
+    ('Material (R$)', 'custo_material'),
+    ('Painéis Extras (R$)', 'custo_paineis_extras'),
+    ('Montagem (R$)', 'custo_montagem'),
+    ('Sua Margem (R$)', 'valor_lucro'),
+    ('Margem (%)', 'margem_lucro_pct'),
+    ('Área Total (m²)', 'area_total_m2'),
+    ('Preço/m² (R$)', 'preco_por_m2'),
+    ('Preço Mercado (R$)', 'valor_mercado_estimado'),
+    ('Economia Cliente (R$)', 'economia_cliente')
+]
+
+def _valor_componente(comp: Dict, chave: str):
+    """Valor de uma coluna da lista de corte"""
+    valor = comp.get(chave)
+    return '' if valor is None else valor
+
+def iter_txt(orcamento: Dict) -> Iterator[str]:
+    """Relatório detalhado em texto, linha a linha"""
+    
+    engine = OrcamentoEngineFabricaFinal()
+    for linha in engine.iter_relatorio_detalhado(orcamento):
+        yield linha + "\n"
+
+def iter_json(orcamento: Dict) -> Iterator[str]:
+    """Orçamento completo em JSON, em pedaços"""
+    
+    encoder = json.JSONEncoder(indent=2, ensure_ascii=False, default=str)
+    yield from encoder.iterencode(orcamento)
+
+def iter_csv(orcamento: Dict) -> Iterator[str]:
+    """Lista de corte em CSV, uma linha por componente"""
+    
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    
+    def drenar() -> str:
+        texto = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return texto
+    
+    # BOM para o Excel reconhecer UTF-8 (acentos)
+    yield '\ufeff'
+    
+    escritor.writerow([titulo for titulo, _ in COLUNAS_COMPONENTES])
+    yield drenar()
+    
+    for comp in orcamento.get('componentes', []):
+        escritor.writerow([_valor_componente(comp, chave) for _, chave in COLUNAS_COMPONENTES])
+        yield drenar()
+
+def iter_html(orcamento: Dict) -> Iterator[str]:
+    """Orçamento em HTML pronto para impressão"""
+    
+    resumo = orcamento.get('resumo', {})
+    configuracoes = orcamento.get('configuracoes', {})
+    esc = lambda valor: html.escape(str(valor))
+    
+    yield """<!DOCTYPE html>
+<html lang="pt-BR">
+<head>
+<meta charset="utf-8">
+<title>Orçamento - Orca Interiores</title>
+<style>
+    body { font-family: Arial, sans-serif; color: #222; margin: 2rem; }
+    h1 { color: #2E8B57; margin-bottom: 0; }
+    .sub { color: #666; margin-top: 0.25rem; }
+    table { border-collapse: collapse; width: 100%; margin: 1rem 0; font-size: 0.9rem; }
+    th, td { border: 1px solid #ddd; padding: 0.4rem 0.6rem; text-align: left; }
+    th { background: #2E8B57; color: white; }
+    td.num { text-align: right; }
+    .total { font-size: 1.4rem; font-weight: 700; color: #2E8B57; }
+    @media print {
+        body { margin: 0; }
+        thead { display: table-header-group; }
+        tr { page-break-inside: avoid; }
+    }
+</style>
+</head>
+<body>
+"""
+    
+    yield "<h1>🏠 Orca Interiores</h1>\n"
+    yield (f"<p class=\"sub\">Orçamento gerado em {esc(orcamento.get('timestamp', ''))} · "
+           f"Catálogo de preços {esc(orcamento.get('versao_catalogo') or 'N/A')}</p>\n")
+    yield f"<p class=\"total\">Valor Final: R$ {resumo.get('valor_final', 0):,.2f}</p>\n"
+    
+    # Configurações e resumo
+    yield "<table>\n<tr><th colspan=\"2\">Configurações</th></tr>\n"
+    yield f"<tr><td>Material</td><td>{esc(configuracoes.get('material', 'N/A').replace('_', ' ').title())}</td></tr>\n"
+    yield f"<tr><td>Complexidade</td><td>{esc(configuracoes.get('complexidade', 'N/A').title())}</td></tr>\n"
+    yield f"<tr><td>Acessórios</td><td>{esc(configuracoes.get('qualidade_acessorios', 'N/A').title())}</td></tr>\n"
+    yield "</table>\n"
+    
+    yield "<table>\n<tr><th colspan=\"2\">Resumo</th></tr>\n"
+    for titulo, chave in LINHAS_RESUMO:
+        yield f"<tr><td>{esc(titulo)}</td><td class=\"num\">{resumo.get(chave, 0):,.2f}</td></tr>\n"
+    yield "</table>\n"
+    
+    # Componentes
+    yield "<table>\n<thead><tr><th>#</th><th>Componente</th><th>Tipo</th><th>Área (m²)</th>"
+    yield "<th>Preço/m² (R$)</th><th>Total (R$)</th></tr></thead>\n<tbody>\n"
+    
+    for i, comp in enumerate(orcamento.get('componentes', []), 1):
+        yield (f"<tr><td>{i}</td><td>{esc(comp.get('nome', ''))}</td>"
+               f"<td>{esc(comp.get('tipo', '').title())}</td>"
+               f"<td class=\"num\">{comp.get('area_m2', 0):.2f}</td>"
+               f"<td class=\"num\">{comp.get('preco_por_m2', 0):,.2f}</td>"
+               f"<td class=\"num\">{comp.get('custo_total', 0):,.2f}</td></tr>\n")
+    
+    yield "</tbody>\n</table>\n"
+    yield "<p class=\"sub\">Montagem não inclusa. Preços baseados em custos reais de fábrica.</p>\n"
+    yield "</body>\n</html>\n"
+
+class _BufferFluxo(io.RawIOBase):
+    """Destino não-posicionável para o zipfile: acumula bytes até serem drenados"""
+    
+    def __init__(self):
+        self._pedacos = []
+    
+    def writable(self) -> bool:
+        return True
+    
+    def write(self, dados) -> int:
+        self._pedacos.append(bytes(dados))
+        return len(dados)
+    
+    def drenar(self) -> bytes:
+        dados = b''.join(self._pedacos)
+        self._pedacos = []
+        return dados
+
+def _celula_xlsx(valor) -> str:
+    """Célula de planilha (número ou texto inline)"""
+    
+    if valor is None or valor == '':
+        return '<c/>'
+    
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool) and math.isfinite(valor):
+        return f'<c><v>{valor!r}</v></c>'
+    
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{escape(str(valor))}</t></is></c>'
+
+def _linha_xlsx(valores) -> str:
+    """Linha de planilha"""
+    return '<row>' + ''.join(_celula_xlsx(v) for v in valores) + '</row>'
+
+_XLSX_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+<Override PartName="/xl/worksheets/sheet2.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+</Types>"""
+
+_XLSX_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>"""
+
+_XLSX_WORKBOOK = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets>
+<sheet name="Resumo" sheetId="1" r:id="rId1"/>
+<sheet name="Componentes" sheetId="2" r:id="rId2"/>
+</sheets>
+</workbook>"""
+
+_XLSX_WORKBOOK_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet2.xml"/>
+</Relationships>"""
+
+_XLSX_INICIO_PLANILHA = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                         '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+_XLSX_FIM_PLANILHA = '</sheetData></worksheet>'
+
+def iter_xlsx(orcamento: Dict) -> Iterator[bytes]:
+    """Planilha XLSX (Resumo + Componentes) gerada em fluxo, sem dependências"""
+    
+    resumo = orcamento.get('resumo', {})
+    destino = _BufferFluxo()
+    
+    with zipfile.ZipFile(destino, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('[Content_Types].xml', _XLSX_CONTENT_TYPES)
+        zf.writestr('_rels/.rels', _XLSX_RELS)
+        zf.writestr('xl/workbook.xml', _XLSX_WORKBOOK)
+        zf.writestr('xl/_rels/workbook.xml.rels', _XLSX_WORKBOOK_RELS)
+        
+        linhas_resumo = [_linha_xlsx(['Item', 'Valor'])]
+        linhas_resumo += [_linha_xlsx([titulo, resumo.get(chave, 0)]) for titulo, chave in LINHAS_RESUMO]
+        linhas_resumo.append(_linha_xlsx(['Catálogo de Preços', orcamento.get('versao_catalogo') or 'N/A']))
+        zf.writestr('xl/worksheets/sheet1.xml', _XLSX_INICIO_PLANILHA + ''.join(linhas_resumo) + _XLSX_FIM_PLANILHA)
+        yield destino.drenar()
+        
+        with zf.open('xl/worksheets/sheet2.xml', 'w') as planilha:
+            planilha.write(_XLSX_INICIO_PLANILHA.encode())
+            planilha.write(_linha_xlsx([titulo for titulo, _ in COLUNAS_COMPONENTES]).encode())
+            
+            for comp in orcamento.get('componentes', []):
+                planilha.write(_linha_xlsx([_valor_componente(comp, chave) for _, chave in COLUNAS_COMPONENTES]).encode())
+                pedaco = destino.drenar()
+                if pedaco:
+                    yield pedaco
+            
+            planilha.write(_XLSX_FIM_PLANILHA.encode())
+    
+    yield destino.drenar()
+
+# formato -> (gerador, extensão, mime)
+FORMATOS: Dict[str, Tuple[Callable[[Dict], Iterator], str, str]] = {
+    'txt': (iter_txt, 'txt', 'text/plain'),
+    'json': (iter_json, 'json', 'application/json'),
+    'csv': (iter_csv, 'csv', 'text/csv'),
+    'xlsx': (iter_xlsx, 'xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'html': (iter_html, 'html', 'text/html')
+}
+
+_cache_exportacoes: 'OrderedDict[Tuple[str, str], bytes]' = OrderedDict()
+_tamanho_cache = 0
+_lock_cache = threading.Lock()
+
+def iter_exportacao(orcamento: Dict, formato: str) -> Iterator[bytes]:
+    """Pedaços em bytes do arquivo exportado, gerados sob demanda"""
+    
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato de exportação desconhecido: {formato}")
+    
+    gerador = FORMATOS[formato][0]
+    for pedaco in gerador(orcamento):
+        yield pedaco if isinstance(pedaco, bytes) else pedaco.encode('utf-8')
+
+def exportar(orcamento: Dict, formato: str) -> bytes:
+    """Arquivo exportado completo, gerado uma vez por orçamento e formato
+    
+    Fica num cache LRU do processo (limitado em bytes) indexado pelo hash
+    do orçamento, então reruns do Streamlit não regeram o arquivo.
+    """
+    
+    global _tamanho_cache
+    
+    chave = (chave_orcamento(orcamento), formato)
+    
+    with _lock_cache:
+        dados = _cache_exportacoes.get(chave)
+        if dados is not None:
+            _cache_exportacoes.move_to_end(chave)
+            return dados
+    
+    dados = b''.join(iter_exportacao(orcamento, formato))
+    
+    with _lock_cache:
+        if chave not in _cache_exportacoes and len(dados) <= TAMANHO_MAXIMO_CACHE:
+            _cache_exportacoes[chave] = dados
+            _tamanho_cache += len(dados)
+            
+            while _tamanho_cache > TAMANHO_MAXIMO_CACHE:
+                _, removido = _cache_exportacoes.popitem(last=False)
+                _tamanho_cache -= len(removido)
+    
+    return dados
+
+def exportar_para_arquivo(orcamento: Dict, formato: str, caminho: str) -> int:
+    """Grava o arquivo exportado em disco em fluxo (sem montá-lo em memória)"""
+    
+    total = 0
+    with open(caminho, 'wb') as f:
+        for pedaco in iter_exportacao(orcamento, formato):
+            f.write(pedaco)
+            total += len(pedaco)
+    
+    return total
+
+def nome_arquivo_exportacao(formato: str, sufixo: str) -> str:
+    """Nome do arquivo de download para o formato"""
+    return f"orcamento_orca_{sufixo}.{FORMATOS[formato][1]}"
+
+def mime_exportacao(formato: str) -> str:
+    """Tipo MIME do formato"""
+    return FORMATOS[formato][2]
@@ -0,0 +1,463 @@
+"""
+Migrações do Banco - Orca Interiores
+Schema versionado pela tabela schema_version: cada migração roda uma única
+vez, em ordem, e é idempotente (pode ser reaplicada sobre bancos antigos
+criados antes do versionamento)
+"""
+
+import json
+import sqlite3
+from typing import Callable, List, Tuple
+
+from busca import textos_busca_payload, token_usuario
+from serializacao import ErroSerializacao, hash_conteudo, serializar_orcamento
+
+# Orçamentos lidos por lote nas migrações e reparos de dados
+LOTE_MIGRACAO = 500
+
+def _adicionar_coluna(cursor: sqlite3.Cursor, tabela: str, coluna: str, definicao: str):
+    """ALTER TABLE ADD COLUMN só se a coluna ainda não existir"""
+    
+    colunas = {linha[1] for linha in cursor.execute(f"PRAGMA table_info({tabela})")}
+    if coluna not in colunas:
+        cursor.execute(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {definicao}")
+
+def _tabelas_iniciais(cursor: sqlite3.Cursor):
+    """Tabelas de usuários, sessões e orçamentos"""
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT UNIQUE NOT NULL,
+            senha_hash TEXT NOT NULL,
+            plano TEXT DEFAULT 'basico',
+            data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            data_ultimo_login TIMESTAMP,
+            ativo BOOLEAN DEFAULT 1,
+            orcamentos_mes INTEGER DEFAULT 0,
+            limite_orcamentos INTEGER DEFAULT 10
+        )
+    """)
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sessoes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER,
+            token TEXT UNIQUE NOT NULL,
+            data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            data_expiracao TIMESTAMP NOT NULL,
+            ativo BOOLEAN DEFAULT 1,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
+        )
+    """)
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS orcamentos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER,
+            nome_arquivo TEXT,
+            valor_final REAL,
+            area_total REAL,
+            data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            dados_json TEXT,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
+        )
+    """)
+
+def _coluna_dados_bin(cursor: sqlite3.Cursor):
+    """Orçamento no formato binário compacto (serializacao.py)"""
+    _adicionar_coluna(cursor, 'orcamentos', 'dados_bin', 'BLOB')
+
+def _indices_consultas(cursor: sqlite3.Cursor):
+    """Índices das consultas por usuário (histórico, estatísticas, sessões)"""
+    
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_orcamentos_usuario_data
+        ON orcamentos (usuario_id, data_criacao)
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessoes_usuario ON sessoes (usuario_id)")
+
+def _indice_expiracao_sessoes(cursor: sqlite3.Cursor):
+    """Índice da limpeza em lote de sessões vencidas"""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessoes_expiracao ON sessoes (data_expiracao)")
+
+def _estatisticas_usuario(cursor: sqlite3.Cursor):
+    """Estatísticas por usuário mantidas por triggers na mesma transação do INSERT"""
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS estatisticas_usuario (
+            usuario_id INTEGER PRIMARY KEY,
+            total_orcamentos INTEGER NOT NULL DEFAULT 0,
+            qtd_valor INTEGER NOT NULL DEFAULT 0,
+            soma_valor REAL NOT NULL DEFAULT 0,
+            soma_area REAL NOT NULL DEFAULT 0,
+            ultimo_orcamento TIMESTAMP
+        )
+    """)
+    
+    # Entrada de um orçamento (usada no INSERT e no lado NEW do UPDATE)
+    somar = """
+        INSERT INTO estatisticas_usuario
+            (usuario_id, total_orcamentos, qtd_valor, soma_valor, soma_area, ultimo_orcamento)
+        SELECT NEW.usuario_id, 1, NEW.valor_final IS NOT NULL, COALESCE(NEW.valor_final, 0),
+               COALESCE(NEW.area_total, 0), NEW.data_criacao
+        WHERE NEW.usuario_id IS NOT NULL
+        ON CONFLICT (usuario_id) DO UPDATE SET
+            total_orcamentos = total_orcamentos + 1,
+            qtd_valor = qtd_valor + excluded.qtd_valor,
+            soma_valor = soma_valor + excluded.soma_valor,
+            soma_area = soma_area + excluded.soma_area,
+            ultimo_orcamento = CASE
+                WHEN ultimo_orcamento IS NULL OR excluded.ultimo_orcamento > ultimo_orcamento
+                THEN excluded.ultimo_orcamento ELSE ultimo_orcamento END;
+    """
+    
+    # Saída de um orçamento (DELETE e lado OLD do UPDATE); o último orçamento
+    # é relido pelo índice (usuario_id, data_criacao)
+    subtrair = """
+        UPDATE estatisticas_usuario SET
+            total_orcamentos = total_orcamentos - 1,
+            qtd_valor = qtd_valor - (OLD.valor_final IS NOT NULL),
+            soma_valor = soma_valor - COALESCE(OLD.valor_final, 0),
+            soma_area = soma_area - COALESCE(OLD.area_total, 0),
+            ultimo_orcamento = (SELECT MAX(data_criacao) FROM orcamentos WHERE usuario_id = OLD.usuario_id)
+        WHERE usuario_id = OLD.usuario_id AND OLD.usuario_id IS NOT NULL;
+    """
+    
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_estatisticas_insert AFTER INSERT ON orcamentos
+        BEGIN {somar} END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_estatisticas_delete AFTER DELETE ON orcamentos
+        BEGIN {subtrair} END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_estatisticas_update
+        AFTER UPDATE OF usuario_id, valor_final, area_total, data_criacao ON orcamentos
+        BEGIN {subtrair} {somar} END
+    """)
+    
+    reconstruir_estatisticas(cursor)
+
+def _uso_por_periodo(cursor: sqlite3.Cursor):
+    """Período de cobrança do contador (reset preguiçoso) e histórico de uso por período"""
+    
+    _adicionar_coluna(cursor, 'usuarios', 'periodo_uso', 'TEXT')
+    
+    # Contadores atuais pertencem ao mês corrente
+    cursor.execute("UPDATE usuarios SET periodo_uso = strftime('%Y-%m', 'now') WHERE periodo_uso IS NULL")
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS uso_periodo (
+            usuario_id INTEGER NOT NULL,
+            periodo TEXT NOT NULL,
+            orcamentos INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (usuario_id, periodo)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        INSERT OR IGNORE INTO uso_periodo (usuario_id, periodo, orcamentos)
+        SELECT id, periodo_uso, orcamentos_mes FROM usuarios WHERE orcamentos_mes > 0
+    """)
+    
+    # Cada incremento do contador soma no período (na mesma transação);
+    # zerar o contador não apaga o histórico
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_uso_periodo
+        AFTER UPDATE OF orcamentos_mes, periodo_uso ON usuarios
+        WHEN NEW.periodo_uso IS NOT NULL
+         AND NEW.orcamentos_mes > CASE WHEN OLD.periodo_uso IS NEW.periodo_uso THEN OLD.orcamentos_mes ELSE 0 END
+        BEGIN
+            INSERT INTO uso_periodo (usuario_id, periodo, orcamentos)
+            VALUES (NEW.id, NEW.periodo_uso,
+                    NEW.orcamentos_mes - CASE WHEN OLD.periodo_uso IS NEW.periodo_uso THEN OLD.orcamentos_mes ELSE 0 END)
+            ON CONFLICT (usuario_id, periodo) DO UPDATE SET orcamentos = orcamentos + excluded.orcamentos;
+        END
+    """)
+
+def _blobs_orcamento(cursor: sqlite3.Cursor):
+    """Payloads fora de orcamentos: tabela de blobs endereçada pelo hash do conteúdo
+    
+    orcamentos fica só com as colunas pequenas (listagens e estatísticas
+    leem páginas densas); payloads idênticos são gravados uma única vez.
+    O espaço das colunas antigas só volta ao sistema após um VACUUM.
+    """
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS blobs_orcamento (
+            hash BLOB PRIMARY KEY,
+            dados BLOB NOT NULL
+        )
+    """)
+    _adicionar_coluna(cursor, 'orcamentos', 'dados_hash', 'BLOB')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orcamentos_dados_hash ON orcamentos (dados_hash)")
+    
+    # Mover payloads existentes; JSON legado é convertido para o formato
+    # binário (comprimido). JSON ilegível fica onde está.
+    ultimo_id = 0
+    while True:
+        linhas = cursor.execute("""
+            SELECT id, dados_bin, dados_json FROM orcamentos
+            WHERE id > ? AND dados_hash IS NULL AND (dados_bin IS NOT NULL OR dados_json IS NOT NULL)
+            ORDER BY id LIMIT ?
+        """, (ultimo_id, LOTE_MIGRACAO)).fetchall()
+        if not linhas:
+            break
+        
+        movidos = []
+        for orcamento_id, dados_bin, dados_json in linhas:
+            dados = dados_bin
+            if dados is None:
+                try:
+                    dados = serializar_orcamento(json.loads(dados_json))
+                except (ValueError, TypeError, AttributeError, ErroSerializacao):
+                    continue
+            movidos.append((orcamento_id, hash_conteudo(dados), dados))
+        
+        cursor.executemany("INSERT OR IGNORE INTO blobs_orcamento (hash, dados) VALUES (?, ?)",
+                           [(h, dados) for _, h, dados in movidos])
+        cursor.executemany("UPDATE orcamentos SET dados_hash = ?, dados_bin = NULL, dados_json = NULL WHERE id = ?",
+                           [(h, orcamento_id) for orcamento_id, h, _ in movidos])
+        ultimo_id = linhas[-1][0]
+
+def _busca_orcamentos(cursor: sqlite3.Cursor):
+    """Índice FTS5 do histórico: nome do arquivo, nomes e tipos dos componentes
+    
+    rowid = id do orçamento. A coluna usuario guarda o token 'u<id>', assim a
+    busca de um usuário cruza listas de postings em vez de filtrar depois.
+    Inserções são indexadas pelo AuthManager (o texto vem do payload);
+    exclusões e renomeações, pelos gatilhos abaixo.
+    """
+    
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS busca_orcamentos USING fts5(
+            nome_arquivo, componentes, tipos, usuario,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    """)
+    
+    # Ranking: nome do arquivo pesa mais que componentes; o token do usuário não conta
+    cursor.execute("INSERT INTO busca_orcamentos (busca_orcamentos, rank) VALUES ('rank', 'bm25(10.0, 2.0, 1.0, 0.0)')")
+    
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_busca_orcamentos_delete
+        AFTER DELETE ON orcamentos
+        BEGIN
+            DELETE FROM busca_orcamentos WHERE rowid = OLD.id;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_busca_orcamentos_update
+        AFTER UPDATE OF nome_arquivo, usuario_id ON orcamentos
+        BEGIN
+            UPDATE busca_orcamentos
+            SET nome_arquivo = NEW.nome_arquivo, usuario = 'u' || NEW.usuario_id
+            WHERE rowid = NEW.id;
+        END
+    """)
+    
+    reconstruir_busca(cursor)
+
+def _diretorio_shards(cursor: sqlite3.Cursor):
+    """Diretório de shards: arquivo de orçamentos de cada usuário e configuração
+    
+    usuarios.shard é o caminho do arquivo relativo à pasta do banco central
+    (NULL = não atribuído). Nos arquivos de shard a coluna fica sem uso.
+    """
+    
+    _adicionar_coluna(cursor, 'usuarios', 'shard', 'TEXT')
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS configuracao (
+            chave TEXT PRIMARY KEY,
+            valor TEXT
+        )
+    """)
+
+def _alteracoes_planos(cursor: sqlite3.Cursor):
+    """Registro de trocas de plano: versão dos caches de plano entre processos
+    
+    Cada alterar_plano insere uma linha; a maior versao é o contador que os
+    processos consultam para descartar os planos em cache desses usuários.
+    AUTOINCREMENT: a versão nunca volta, mesmo depois da limpeza das antigas.
+    """
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS alteracoes_planos (
+            versao INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER NOT NULL,
+            data_alteracao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+# Ordem de aplicação: (versão, descrição, função)
+MIGRACOES: List[Tuple[int, str, Callable[[sqlite3.Cursor], None]]] = [
+    (1, "Tabelas iniciais", _tabelas_iniciais),
+    (2, "Coluna dados_bin em orcamentos", _coluna_dados_bin),
+    (3, "Índices de histórico e sessões", _indices_consultas),
+    (4, "Índice de expiração de sessões", _indice_expiracao_sessoes),
+    (5, "Estatísticas materializadas por usuário", _estatisticas_usuario),
+    (6, "Período de cobrança e uso por período", _uso_por_periodo),
+    (7, "Repositório de blobs dos orçamentos", _blobs_orcamento),
+    (8, "Busca FTS5 no histórico", _busca_orcamentos),
+    (9, "Diretório de shards", _diretorio_shards),
+    (10, "Versão dos caches de plano", _alteracoes_planos),
+]
+
+def reconstruir_estatisticas(cursor: sqlite3.Cursor) -> int:
+    """Recalcula estatisticas_usuario do zero a partir de orcamentos (reparo)"""
+    
+    cursor.execute("DELETE FROM estatisticas_usuario")
+    cursor.execute("""
+        INSERT INTO estatisticas_usuario
+            (usuario_id, total_orcamentos, qtd_valor, soma_valor, soma_area, ultimo_orcamento)
+        SELECT usuario_id, COUNT(*), COUNT(valor_final), COALESCE(SUM(valor_final), 0),
+               COALESCE(SUM(area_total), 0), MAX(data_criacao)
+        FROM orcamentos
+        WHERE usuario_id IS NOT NULL
+        GROUP BY usuario_id
+    """)
+    return cursor.rowcount
+
+def reconstruir_busca(cursor: sqlite3.Cursor) -> int:
+    """Reindexa busca_orcamentos do zero a partir de orcamentos (reparo)
+    
+    Cada payload distinto é decodificado uma vez (só as colunas de nome e
+    tipo); payload ilegível indexa só o nome do arquivo.
+    """
+    
+    cursor.execute("DELETE FROM busca_orcamentos")
+    
+    textos = {}
+    indexados = 0
+    ultimo_id = 0
+    while True:
+        linhas = cursor.execute("""
+            SELECT o.id, o.usuario_id, o.nome_arquivo, o.dados_hash, COALESCE(b.dados, o.dados_bin, o.dados_json)
+            FROM orcamentos o
+            LEFT JOIN blobs_orcamento b ON b.hash = o.dados_hash
+            WHERE o.id > ?
+            ORDER BY o.id LIMIT ?
+        """, (ultimo_id, LOTE_MIGRACAO)).fetchall()
+        if not linhas:
+            break
+        
+        registros = []
+        for orcamento_id, usuario_id, nome_arquivo, dados_hash, dados in linhas:
+            chave = dados_hash if dados_hash is not None else orcamento_id
+            if chave not in textos:
+                try:
+                    textos[chave] = textos_busca_payload(dados) if dados else ('', '')
+                except (ValueError, TypeError, AttributeError, KeyError):
+                    textos[chave] = ('', '')
+            
+            nomes, tipos = textos[chave]
+            registros.append((orcamento_id, nome_arquivo or '', nomes, tipos, token_usuario(usuario_id)))
+        
+        cursor.executemany("""
+            INSERT INTO busca_orcamentos (rowid, nome_arquivo, componentes, tipos, usuario)
+            VALUES (?, ?, ?, ?, ?)
+        """, registros)
+        indexados += len(registros)
+        ultimo_id = linhas[-1][0]
+        
+        # Cache de textos limitado: a memória não cresce com o banco
+        if len(textos) > 10 * LOTE_MIGRACAO:
+            textos.clear()
+    
+    return indexados
+
+def limpar_blobs_orfaos(cursor: sqlite3.Cursor) -> int:
+    """Remove payloads que nenhum orçamento referencia mais; retorna quantos"""
+    
+    cursor.execute("""
+        DELETE FROM blobs_orcamento
+        WHERE NOT EXISTS (SELECT 1 FROM orcamentos o WHERE o.dados_hash = blobs_orcamento.hash)
+    """)
+    return cursor.rowcount
+
+def versao_schema(conn: sqlite3.Connection) -> int:
+    """Última migração aplicada (0 = banco sem versionamento)"""
+    
+    existe = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+    ).fetchone()
+    if not existe:
+        return 0
+    
+    return conn.execute("SELECT COALESCE(MAX(versao), 0) FROM schema_version").fetchone()[0]
+
+def aplicar_migracoes(conn: sqlite3.Connection) -> List[int]:
+    """Aplica as migrações pendentes numa única transação; retorna as versões aplicadas
+    
+    BEGIN IMMEDIATE reserva a escrita antes de ler a versão: se dois
+    processos sobem juntos, o segundo espera e não encontra nada pendente.
+    """
+    
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                versao INTEGER PRIMARY KEY,
+                descricao TEXT,
+                aplicada_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        atual = versao_schema(conn)
+        aplicadas = []
+        
+        for versao, descricao, migracao in MIGRACOES:
+            if versao <= atual:
+                continue
+            
+            migracao(cursor)
+            cursor.execute("INSERT INTO schema_version (versao, descricao) VALUES (?, ?)", (versao, descricao))
+            aplicadas.append(versao)
+        
+        conn.commit()
+        return aplicadas
+    
+    except Exception:
+        conn.rollback()
+        raise
+
+if __name__ == "__main__":
+    import sys
+    
+    argumentos = [a for a in sys.argv[1:] if not a.startswith('--')]
+    db_path = argumentos[0] if argumentos else "usuarios.db"
+    
+    with sqlite3.connect(db_path) as conn:
+        antes = versao_schema(conn)
+        aplicadas = aplicar_migracoes(conn)
+        
+        usuarios_reconstruidos = None
+        if '--reconstruir-estatisticas' in sys.argv:
+            usuarios_reconstruidos = reconstruir_estatisticas(conn.cursor())
+            conn.commit()
+        
+        orcamentos_indexados = None
+        if '--reconstruir-busca' in sys.argv:
+            orcamentos_indexados = reconstruir_busca(conn.cursor())
+            conn.commit()
+        
+        blobs_removidos = None
+        if '--limpar-blobs' in sys.argv:
+            blobs_removidos = limpar_blobs_orfaos(conn.cursor())
+            conn.commit()
+    
+    print(f"🗄️ Migrações - {db_path}")
+    print("=" * 50)
+    print(f"📌 Versão anterior: {antes}")
+    print(f"✅ Aplicadas: {aplicadas or 'nenhuma (schema em dia)'}")
+    if usuarios_reconstruidos is not None:
+        print(f"📊 Estatísticas reconstruídas para {usuarios_reconstruidos} usuários")
+    if orcamentos_indexados is not None:
+        print(f"🔎 Busca reindexada: {orcamentos_indexados} orçamentos")
+    if blobs_removidos is not None:
+        print(f"🧹 Payloads órfãos removidos: {blobs_removidos}")
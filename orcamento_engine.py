@@ -2,144 +2,467 @@
 Engine de Orçamento - Preços de Fábrica FINAL
 Sistema calibrado para R$ 9.000 base (preço real de fábrica)
 Versão: 5.0 Fábrica Final
+
+Plotly só é importado na primeira geração de gráfico: o cálculo de
+preços pode ser usado sem as bibliotecas de visualização.
 """
 
-import plotly.express as px
-import plotly.graph_objects as go
+import numpy as np
+import hashlib
+import json
+import threading
+from collections import OrderedDict
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from catalogo_precos import CatalogoPrecos, obter_catalogo
+
+# Gráficos disponíveis, na ordem de exibição
+GRAFICOS_DISPONIVEIS = ('distribuicao', 'comparacao', 'componentes')
+
+# Acima disso o gráfico de componentes agrupa por tipo
+LIMITE_BARRAS_COMPONENTES = 30
+
+# Cache LRU de especificações de figuras: (hash do orçamento, gráfico) -> JSON
+TAMANHO_CACHE_GRAFICOS = 64
+_cache_graficos: 'OrderedDict[Tuple[str, str], str]' = OrderedDict()
+_lock_cache_graficos = threading.Lock()
+
+class ErroOrcamento(Exception):
+    """Erro de cálculo de um orçamento (análise vazia, sem componentes válidos...)"""
 
 class OrcamentoEngineFabricaFinal:
     """Engine calibrado para preços reais de fábrica (R$ 9.000 base)"""
     
-    def __init__(self):
-        """Inicializa o engine com preços REAIS de fábrica"""
-        
-        # Preços base de FÁBRICA (calibrados para R$ 9.000)
-        self.precos_materiais = {
-            'mdf_15mm': 208.00,        # Base fábrica
-            'mdf_18mm': 227.50,        # Base fábrica
-            'compensado_15mm': 182.00, # Base fábrica
-            'compensado_18mm': 201.50, # Base fábrica
-            'melamina_15mm': 247.00,   # Base fábrica
-            'melamina_18mm': 266.50    # Base fábrica
-        }
+    def __init__(self, catalogo: Optional[CatalogoPrecos] = None):
+        """Inicializa o engine com preços REAIS de fábrica
         
-        # Multiplicadores ajustados para fábrica
-        self.multiplicadores_tipo = {
-            'armario': 1.0,        # Base
-            'despenseiro': 1.6,    # Torres altas
-            'balcao': 1.2,         # Móveis baixos
-            'gaveteiro': 1.4,      # Com gavetas
-            'prateleira': 0.7,     # Prateleiras
-            'porta': 1.0,          # Portas
-            'gaveta': 1.2          # Gavetas individuais
-        }
-        
-        # Multiplicadores por complexidade (fábrica)
-        self.multiplicadores_complexidade = {
-            'simples': 1.0,
-            'media': 1.1,          
-            'complexa': 1.25,      
-            'premium': 1.4         
-        }
-        
-        # Configurações calibradas para R$ 9.000
-        self.config = {
-            'fator_desperdicio': 0.05,      # 5% (fábrica eficiente)
-            'percentual_paineis_extras': 0.15,  # 15% (otimizado)
-            'percentual_montagem': 0.0,     # 0% (fábrica não instala)
-            'fator_calibracao_geral': 1.192, # Calibrado para R$ 9.000
-            'custo_acessorios_por_m2': {
-                'comum': 16.00,             # Preço fábrica
-                'premium': 26.00            # Preço fábrica premium
-            }
-        }
+        Sem catálogo fixo, usa o catálogo compartilhado do processo
+        (catalogo_precos.json), que é recarregado quando o arquivo muda.
+        """
+        self._catalogo = catalogo
+    
+    @property
+    def catalogo(self) -> CatalogoPrecos:
+        """Catálogo de preços em uso (fixo ou o compartilhado do processo)"""
+        return self._catalogo or obter_catalogo()
+    
+    @property
+    def precos_materiais(self):
+        """Preços base de FÁBRICA por m² (calibrados para R$ 9.000)"""
+        return self.catalogo.precos_materiais
+    
+    @property
+    def multiplicadores_tipo(self):
+        """Multiplicadores ajustados para fábrica por tipo de móvel"""
+        return self.catalogo.multiplicadores_tipo
+    
+    @property
+    def multiplicadores_complexidade(self):
+        """Multiplicadores por complexidade (fábrica)"""
+        return self.catalogo.multiplicadores_complexidade
+    
+    @property
+    def config(self):
+        """Configurações calibradas para R$ 9.000"""
+        return self.catalogo.config
     
     def calcular_orcamento_completo(self, analise: Dict, configuracoes: Dict) -> Optional[Dict]:
         """Calcula orçamento com base REAL de fábrica (R$ 9.000)"""
         
         try:
-            componentes = analise.get('componentes', [])
+            base = self.calcular_custo_base(analise, configuracoes)
+            if not base:
+                return None
+            
+            return base.orcamento(configuracoes)
+        
+        except Exception as e:
+            print(f"Erro no cálculo do orçamento: {e}")
+            return None
+    
+    def calcular_custo_base(self, analise: Dict, configuracoes: Dict) -> Optional['CustoBaseOrcamento']:
+        """Calcula o custo base de fábrica, reutilizável para qualquer margem"""
+        
+        try:
+            return self._calcular_custo_base(analise, configuracoes)
+        
+        except ErroOrcamento:
+            return None
+        except Exception as e:
+            print(f"Erro no cálculo do custo base: {e}")
+            return None
+    
+    def _calcular_custo_base(self, analise: Dict, configuracoes: Dict) -> 'CustoBaseOrcamento':
+        """Calcula o custo base levantando ErroOrcamento em vez de retornar None"""
+        
+        componentes = analise.get('componentes', [])
+        if not componentes:
+            raise ErroOrcamento("Análise sem componentes")
+        
+        # Mesma versão do catálogo para todo o orçamento
+        catalogo = self.catalogo
+        
+        # Extrair configurações (a margem não influencia a base)
+        material = configuracoes.get('material', 'mdf_18mm')
+        complexidade = configuracoes.get('complexidade', 'media')
+        qualidade_acessorios = configuracoes.get('qualidade_acessorios', 'comum')
+        
+        # Calcular cada componente
+        componentes_calculados = []
+        custo_total_material = 0
+        area_total = 0
+        
+        # Colunas para as agregações por tipo/material (mesma passada)
+        colunas = {'tipo': [], 'material': [], 'area': [], 'custo': [], 'confianca': []}
+        
+        for comp in componentes:
+            resultado_comp = self._calcular_componente(
+                comp, material, complexidade, qualidade_acessorios, catalogo
+            )
+            
+            if resultado_comp:
+                componentes_calculados.append(resultado_comp)
+                custo_total_material += resultado_comp['custo_total']
+                area_total += resultado_comp['area_m2']
+                
+                colunas['tipo'].append(resultado_comp['tipo'])
+                colunas['material'].append(resultado_comp['material_usado'])
+                colunas['area'].append(resultado_comp['area_m2'])
+                colunas['custo'].append(resultado_comp['custo_total'])
+                colunas['confianca'].append(resultado_comp['ia_confianca'])
+        
+        if not componentes_calculados:
+            raise ErroOrcamento("Nenhum componente com área válida")
+        
+        # Aplicar fator de calibração para R$ 9.000
+        custo_total_material *= catalogo.config['fator_calibracao_geral']
+        
+        # Calcular custos adicionais
+        custo_paineis_extras = custo_total_material * catalogo.config['percentual_paineis_extras']
+        custo_montagem = 0  # Fábrica não instala
+        
+        return CustoBaseOrcamento(
+            componentes=componentes_calculados,
+            configuracoes=configuracoes,
+            area_total=area_total,
+            custo_material=custo_total_material,
+            custo_paineis_extras=custo_paineis_extras,
+            custo_montagem=custo_montagem,
+            fator_mercado=catalogo.config['fator_preco_mercado'],
+            versao_catalogo=catalogo.versao,
+            agregacoes=_agregar_colunas(colunas)
+        )
+    
+    def calcular_orcamentos_em_lote(self, itens: Iterable[Tuple[Dict, Dict]],
+                                    max_workers: Optional[int] = None,
+                                    tamanho_bloco: int = 32) -> Iterator[Dict]:
+        """Calcula muitos orçamentos (análise, configurações) em paralelo
+        
+        Análises idênticas com o mesmo material/complexidade/acessórios são
+        precificadas uma única vez; a margem de cada item é aplicada sobre a
+        base compartilhada. Os blocos são distribuídos num pool de processos
+        (max_workers=1 calcula no próprio processo) e os resultados saem à
+        medida que ficam prontos, como dicts com 'indice', 'orcamento' e
+        'erro' (None em caso de sucesso).
+        """
+        
+        # Todo o lote usa a mesma versão do catálogo
+        motor = OrcamentoEngineFabricaFinal(self.catalogo)
+        
+        # Deduplicar por análise + configurações que afetam a base
+        tarefas = {}
+        itens_por_chave = {}
+        
+        for indice, (analise, configuracoes) in enumerate(itens):
+            try:
+                chave = _chave_custo_base(analise, configuracoes)
+            except Exception as e:
+                yield {'indice': indice, 'orcamento': None, 'erro': f"Item inválido: {e}"}
+                continue
+            
+            if chave not in tarefas:
+                tarefas[chave] = (analise, configuracoes)
+                itens_por_chave[chave] = []
+            itens_por_chave[chave].append((indice, configuracoes))
+        
+        chaves = list(tarefas)
+        blocos = [
+            [(chave, *tarefas[chave]) for chave in chaves[i:i + tamanho_bloco]]
+            for i in range(0, len(chaves), tamanho_bloco)
+        ]
+        
+        def resultados_do_bloco(resultados):
+            for chave, base, erro in resultados:
+                for indice, configuracoes in itens_por_chave[chave]:
+                    if erro:
+                        yield {'indice': indice, 'orcamento': None, 'erro': erro}
+                    else:
+                        yield {'indice': indice, 'orcamento': base.orcamento(configuracoes), 'erro': None}
+        
+        if max_workers == 1 or len(blocos) <= 1:
+            for bloco in blocos:
+                yield from resultados_do_bloco(_precificar_bloco(motor, bloco))
+            return
+        
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futuros = {executor.submit(_precificar_bloco, motor, bloco): bloco for bloco in blocos}
+            
+            for futuro in as_completed(futuros):
+                try:
+                    resultados = futuro.result()
+                except Exception as e:
+                    resultados = [(chave, None, f"Falha no processo de cálculo: {e}") 
+                                  for chave, _, _ in futuros[futuro]]
+                yield from resultados_do_bloco(resultados)
+    
+    def precificar_colunas(self, areas: np.ndarray, codigos_tipo: np.ndarray,
+                           indice_orcamento: np.ndarray, codigos_material: np.ndarray,
+                           codigos_complexidade: np.ndarray, codigos_acessorios: np.ndarray,
+                           margens_pct: np.ndarray) -> np.ndarray:
+        """Precifica muitos orçamentos de uma vez a partir de dados em colunas
+        
+        Arrays por componente: areas, codigos_tipo (catalogo.codificar_tipos)
+        e indice_orcamento (posição do orçamento dono). Arrays por orçamento:
+        códigos de material/complexidade/acessórios do catálogo (-1 = valor
+        desconhecido, tratado como em _calcular_componente) e margens em %.
+        Retorna o valor final de cada orçamento (NaN se nenhum componente
+        tiver área válida).
+        """
+        
+        catalogo = self.catalogo
+        config = catalogo.config
+        n = len(margens_pct)
+        
+        # Valores por orçamento, com os mesmos padrões do cálculo unitário
+        codigos_material = np.where(codigos_material >= 0, codigos_material,
+                                    catalogo.indice_material['mdf_18mm'])
+        preco_material = catalogo.tabela_precos_materiais[codigos_material]
+        mult_complexidade = np.where(codigos_complexidade >= 0,
+                                     catalogo.tabela_multiplicadores_complexidade[codigos_complexidade], 1.0)
+        custo_acessorios = np.where(codigos_acessorios >= 0,
+                                    catalogo.tabela_acessorios[codigos_acessorios], 16.00)
+        
+        # Custo de cada componente (área <= 0 é ignorada)
+        validos = areas > 0
+        areas = areas[validos]
+        dono = indice_orcamento[validos]
+        preco_m2 = (preco_material[dono] * catalogo.tabela_multiplicadores_tipo[codigos_tipo[validos]]
+                    * mult_complexidade[dono])
+        custos = areas * (1 + config['fator_desperdicio']) * preco_m2 + areas * custo_acessorios[dono]
+        
+        custo_material = np.bincount(dono, weights=custos, minlength=n) * config['fator_calibracao_geral']
+        custo_base = custo_material * (1 + config['percentual_paineis_extras'])
+        valores = custo_base * (1 + np.asarray(margens_pct, dtype=float) / 100)
+        
+        return np.where(np.bincount(dono, minlength=n) > 0, valores, np.nan)
+    
+    def simular_incerteza(self, analise: Dict, configuracoes: Dict,
+                          n_simulacoes: int = 10000, semente: Optional[int] = None) -> Optional[Dict]:
+        """Simulação Monte Carlo do preço final sobre a confiança da IA
+        
+        Cada sorteio perturba a área de cada componente (desvio maior quanto
+        menor a confiança ou se a dimensão foi marcada como inválida) e, com
+        probabilidade 1 - confiança, troca o tipo por outro tipo do catálogo.
+        Retorna P10/P50/P90 do valor final e os componentes que mais
+        contribuem para a variância.
+        """
+        
+        try:
+            componentes = [c for c in analise.get('componentes', []) if c.get('area_m2', 0) > 0]
             if not componentes:
                 return None
             
-            # Extrair configurações
             material = configuracoes.get('material', 'mdf_18mm')
             complexidade = configuracoes.get('complexidade', 'media')
             qualidade_acessorios = configuracoes.get('qualidade_acessorios', 'comum')
             margem_lucro = configuracoes.get('margem_lucro', 30) / 100
+            catalogo = self.catalogo
+            
+            # Dados dos componentes em colunas
+            areas = np.array([c['area_m2'] for c in componentes], dtype=float)
+            confiancas = np.array([
+                c['ia_confianca'] if c.get('ia_confianca') is not None else 1.0
+                for c in componentes
+            ], dtype=float).clip(0.0, 1.0)
+            dimensao_invalida = np.array([
+                c.get('ia_validacao', {}).get('dimensao_valida') is False for c in componentes
+            ])
+            
+            # Tabelas compiladas do catálogo (última posição = tipo desconhecido)
+            n_tipos = len(catalogo.tipos)
+            multiplicadores = catalogo.tabela_multiplicadores_tipo[:n_tipos]
+            mult_atual = catalogo.tabela_multiplicadores_tipo[
+                catalogo.codificar_tipos(c.get('tipo', 'armario') for c in componentes)
+            ]
             
-            # Calcular cada componente
-            componentes_calculados = []
-            custo_total_material = 0
-            area_total = 0
+            # Desvio relativo da área por componente
+            sigma = catalogo.config['incerteza_area_base'] + catalogo.config['incerteza_area_confianca'] * (1 - confiancas)
+            sigma = np.where(dimensao_invalida, sigma * catalogo.config['fator_incerteza_dimensao_invalida'], sigma)
             
-            for comp in componentes:
-                resultado_comp = self._calcular_componente(
-                    comp, material, complexidade, qualidade_acessorios
-                )
+            # Constantes do preço
+            preco_base_m2 = catalogo.precos_materiais.get(material, catalogo.precos_materiais['mdf_18mm'])
+            mult_complexidade = catalogo.multiplicadores_complexidade.get(complexidade, 1.0)
+            preco_material_m2 = (1 + catalogo.config['fator_desperdicio']) * preco_base_m2 * mult_complexidade
+            custo_acessorios_m2 = catalogo.config['custo_acessorios_por_m2'].get(qualidade_acessorios, 16.00)
+            fator_final = (catalogo.config['fator_calibracao_geral']
+                           * (1 + catalogo.config['percentual_paineis_extras'])
+                           * (1 + margem_lucro))
+            
+            rng = np.random.default_rng(semente)
+            n = len(componentes)
+            
+            # Sorteios em blocos para limitar a memória (n componentes x bloco)
+            tamanho_bloco = max(1, min(n_simulacoes, 1_000_000 // n))
+            totais = np.empty(n_simulacoes)
+            soma_custos = np.zeros(n)
+            soma_custos_total = np.zeros(n)
+            
+            for inicio in range(0, n_simulacoes, tamanho_bloco):
+                s = min(tamanho_bloco, n_simulacoes - inicio)
+                
+                # Área com ruído log-normal de média preservada
+                ruido = rng.standard_normal((n, s)) * sigma[:, None] - (sigma[:, None] ** 2) / 2
+                areas_s = areas[:, None] * np.exp(ruido)
                 
-                if resultado_comp:
-                    componentes_calculados.append(resultado_comp)
-                    custo_total_material += resultado_comp['custo_total']
-                    area_total += resultado_comp['area_m2']
+                # Troca de tipo nos componentes de baixa confiança
+                trocar = rng.random((n, s)) < (1 - confiancas)[:, None]
+                sorteados = multiplicadores[rng.integers(0, n_tipos, (n, s))]
+                mult_s = np.where(trocar, sorteados, mult_atual[:, None])
+                
+                custos = areas_s * (preco_material_m2 * mult_s + custo_acessorios_m2) * fator_final
+                total = custos.sum(axis=0)
+                
+                totais[inicio:inicio + s] = total
+                soma_custos += custos.sum(axis=1)
+                soma_custos_total += custos @ total
             
-            if not componentes_calculados:
-                return None
+            # Contribuição de cada componente: cov(custo_i, total) / var(total)
+            media_total = totais.mean()
+            variancia_total = totais.var()
+            covariancias = soma_custos_total / n_simulacoes - (soma_custos / n_simulacoes) * media_total
+            contribuicoes = covariancias / variancia_total if variancia_total > 0 else np.zeros(n)
             
-            # Aplicar fator de calibração para R$ 9.000
-            custo_total_material *= self.config['fator_calibracao_geral']
-            
-            # Calcular custos adicionais
-            custo_paineis_extras = custo_total_material * self.config['percentual_paineis_extras']
-            custo_montagem = 0  # Fábrica não instala
-            
-            # Custo base de fábrica (R$ 9.000 para área de serviço padrão)
-            custo_base_fabrica = custo_total_material + custo_paineis_extras + custo_montagem
-            
-            # Aplicar margem do usuário
-            valor_lucro = custo_base_fabrica * margem_lucro
-            valor_final = custo_base_fabrica + valor_lucro
-            
-            # Calcular comparações
-            valor_mercado = custo_base_fabrica * 2.33  # Mercado é 133% mais caro
-            economia_cliente = valor_mercado - valor_final
-            
-            # Resumo
-            resumo = {
-                'valor_final': valor_final,
-                'area_total_m2': area_total,
-                'preco_por_m2': valor_final / area_total if area_total > 0 else 0,
-                'custo_base_fabrica': custo_base_fabrica,
-                'custo_material': custo_total_material,
-                'custo_paineis_extras': custo_paineis_extras,
-                'custo_montagem': custo_montagem,
-                'valor_lucro': valor_lucro,
-                'margem_lucro_pct': margem_lucro * 100,
-                'valor_mercado_estimado': valor_mercado,
-                'economia_cliente': economia_cliente,
-                'percentual_economia': (economia_cliente / valor_mercado) * 100 if valor_mercado > 0 else 0
-            }
+            ordem = np.argsort(-contribuicoes)
+            componentes_variancia = [
+                {
+                    'nome': componentes[i].get('nome', 'Componente'),
+                    'tipo': componentes[i].get('tipo', 'armario'),
+                    'ia_confianca': componentes[i].get('ia_confianca'),
+                    'contribuicao_variancia_pct': float(contribuicoes[i] * 100)
+                }
+                for i in ordem
+            ]
+            
+            p10, p50, p90 = np.percentile(totais, [10, 50, 90])
             
             return {
-                'resumo': resumo,
-                'componentes': componentes_calculados,
-                'configuracoes': configuracoes,
-                'timestamp': datetime.now().isoformat(),
-                'versao_engine': '5.0_fabrica_final',
-                'base_preco': 'fabrica_real'
+                'n_simulacoes': n_simulacoes,
+                'versao_catalogo': catalogo.versao,
+                'p10': float(p10),
+                'p50': float(p50),
+                'p90': float(p90),
+                'media': float(media_total),
+                'desvio_padrao': float(np.sqrt(variancia_total)),
+                'componentes_variancia': componentes_variancia
             }
+        
+        except Exception as e:
+            print(f"Erro na simulação de incerteza: {e}")
+            return None
+    
+    def resolver_preco_alvo(self, analise: Union[Dict, 'CustoBaseOrcamento'], valor_alvo: float,
+                            margem_minima: float = 0.0) -> Optional[Dict]:
+        """Margem que atinge exatamente o valor_alvo em cada combinação do catálogo
+        
+        O custo base é linear nos preços: para material m, complexidade c e
+        acessórios q, base = K * ((1 + desperdício) * preço[m] * mult[c] * S + acess[q] * A),
+        com S = soma(área * multiplicador do tipo) e A = soma(área). Assim a
+        margem sai em forma fechada, margem = (alvo / base - 1) * 100, para
+        todas as combinações de uma vez. Aceita a análise, um orçamento já
+        calculado (usa só área e tipo dos componentes) ou um CustoBaseOrcamento,
+        que guarda S e A: com ele o custo não depende do número de componentes.
+        
+        'pareto' traz as combinações com margem >= margem_minima que nenhuma
+        outra supera ao mesmo tempo em margem e em padrão (soma das posições
+        de cada opção na ordem de preço do catálogo).
+        """
+        
+        try:
+            catalogo = self.catalogo
+            config = catalogo.config
+            
+            # Somatórios que não dependem das escolhas
+            if isinstance(analise, CustoBaseOrcamento):
+                area_ponderada, area_total = analise.somas_area(catalogo)
+            else:
+                area_ponderada, area_total = _somas_area(analise.get('componentes', []), catalogo)
+            
+            if area_total <= 0 or valor_alvo <= 0:
+                return None
+            
+            # Base para todas as combinações: eixos (material, complexidade, acessórios)
+            precos = catalogo.tabela_precos_materiais
+            complexidades = catalogo.tabela_multiplicadores_complexidade
+            acessorios = catalogo.tabela_acessorios
+            fator = config['fator_calibracao_geral'] * (1 + config['percentual_paineis_extras'])
             
+            bases = fator * (
+                (1 + config['fator_desperdicio']) * area_ponderada * precos[:, None, None] * complexidades[None, :, None]
+                + area_total * acessorios[None, None, :]
+            )
+            margens = (valor_alvo / bases - 1) * 100
+            
+            # Padrão de cada combinação: posição de cada opção na ordem de preço
+            niveis = (np.argsort(np.argsort(precos))[:, None, None]
+                      + np.argsort(np.argsort(complexidades))[None, :, None]
+                      + np.argsort(np.argsort(acessorios))[None, None, :])
+            niveis = np.broadcast_to(niveis, bases.shape)
+            
+            indices = np.argsort(-margens, axis=None, kind='stable')
+            combinacoes = []
+            for i, j, k in zip(*np.unravel_index(indices, bases.shape)):
+                combinacoes.append({
+                    'material': catalogo.materiais[i],
+                    'complexidade': catalogo.complexidades[j],
+                    'qualidade_acessorios': catalogo.qualidades_acessorios[k],
+                    'custo_base_fabrica': float(bases[i, j, k]),
+                    'margem_lucro_pct': float(margens[i, j, k]),
+                    'nivel_padrao': int(niveis[i, j, k]),
+                    'viavel': bool(margens[i, j, k] >= margem_minima)
+                })
+            
+            # Fronteira de Pareto (margem x padrão) entre as viáveis
+            pareto = []
+            melhor_margem = -np.inf
+            for combinacao in sorted((c for c in combinacoes if c['viavel']),
+                                     key=lambda c: (-c['nivel_padrao'], -c['margem_lucro_pct'])):
+                if combinacao['margem_lucro_pct'] > melhor_margem:
+                    pareto.append(combinacao)
+                    melhor_margem = combinacao['margem_lucro_pct']
+            
+            return {
+                'valor_alvo': float(valor_alvo),
+                'margem_minima': float(margem_minima),
+                'versao_catalogo': catalogo.versao,
+                'combinacoes': combinacoes,
+                'pareto': pareto
+            }
+        
         except Exception as e:
-            print(f"Erro no cálculo do orçamento: {e}")
+            print(f"Erro ao resolver preço-alvo: {e}")
             return None
     
     def _calcular_componente(self, componente: Dict, material: str, 
-                           complexidade: str, qualidade_acessorios: str) -> Optional[Dict]:
+                           complexidade: str, qualidade_acessorios: str,
+                           catalogo: Optional[CatalogoPrecos] = None) -> Optional[Dict]:
         """Calcula custo de componente com preços reais de fábrica"""
         
         try:
+            catalogo = catalogo or self.catalogo
+            
             area_m2 = componente.get('area_m2', 0)
             tipo = componente.get('tipo', 'armario')
             nome = componente.get('nome', 'Componente')
@@ -148,21 +471,21 @@ class OrcamentoEngineFabricaFinal:
                 return None
             
             # Preço base do material (FÁBRICA REAL)
-            preco_base_m2 = self.precos_materiais.get(material, self.precos_materiais['mdf_18mm'])
+            preco_base_m2 = catalogo.precos_materiais.get(material, catalogo.precos_materiais['mdf_18mm'])
             
             # Aplicar multiplicadores
-            multiplicador_tipo = self.multiplicadores_tipo.get(tipo, 1.0)
-            multiplicador_complexidade = self.multiplicadores_complexidade.get(complexidade, 1.0)
+            multiplicador_tipo = catalogo.multiplicadores_tipo.get(tipo, 1.0)
+            multiplicador_complexidade = catalogo.multiplicadores_complexidade.get(complexidade, 1.0)
             
             # Calcular preço por m²
             preco_por_m2 = preco_base_m2 * multiplicador_tipo * multiplicador_complexidade
             
             # Aplicar desperdício (fábrica eficiente)
-            area_com_desperdicio = area_m2 * (1 + self.config['fator_desperdicio'])
+            area_com_desperdicio = area_m2 * (1 + catalogo.config['fator_desperdicio'])
             
             # Custos
             custo_material = area_com_desperdicio * preco_por_m2
-            custo_acessorios_m2 = self.config['custo_acessorios_por_m2'].get(qualidade_acessorios, 16.00)
+            custo_acessorios_m2 = catalogo.config['custo_acessorios_por_m2'].get(qualidade_acessorios, 16.00)
             custo_acessorios = area_m2 * custo_acessorios_m2
             custo_total = custo_material + custo_acessorios
             
@@ -183,7 +506,7 @@ class OrcamentoEngineFabricaFinal:
                 'ia_confianca': componente.get('ia_confianca'),
                 'ia_motivo': componente.get('ia_motivo')
             }
-            
+        
         except Exception as e:
             print(f"Erro no cálculo do componente: {e}")
             return None
@@ -191,209 +514,547 @@ class OrcamentoEngineFabricaFinal:
     def gerar_graficos(self, orcamento: Dict) -> Dict:
         """Gera gráficos otimizados para preços de fábrica"""
         
+        graficos = {}
+        for nome in GRAFICOS_DISPONIVEIS:
+            figura = self.gerar_grafico(orcamento, nome)
+            if figura is not None:
+                graficos[nome] = figura
+        
+        return graficos
+    
+    def gerar_grafico(self, orcamento: Dict, nome: str):
+        """Gera um único gráfico ('distribuicao', 'comparacao' ou 'componentes')
+        
+        A especificação da figura fica num cache LRU do processo, indexado
+        pelo hash do resumo e dos componentes; orçamentos iguais não
+        reconstroem a figura.
+        """
+        
         try:
-            resumo = orcamento.get('resumo', {})
-            componentes = orcamento.get('componentes', [])
-            
-            graficos = {}
-            
-            # Gráfico 1: Distribuição de custos
-            if resumo:
-                labels = ['Material', 'Painéis Extras', 'Sua Margem']
-                values = [
-                    resumo.get('custo_material', 0),
-                    resumo.get('custo_paineis_extras', 0),
-                    resumo.get('valor_lucro', 0)
-                ]
-                
-                fig_pizza = px.pie(
-                    values=values,
-                    names=labels,
-                    title="Distribuição de Custos - Base Fábrica Real",
-                    color_discrete_sequence=['#2E8B57', '#4682B4', '#FFD700']
-                )
-                
-                fig_pizza.update_layout(
-                    font=dict(size=12),
-                    showlegend=True,
-                    height=400
-                )
-                
-                graficos['distribuicao'] = fig_pizza
-            
-            # Gráfico 2: Comparação Fábrica vs Mercado vs Seu Preço
-            if resumo:
-                categorias = ['Base Fábrica', 'Seu Preço', 'Preço Mercado']
-                valores = [
-                    resumo.get('custo_base_fabrica', 0),
-                    resumo.get('valor_final', 0),
-                    resumo.get('valor_mercado_estimado', 0)
-                ]
-                cores = ['#2E8B57', '#4682B4', '#DC143C']
-                
-                fig_comparacao = go.Figure(data=[
-                    go.Bar(
-                        x=categorias,
-                        y=valores,
-                        marker_color=cores,
-                        text=[f'R$ {valor:,.0f}' for valor in valores],
-                        textposition='auto'
-                    )
-                ])
-                
-                fig_comparacao.update_layout(
-                    title="Comparação: Fábrica vs Seu Preço vs Mercado",
-                    xaxis_title="Tipo de Preço",
-                    yaxis_title="Valor (R$)",
-                    font=dict(size=12),
-                    height=400
-                )
-                
-                graficos['comparacao'] = fig_comparacao
+            chave = (chave_orcamento(orcamento), nome)
             
-            # Gráfico 3: Custo por componente
-            if componentes:
-                nomes = [comp.get('nome', f"Item {i+1}")[:20] for i, comp in enumerate(componentes)]
-                custos = [comp.get('custo_total', 0) for comp in componentes]
+            with _lock_cache_graficos:
+                spec = _cache_graficos.get(chave)
+                if spec is not None:
+                    _cache_graficos.move_to_end(chave)
+            
+            if spec is None:
+                construtor = {
+                    'distribuicao': self._grafico_distribuicao,
+                    'comparacao': self._grafico_comparacao,
+                    'componentes': self._grafico_componentes
+                }.get(nome)
                 
-                fig_barras = go.Figure(data=[
-                    go.Bar(
-                        x=nomes,
-                        y=custos,
-                        marker_color='#2E8B57',
-                        text=[f'R$ {custo:,.0f}' for custo in custos],
-                        textposition='auto'
-                    )
-                ])
+                figura = construtor(orcamento) if construtor else None
+                if figura is None:
+                    return None
                 
-                fig_barras.update_layout(
-                    title="Custo por Componente - Preços de Fábrica",
-                    xaxis_title="Componentes",
-                    yaxis_title="Custo (R$)",
-                    font=dict(size=12),
-                    height=400,
-                    xaxis={'tickangle': 45}
-                )
+                spec = figura.to_json()
+                with _lock_cache_graficos:
+                    _cache_graficos[chave] = spec
+                    while len(_cache_graficos) > TAMANHO_CACHE_GRAFICOS:
+                        _cache_graficos.popitem(last=False)
                 
-                graficos['componentes'] = fig_barras
-            
-            return graficos
+                return figura
             
+            # Spec gerada pelo próprio plotly: dispensa a validação (10x mais rápido)
+            import plotly.graph_objects as go
+            return go.Figure(json.loads(spec), _validate=False)
+        
         except Exception as e:
-            print(f"Erro ao gerar gráficos: {e}")
-            return {}
+            print(f"Erro ao gerar gráfico '{nome}': {e}")
+            return None
+    
+    def _grafico_distribuicao(self, orcamento: Dict):
+        """Gráfico 1: Distribuição de custos"""
+        
+        import plotly.express as px
+        
+        resumo = orcamento.get('resumo', {})
+        if not resumo:
+            return None
+        
+        labels = ['Material', 'Painéis Extras', 'Sua Margem']
+        values = [
+            resumo.get('custo_material', 0),
+            resumo.get('custo_paineis_extras', 0),
+            resumo.get('valor_lucro', 0)
+        ]
+        
+        fig_pizza = px.pie(
+            values=values,
+            names=labels,
+            title="Distribuição de Custos - Base Fábrica Real",
+            color_discrete_sequence=['#2E8B57', '#4682B4', '#FFD700']
+        )
+        
+        fig_pizza.update_layout(
+            font=dict(size=12),
+            showlegend=True,
+            height=400
+        )
+        
+        return fig_pizza
+    
+    def _grafico_comparacao(self, orcamento: Dict):
+        """Gráfico 2: Comparação Fábrica vs Mercado vs Seu Preço"""
+        
+        import plotly.graph_objects as go
+        
+        resumo = orcamento.get('resumo', {})
+        if not resumo:
+            return None
+        
+        categorias = ['Base Fábrica', 'Seu Preço', 'Preço Mercado']
+        valores = [
+            resumo.get('custo_base_fabrica', 0),
+            resumo.get('valor_final', 0),
+            resumo.get('valor_mercado_estimado', 0)
+        ]
+        cores = ['#2E8B57', '#4682B4', '#DC143C']
+        
+        fig_comparacao = go.Figure(data=[
+            go.Bar(
+                x=categorias,
+                y=valores,
+                marker_color=cores,
+                text=[f'R$ {valor:,.0f}' for valor in valores],
+                textposition='auto'
+            )
+        ])
+        
+        fig_comparacao.update_layout(
+            title="Comparação: Fábrica vs Seu Preço vs Mercado",
+            xaxis_title="Tipo de Preço",
+            yaxis_title="Valor (R$)",
+            font=dict(size=12),
+            height=400
+        )
+        
+        return fig_comparacao
+    
+    def _grafico_componentes(self, orcamento: Dict):
+        """Gráfico 3: Custo por componente (agrupado por tipo em projetos grandes)"""
+        
+        import plotly.graph_objects as go
+        
+        componentes = orcamento.get('componentes', [])
+        if not componentes:
+            return None
+        
+        if len(componentes) <= LIMITE_BARRAS_COMPONENTES:
+            nomes = [comp.get('nome', f"Item {i+1}")[:20] for i, comp in enumerate(componentes)]
+            custos = [comp.get('custo_total', 0) for comp in componentes]
+            titulo = "Custo por Componente - Preços de Fábrica"
+            eixo_x = "Componentes"
+        else:
+            por_tipo = obter_agregacoes(orcamento)['por_tipo']
+            nomes = [grupo['tipo'].title() for grupo in por_tipo]
+            custos = [grupo['custo_total'] for grupo in por_tipo]
+            titulo = f"Custo por Tipo ({len(componentes)} componentes) - Preços de Fábrica"
+            eixo_x = "Tipos"
+        
+        fig_barras = go.Figure(data=[
+            go.Bar(
+                x=nomes,
+                y=custos,
+                marker_color='#2E8B57',
+                text=[f'R$ {custo:,.0f}' for custo in custos],
+                textposition='auto'
+            )
+        ])
+        
+        fig_barras.update_layout(
+            title=titulo,
+            xaxis_title=eixo_x,
+            yaxis_title="Custo (R$)",
+            font=dict(size=12),
+            height=400,
+            xaxis={'tickangle': 45}
+        )
+        
+        return fig_barras
     
     def gerar_relatorio_detalhado(self, orcamento: Dict) -> str:
         """Gera relatório com foco em competitividade"""
         
         try:
-            resumo = orcamento.get('resumo', {})
-            componentes = orcamento.get('componentes', [])
-            configuracoes = orcamento.get('configuracoes', {})
-            timestamp = orcamento.get('timestamp', datetime.now().isoformat())
-            
-            relatorio = []
-            relatorio.append("=" * 80)
-            relatorio.append("ORÇAMENTO BASEADO EM PREÇOS REAIS DE FÁBRICA")
-            relatorio.append("Sistema Calibrado com Dados Reais - Máxima Competitividade")
-            relatorio.append("=" * 80)
-            relatorio.append("")
-            
-            # Cabeçalho
-            relatorio.append(f"📅 Data/Hora: {timestamp}")
-            relatorio.append(f"🔧 Versão: {orcamento.get('versao_engine', '5.0')}")
-            relatorio.append(f"🏭 Base: {orcamento.get('base_preco', 'Fábrica Real').replace('_', ' ').title()}")
-            relatorio.append("")
-            
-            # Resumo Executivo
-            relatorio.append("💼 RESUMO EXECUTIVO")
-            relatorio.append("-" * 25)
-            relatorio.append(f"💰 Valor Final: R$ {resumo.get('valor_final', 0):,.2f}")
-            relatorio.append(f"🏭 Base Fábrica: R$ {resumo.get('custo_base_fabrica', 0):,.2f}")
-            relatorio.append(f"💵 Sua Margem: R$ {resumo.get('valor_lucro', 0):,.2f} ({resumo.get('margem_lucro_pct', 0):.1f}%)")
-            relatorio.append(f"📐 Área Total: {resumo.get('area_total_m2', 0):.2f} m²")
-            relatorio.append(f"📊 Preço/m²: R$ {resumo.get('preco_por_m2', 0):,.2f}")
-            relatorio.append("")
-            
-            # Vantagem Competitiva
-            relatorio.append("🎯 VANTAGEM COMPETITIVA")
-            relatorio.append("-" * 30)
-            relatorio.append(f"🏭 Seu Preço: R$ {resumo.get('valor_final', 0):,.2f}")
-            relatorio.append(f"🏪 Preço Mercado: R$ {resumo.get('valor_mercado_estimado', 0):,.2f}")
-            relatorio.append(f"💸 Economia Cliente: R$ {resumo.get('economia_cliente', 0):,.2f}")
-            relatorio.append(f"📈 Percentual Economia: {resumo.get('percentual_economia', 0):.1f}%")
-            relatorio.append(f"🏆 Competitividade: MÁXIMA")
-            relatorio.append("")
-            
-            # Simulação de Margens
-            base_fabrica = resumo.get('custo_base_fabrica', 0)
-            relatorio.append("💰 SIMULAÇÃO DE MARGENS")
-            relatorio.append("-" * 30)
-            relatorio.append(f"🏭 Base Fábrica: R$ {base_fabrica:,.2f}")
-            relatorio.append(f"📊 Margem 20%: R$ {base_fabrica * 1.2:,.2f}")
-            relatorio.append(f"📊 Margem 30%: R$ {base_fabrica * 1.3:,.2f}")
-            relatorio.append(f"📊 Margem 40%: R$ {base_fabrica * 1.4:,.2f}")
-            relatorio.append(f"📊 Margem 50%: R$ {base_fabrica * 1.5:,.2f}")
-            relatorio.append(f"🏪 Mercado: R$ {resumo.get('valor_mercado_estimado', 0):,.2f}")
-            relatorio.append("")
-            
-            # Configurações
-            relatorio.append("⚙️ CONFIGURAÇÕES")
-            relatorio.append("-" * 20)
-            relatorio.append(f"Material: {configuracoes.get('material', 'N/A').replace('_', ' ').title()}")
-            relatorio.append(f"Complexidade: {configuracoes.get('complexidade', 'N/A').title()}")
-            relatorio.append(f"Acessórios: {configuracoes.get('qualidade_acessorios', 'N/A').title()}")
-            relatorio.append(f"Margem Aplicada: {configuracoes.get('margem_lucro', 0)}%")
-            relatorio.append("")
-            
-            # Breakdown
-            relatorio.append("🔍 BREAKDOWN DE CUSTOS")
-            relatorio.append("-" * 25)
-            relatorio.append(f"🔨 Material: R$ {resumo.get('custo_material', 0):,.2f}")
-            relatorio.append(f"📋 Painéis Extras: R$ {resumo.get('custo_paineis_extras', 0):,.2f}")
-            relatorio.append(f"🔧 Montagem: R$ {resumo.get('custo_montagem', 0):,.2f} (Não inclusa)")
-            relatorio.append(f"🏭 Subtotal Fábrica: R$ {resumo.get('custo_base_fabrica', 0):,.2f}")
-            relatorio.append(f"💰 Sua Margem: R$ {resumo.get('valor_lucro', 0):,.2f}")
-            relatorio.append(f"🎯 TOTAL: R$ {resumo.get('valor_final', 0):,.2f}")
-            relatorio.append("")
-            
-            # Componentes
-            relatorio.append("📦 COMPONENTES DETALHADOS")
-            relatorio.append("-" * 30)
-            
-            for i, comp in enumerate(componentes, 1):
-                relatorio.append(f"{i}. {comp.get('nome', f'Componente {i}')}")
-                relatorio.append(f"   📐 Área: {comp.get('area_m2', 0):.2f} m²")
-                relatorio.append(f"   🏷️ Tipo: {comp.get('tipo', 'N/A').title()}")
-                relatorio.append(f"   💵 Preço/m²: R$ {comp.get('preco_por_m2', 0):,.2f}")
-                relatorio.append(f"   💰 Total: R$ {comp.get('custo_total', 0):,.2f}")
-                
-                if comp.get('ia_tipo_detectado'):
-                    relatorio.append(f"   🤖 IA: {comp['ia_tipo_detectado']} ({comp.get('ia_confianca', 0):.1%})")
-                
-                relatorio.append("")
-            
-            # Observações
-            relatorio.append("📝 OBSERVAÇÕES IMPORTANTES")
-            relatorio.append("-" * 35)
-            relatorio.append("✅ Preços calibrados com dados REAIS de fábrica")
-            relatorio.append("✅ Base de R$ 9.000 para área de serviço padrão")
-            relatorio.append("✅ Desperdício otimizado para 5% (eficiência industrial)")
-            relatorio.append("✅ Painéis extras: 15% (padrão fábrica)")
-            relatorio.append("⚠️  Montagem NÃO INCLUÍDA (padrão fábrica)")
-            relatorio.append("💰 Margem de lucro 100% controlável")
-            relatorio.append("🎯 Competitividade máxima garantida")
-            relatorio.append("")
-            
-            relatorio.append("=" * 80)
-            relatorio.append("🏆 Orca Interiores - Orçamento Baseado em Preços Reais de Fábrica")
-            relatorio.append("🎯 Máxima Competitividade | 💰 Controle Total da Margem")
-            relatorio.append("=" * 80)
-            
-            return "\n".join(relatorio)
-            
+            return "\n".join(self.iter_relatorio_detalhado(orcamento))
+        
         except Exception as e:
             return f"Erro ao gerar relatório: {str(e)}"
+    
+    def iter_relatorio_detalhado(self, orcamento: Dict) -> Iterator[str]:
+        """Gera o relatório linha a linha (sem montar o texto inteiro em memória)"""
+        
+        resumo = orcamento.get('resumo', {})
+        componentes = orcamento.get('componentes', [])
+        configuracoes = orcamento.get('configuracoes', {})
+        timestamp = orcamento.get('timestamp', datetime.now().isoformat())
+        
+        yield "=" * 80
+        yield "ORÇAMENTO BASEADO EM PREÇOS REAIS DE FÁBRICA"
+        yield "Sistema Calibrado com Dados Reais - Máxima Competitividade"
+        yield "=" * 80
+        yield ""
+        
+        # Cabeçalho
+        yield f"📅 Data/Hora: {timestamp}"
+        yield f"🔧 Versão: {orcamento.get('versao_engine', '5.0')}"
+        yield f"📚 Catálogo de Preços: {orcamento.get('versao_catalogo') or 'N/A'}"
+        yield f"🏭 Base: {orcamento.get('base_preco', 'Fábrica Real').replace('_', ' ').title()}"
+        yield ""
+        
+        # Resumo Executivo
+        yield "💼 RESUMO EXECUTIVO"
+        yield "-" * 25
+        yield f"💰 Valor Final: R$ {resumo.get('valor_final', 0):,.2f}"
+        yield f"🏭 Base Fábrica: R$ {resumo.get('custo_base_fabrica', 0):,.2f}"
+        yield f"💵 Sua Margem: R$ {resumo.get('valor_lucro', 0):,.2f} ({resumo.get('margem_lucro_pct', 0):.1f}%)"
+        yield f"📐 Área Total: {resumo.get('area_total_m2', 0):.2f} m²"
+        yield f"📊 Preço/m²: R$ {resumo.get('preco_por_m2', 0):,.2f}"
+        yield ""
+        
+        # Vantagem Competitiva
+        yield "🎯 VANTAGEM COMPETITIVA"
+        yield "-" * 30
+        yield f"🏭 Seu Preço: R$ {resumo.get('valor_final', 0):,.2f}"
+        yield f"🏪 Preço Mercado: R$ {resumo.get('valor_mercado_estimado', 0):,.2f}"
+        yield f"💸 Economia Cliente: R$ {resumo.get('economia_cliente', 0):,.2f}"
+        yield f"📈 Percentual Economia: {resumo.get('percentual_economia', 0):.1f}%"
+        yield f"🏆 Competitividade: MÁXIMA"
+        yield ""
+        
+        # Simulação de Margens
+        base = CustoBaseOrcamento.de_orcamento(orcamento)
+        yield "💰 SIMULAÇÃO DE MARGENS"
+        yield "-" * 30
+        yield f"🏭 Base Fábrica: R$ {base.custo_base_fabrica:,.2f}"
+        for simulacao in base.simular_margens([20, 30, 40, 50]):
+            yield f"📊 Margem {simulacao['margem_lucro_pct']:.0f}%: R$ {simulacao['valor_final']:,.2f}"
+        yield f"🏪 Mercado: R$ {resumo.get('valor_mercado_estimado', 0):,.2f}"
+        yield ""
+        
+        # Configurações
+        yield "⚙️ CONFIGURAÇÕES"
+        yield "-" * 20
+        yield f"Material: {configuracoes.get('material', 'N/A').replace('_', ' ').title()}"
+        yield f"Complexidade: {configuracoes.get('complexidade', 'N/A').title()}"
+        yield f"Acessórios: {configuracoes.get('qualidade_acessorios', 'N/A').title()}"
+        yield f"Margem Aplicada: {configuracoes.get('margem_lucro', 0)}%"
+        yield ""
+        
+        # Breakdown
+        yield "🔍 BREAKDOWN DE CUSTOS"
+        yield "-" * 25
+        yield f"🔨 Material: R$ {resumo.get('custo_material', 0):,.2f}"
+        yield f"📋 Painéis Extras: R$ {resumo.get('custo_paineis_extras', 0):,.2f}"
+        yield f"🔧 Montagem: R$ {resumo.get('custo_montagem', 0):,.2f} (Não inclusa)"
+        yield f"🏭 Subtotal Fábrica: R$ {resumo.get('custo_base_fabrica', 0):,.2f}"
+        yield f"💰 Sua Margem: R$ {resumo.get('valor_lucro', 0):,.2f}"
+        yield f"🎯 TOTAL: R$ {resumo.get('valor_final', 0):,.2f}"
+        yield ""
+        
+        # Resumo por tipo
+        agregacoes = obter_agregacoes(orcamento)
+        if agregacoes['por_tipo']:
+            yield "🗂️ RESUMO POR TIPO"
+            yield "-" * 25
+            for grupo in agregacoes['por_tipo']:
+                confianca = grupo['confianca_media']
+                yield (f"{grupo['tipo'].title()}: {grupo['quantidade']} un. | {grupo['area_m2']:.2f} m² | "
+                       f"R$ {grupo['custo_total']:,.2f} ({grupo['percentual_custo']:.1f}%)"
+                       + (f" | IA {confianca:.1%}" if confianca is not None else ""))
+            for grupo in agregacoes['por_material']:
+                yield (f"🪵 {grupo['material'].replace('_', ' ').title()}: {grupo['area_m2']:.2f} m² | "
+                       f"R$ {grupo['custo_total']:,.2f}")
+            yield ""
+        
+        # Componentes
+        yield "📦 COMPONENTES DETALHADOS"
+        yield "-" * 30
+        
+        for i, comp in enumerate(componentes, 1):
+            yield f"{i}. {comp.get('nome', f'Componente {i}')}"
+            yield f"   📐 Área: {comp.get('area_m2', 0):.2f} m²"
+            yield f"   🏷️ Tipo: {comp.get('tipo', 'N/A').title()}"
+            yield f"   💵 Preço/m²: R$ {comp.get('preco_por_m2', 0):,.2f}"
+            yield f"   💰 Total: R$ {comp.get('custo_total', 0):,.2f}"
+            
+            if comp.get('ia_tipo_detectado'):
+                yield f"   🤖 IA: {comp['ia_tipo_detectado']} ({comp.get('ia_confianca', 0):.1%})"
+            
+            yield ""
+        
+        # Observações
+        yield "📝 OBSERVAÇÕES IMPORTANTES"
+        yield "-" * 35
+        yield "✅ Preços calibrados com dados REAIS de fábrica"
+        yield "✅ Base de R$ 9.000 para área de serviço padrão"
+        yield "✅ Desperdício otimizado para 5% (eficiência industrial)"
+        yield "✅ Painéis extras: 15% (padrão fábrica)"
+        yield "⚠️  Montagem NÃO INCLUÍDA (padrão fábrica)"
+        yield "💰 Margem de lucro 100% controlável"
+        yield "🎯 Competitividade máxima garantida"
+        yield ""
+        
+        yield "=" * 80
+        yield "🏆 Orca Interiores - Orçamento Baseado em Preços Reais de Fábrica"
+        yield "🎯 Máxima Competitividade | 💰 Controle Total da Margem"
+        yield "=" * 80
+
+def _somas_area(componentes: List[Dict], catalogo: CatalogoPrecos) -> Tuple[float, float]:
+    """(soma de área * multiplicador do tipo, área total) dos componentes com área"""
+    
+    componentes = [c for c in componentes if (c.get('area_m2', 0) or 0) > 0]
+    if not componentes:
+        return 0.0, 0.0
+    
+    areas = np.array([c['area_m2'] for c in componentes], dtype=float)
+    mult_tipo = catalogo.tabela_multiplicadores_tipo[
+        catalogo.codificar_tipos(c.get('tipo', 'armario') for c in componentes)
+    ]
+    return float(areas @ mult_tipo), float(areas.sum())
+
+def _agrupar(campo: str, chaves: List[str], areas: np.ndarray, custos: np.ndarray,
+             confiancas: np.ndarray) -> List[Dict]:
+    """Soma área/custo e média de confiança por chave (bincount), do maior custo ao menor"""
+    
+    nomes, codigos = np.unique(np.asarray(chaves, dtype=object).astype(str), return_inverse=True)
+    n = len(nomes)
+    
+    quantidades = np.bincount(codigos, minlength=n)
+    areas_grupo = np.bincount(codigos, weights=areas, minlength=n)
+    custos_grupo = np.bincount(codigos, weights=custos, minlength=n)
+    
+    # Confiança média só entre componentes classificados pela IA
+    com_confianca = ~np.isnan(confiancas)
+    contagem_confianca = np.bincount(codigos[com_confianca], minlength=n)
+    soma_confianca = np.bincount(codigos[com_confianca], weights=confiancas[com_confianca], minlength=n)
+    
+    custo_total = custos_grupo.sum()
+    
+    return [
+        {
+            campo: str(nomes[i]),
+            'quantidade': int(quantidades[i]),
+            'area_m2': float(areas_grupo[i]),
+            'custo_total': float(custos_grupo[i]),
+            'percentual_custo': float(custos_grupo[i] / custo_total * 100) if custo_total > 0 else 0.0,
+            'confianca_media': float(soma_confianca[i] / contagem_confianca[i]) if contagem_confianca[i] else None
+        }
+        for i in np.argsort(-custos_grupo, kind='stable')
+    ]
+
+def _agregar_colunas(colunas: Dict[str, List]) -> Dict:
+    """Agregações por tipo e por material a partir das colunas dos componentes"""
+    
+    areas = np.asarray(colunas['area'], dtype=float)
+    custos = np.asarray(colunas['custo'], dtype=float)
+    confiancas = np.array([np.nan if c is None else c for c in colunas['confianca']], dtype=float)
+    
+    return {
+        'por_tipo': _agrupar('tipo', colunas['tipo'], areas, custos, confiancas),
+        'por_material': _agrupar('material', colunas['material'], areas, custos, confiancas)
+    }
+
+def agregar_componentes(componentes: List[Dict]) -> Dict:
+    """Agregações por tipo e por material de componentes já calculados"""
+    
+    return _agregar_colunas({
+        'tipo': [comp.get('tipo', 'armario') for comp in componentes],
+        'material': [comp.get('material_usado', 'mdf_18mm') for comp in componentes],
+        'area': [comp.get('area_m2', 0) or 0 for comp in componentes],
+        'custo': [comp.get('custo_total', 0) or 0 for comp in componentes],
+        'confianca': [comp.get('ia_confianca') for comp in componentes]
+    })
+
+def obter_agregacoes(orcamento: Dict) -> Dict:
+    """Agregações do orçamento (calculadas junto com ele; recalcula só em orçamentos antigos)"""
+    
+    agregacoes = orcamento.get('agregacoes')
+    if agregacoes is not None:
+        return agregacoes
+    
+    return agregar_componentes(orcamento.get('componentes', []))
+
+def chave_orcamento(orcamento: Dict) -> str:
+    """Hash estável do conteúdo de um orçamento (resumo + componentes)
+    
+    Orçamentos montados por CustoBaseOrcamento já trazem a chave pronta
+    ('chave_conteudo'), evitando serializar todos os componentes de novo.
+    """
+    
+    if orcamento.get('chave_conteudo'):
+        return orcamento['chave_conteudo']
+    
+    dados = {
+        'resumo': orcamento.get('resumo', {}),
+        'componentes': orcamento.get('componentes', [])
+    }
+    serializado = json.dumps(dados, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serializado.encode()).hexdigest()
+
+def _chave_custo_base(analise: Dict, configuracoes: Dict) -> str:
+    """Chave estável da base de custo: componentes + configurações que não são a margem"""
+    
+    dados = {
+        'componentes': analise.get('componentes', []),
+        'material': configuracoes.get('material', 'mdf_18mm'),
+        'complexidade': configuracoes.get('complexidade', 'media'),
+        'qualidade_acessorios': configuracoes.get('qualidade_acessorios', 'comum')
+    }
+    serializado = json.dumps(dados, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serializado.encode()).hexdigest()
+
+def _precificar_bloco(engine: OrcamentoEngineFabricaFinal, 
+                      tarefas: List[Tuple[str, Dict, Dict]]) -> List[Tuple[str, Optional['CustoBaseOrcamento'], Optional[str]]]:
+    """Calcula as bases de um bloco de tarefas (executado nos processos do pool)"""
+    
+    resultados = []
+    for chave, analise, configuracoes in tarefas:
+        try:
+            resultados.append((chave, engine._calcular_custo_base(analise, configuracoes), None))
+        except Exception as e:
+            resultados.append((chave, None, str(e) or e.__class__.__name__))
+    return resultados
+
+class CustoBaseOrcamento:
+    """Custo base de fábrica já calculado, do qual se deriva o resumo para qualquer margem"""
+    
+    def __init__(self, componentes: List[Dict], configuracoes: Dict, area_total: float,
+                 custo_material: float, custo_paineis_extras: float, custo_montagem: float,
+                 fator_mercado: float = 2.33, versao_catalogo: Optional[str] = None,
+                 agregacoes: Optional[Dict] = None):
+        """Guarda os componentes calculados e os custos que independem da margem"""
+        self.componentes = componentes
+        self.configuracoes = configuracoes
+        self.area_total = area_total
+        self.custo_material = custo_material
+        self.custo_paineis_extras = custo_paineis_extras
+        self.custo_montagem = custo_montagem
+        self.fator_mercado = fator_mercado
+        self.versao_catalogo = versao_catalogo
+        self._agregacoes = agregacoes
+        self._chave_componentes = None
+        self._somas_area: Optional[Tuple[str, Tuple[float, float]]] = None
+        
+        # Custo base de fábrica (R$ 9.000 para área de serviço padrão)
+        self.custo_base_fabrica = custo_material + custo_paineis_extras + custo_montagem
+        self.valor_mercado = self.custo_base_fabrica * fator_mercado
+    
+    @classmethod
+    def de_orcamento(cls, orcamento: Dict) -> 'CustoBaseOrcamento':
+        """Reconstrói a base a partir de um orçamento já calculado (sem recalcular componentes)"""
+        
+        resumo = orcamento.get('resumo', {})
+        custo_base = resumo.get('custo_base_fabrica', 0)
+        valor_mercado = resumo.get('valor_mercado_estimado', 0)
+        
+        return cls(
+            componentes=orcamento.get('componentes', []),
+            configuracoes=orcamento.get('configuracoes', {}),
+            area_total=resumo.get('area_total_m2', 0),
+            custo_material=resumo.get('custo_material', 0),
+            custo_paineis_extras=resumo.get('custo_paineis_extras', 0),
+            custo_montagem=resumo.get('custo_montagem', 0),
+            fator_mercado=valor_mercado / custo_base if custo_base > 0 else 2.33,
+            versao_catalogo=orcamento.get('versao_catalogo'),
+            agregacoes=orcamento.get('agregacoes')
+        )
+    
+    @property
+    def agregacoes(self) -> Dict:
+        """Totais por tipo e por material (não dependem da margem)"""
+        if self._agregacoes is None:
+            self._agregacoes = agregar_componentes(self.componentes)
+        return self._agregacoes
+    
+    def somas_area(self, catalogo: CatalogoPrecos) -> Tuple[float, float]:
+        """(soma de área * multiplicador do tipo, área total) para o preço-alvo
+        
+        Calculadas uma vez por versão do catálogo (os multiplicadores vêm dele).
+        """
+        
+        if self._somas_area is None or self._somas_area[0] != catalogo.versao:
+            self._somas_area = (catalogo.versao, _somas_area(self.componentes, catalogo))
+        return self._somas_area[1]
+    
+    def valores_finais(self, margens_pct) -> np.ndarray:
+        """Valor final para um vetor de margens (em %), numa única operação"""
+        return self.custo_base_fabrica * (1 + np.asarray(margens_pct, dtype=float) / 100)
+    
+    def resumo(self, margem_lucro_pct: float) -> Dict:
+        """Resumo do orçamento para a margem informada (em %) - O(1)"""
+        
+        margem_lucro = margem_lucro_pct / 100
+        
+        # Aplicar margem do usuário
+        valor_lucro = self.custo_base_fabrica * margem_lucro
+        valor_final = self.custo_base_fabrica + valor_lucro
+        
+        # Calcular comparações
+        economia_cliente = self.valor_mercado - valor_final
+        
+        return {
+            'valor_final': valor_final,
+            'area_total_m2': self.area_total,
+            'preco_por_m2': valor_final / self.area_total if self.area_total > 0 else 0,
+            'custo_base_fabrica': self.custo_base_fabrica,
+            'custo_material': self.custo_material,
+            'custo_paineis_extras': self.custo_paineis_extras,
+            'custo_montagem': self.custo_montagem,
+            'valor_lucro': valor_lucro,
+            'margem_lucro_pct': margem_lucro * 100,
+            'valor_mercado_estimado': self.valor_mercado,
+            'economia_cliente': economia_cliente,
+            'percentual_economia': (economia_cliente / self.valor_mercado) * 100 if self.valor_mercado > 0 else 0
+        }
+    
+    def simular_margens(self, margens_pct) -> List[Dict]:
+        """Valor final, lucro e economia do cliente para várias margens (em %)"""
+        
+        margens = np.asarray(margens_pct, dtype=float)
+        valores_finais = self.valores_finais(margens)
+        economias = self.valor_mercado - valores_finais
+        
+        return [
+            {
+                'margem_lucro_pct': float(margem),
+                'valor_final': float(valor_final),
+                'valor_lucro': float(valor_final - self.custo_base_fabrica),
+                'economia_cliente': float(economia)
+            }
+            for margem, valor_final, economia in zip(margens, valores_finais, economias)
+        ]
+    
+    def chave_conteudo(self, resumo: Dict) -> str:
+        """Hash do orçamento derivado; os componentes são serializados uma única vez"""
+        
+        if self._chave_componentes is None:
+            serializado = json.dumps(self.componentes, sort_keys=True, ensure_ascii=False, default=str)
+            self._chave_componentes = hashlib.sha256(serializado.encode()).hexdigest()
+        
+        serializado = self._chave_componentes + json.dumps(resumo, sort_keys=True, default=str)
+        return hashlib.sha256(serializado.encode()).hexdigest()
+    
+    def orcamento(self, configuracoes: Optional[Dict] = None) -> Dict:
+        """Monta o orçamento completo aplicando a margem das configurações"""
+        
+        configuracoes = configuracoes if configuracoes is not None else self.configuracoes
+        resumo = self.resumo(configuracoes.get('margem_lucro', 30))
+        
+        return {
+            'resumo': resumo,
+            'componentes': self.componentes,
+            'agregacoes': self.agregacoes,
+            'configuracoes': configuracoes,
+            'timestamp': datetime.now().isoformat(),
+            'versao_engine': '5.0_fabrica_final',
+            'versao_catalogo': self.versao_catalogo,
+            'base_preco': 'fabrica_real',
+            'chave_conteudo': self.chave_conteudo(resumo)
+        }
 
 # Manter compatibilidade com versões anteriores
 OrcamentoEngine = OrcamentoEngineFabricaFinal
@@ -446,15 +1107,10 @@ if __name__ == "__main__":
         print(f"💵 Preço/m²: R$ {orcamento_base['resumo']['preco_por_m2']:,.2f}")
         print("")
         
-        # Teste com margens
-        for margem in [20, 30, 40, 50]:
-            config_margem = config_base.copy()
-            config_margem['margem_lucro'] = margem
-            orcamento_margem = engine.calcular_orcamento_completo(analise_area_servico, config_margem)
-            
-            if orcamento_margem:
-                valor = orcamento_margem['resumo']['valor_final']
-                print(f"💰 Com margem {margem}%: R$ {valor:,.2f}")
+        # Teste com margens (sem recalcular componentes)
+        base = engine.calcular_custo_base(analise_area_servico, config_base)
+        for simulacao in base.simular_margens([20, 30, 40, 50]):
+            print(f"💰 Com margem {simulacao['margem_lucro_pct']:.0f}%: R$ {simulacao['valor_final']:,.2f}")
         
         print("")
         print("✅ Engine calibrado para preços REAIS de fábrica!")
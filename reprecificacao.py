@@ -0,0 +1,239 @@
+"""
+Reprecificação em Massa - Orca Interiores
+Recalcula todos os orçamentos salvos contra um catálogo de preços e
+mede o impacto por usuário e no total
+"""
+
+import argparse
+import json
+import sqlite3
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from catalogo_precos import CatalogoPrecos, carregar_catalogo, obter_catalogo
+from orcamento_engine import OrcamentoEngineFabricaFinal
+from serializacao import decodificar_colunas
+from sharding import arquivos_orcamentos
+
+def _ler_lotes(conn: sqlite3.Connection, tamanho_lote: int) -> Iterator[List[Tuple]]:
+    """Lê orçamentos em lotes por id crescente (sem cursor longo aberto)"""
+    
+    # Bancos antigos: sem a coluna dados_bin (formato binário) ou sem o
+    # repositório de blobs (payload ainda dentro de orcamentos)
+    colunas = {linha[1] for linha in conn.execute("PRAGMA table_info(orcamentos)")}
+    dados = "o.dados_json"
+    juncao = ""
+    if 'dados_bin' in colunas:
+        dados = "COALESCE(o.dados_bin, o.dados_json)"
+    if 'dados_hash' in colunas:
+        dados = "COALESCE(b.dados, o.dados_bin, o.dados_json)"
+        juncao = "LEFT JOIN blobs_orcamento b ON b.hash = o.dados_hash"
+    
+    ultimo_id = 0
+    while True:
+        linhas = conn.execute(f"""
+            SELECT o.id, o.usuario_id, o.valor_final, {dados}
+            FROM orcamentos o {juncao}
+            WHERE o.id > ?
+            ORDER BY o.id
+            LIMIT ?
+        """, (ultimo_id, tamanho_lote)).fetchall()
+        
+        if not linhas:
+            return
+        
+        yield linhas
+        ultimo_id = linhas[-1][0]
+
+def _decodificar_dados(dados, catalogo: CatalogoPrecos) -> Optional[Tuple[Dict, List, np.ndarray]]:
+    """Decodifica o payload salvo em (configurações, áreas, códigos de tipo)
+    
+    O formato binário é lido direto das colunas, sem montar os componentes;
+    o JSON legado passa pelo caminho por componente.
+    """
+    
+    if not dados:
+        return None
+    
+    if isinstance(dados, bytes):
+        cabecalho, colunas = decodificar_colunas(dados)
+        n = cabecalho['n_componentes']
+        if not n or 'area_m2' not in colunas:
+            return None
+        
+        configuracoes = cabecalho['orcamento'].get('configuracoes', {})
+        areas = np.nan_to_num(colunas['area_m2'].astype(float)).tolist()
+        
+        tipo = colunas.get('tipo')
+        if isinstance(tipo, tuple):
+            codigos, categorias = tipo
+            codigos_tipo = catalogo.codificar_tipos(categorias)[codigos]
+        else:
+            codigos_tipo = catalogo.codificar_tipos(tipo or ['armario'] * n)
+        
+        return configuracoes, areas, codigos_tipo
+    
+    orcamento = json.loads(dados)
+    componentes = orcamento.get('componentes', []) if orcamento else []
+    if not componentes:
+        return None
+    
+    return (
+        orcamento.get('configuracoes', {}),
+        [float(comp.get('area_m2', 0) or 0) for comp in componentes],
+        catalogo.codificar_tipos(comp.get('tipo', 'armario') for comp in componentes)
+    )
+
+def _decodificar_lote(linhas: List[Tuple], catalogo: CatalogoPrecos) -> Dict:
+    """Converte um lote de linhas em arrays por orçamento e por componente"""
+    
+    usuarios, valores_atuais = [], []
+    materiais, complexidades, acessorios, margens = [], [], [], []
+    areas, tipos, donos = [], [], []
+    ignorados = 0
+    
+    for _, usuario_id, valor_final, dados in linhas:
+        try:
+            decodificado = _decodificar_dados(dados, catalogo)
+            if not decodificado or valor_final is None:
+                ignorados += 1
+                continue
+            
+            configuracoes, areas_orcamento, tipos_orcamento = decodificado
+            codigos = (
+                catalogo.indice_material.get(configuracoes.get('material', 'mdf_18mm'), -1),
+                catalogo.indice_complexidade.get(configuracoes.get('complexidade', 'media'), -1),
+                catalogo.indice_acessorios.get(configuracoes.get('qualidade_acessorios', 'comum'), -1),
+                float(configuracoes.get('margem_lucro', 30))
+            )
+        
+        except Exception:
+            ignorados += 1
+            continue
+        
+        indice = len(usuarios)
+        areas.extend(areas_orcamento)
+        tipos.append(tipos_orcamento)
+        donos.extend([indice] * len(areas_orcamento))
+        
+        usuarios.append(usuario_id if usuario_id is not None else -1)
+        valores_atuais.append(valor_final)
+        materiais.append(codigos[0])
+        complexidades.append(codigos[1])
+        acessorios.append(codigos[2])
+        margens.append(codigos[3])
+    
+    return {
+        'usuarios': np.array(usuarios, dtype=np.int64),
+        'valores_atuais': np.array(valores_atuais, dtype=float),
+        'codigos_material': np.array(materiais, dtype=np.intp),
+        'codigos_complexidade': np.array(complexidades, dtype=np.intp),
+        'codigos_acessorios': np.array(acessorios, dtype=np.intp),
+        'margens_pct': np.array(margens, dtype=float),
+        'areas': np.array(areas, dtype=float),
+        'codigos_tipo': np.concatenate(tipos).astype(np.intp) if tipos else np.zeros(0, dtype=np.intp),
+        'indice_orcamento': np.array(donos, dtype=np.intp),
+        'ignorados': ignorados
+    }
+
+def reprecificar_historico(db_path: str = "usuarios.db", catalogo: Optional[CatalogoPrecos] = None,
+                           tamanho_lote: int = 5000) -> Dict:
+    """Reprecifica todos os orçamentos salvos e calcula os deltas
+    
+    As linhas são lidas em lotes (memória limitada ao lote e ao número de
+    usuários), decodificadas em colunas e precificadas de uma vez pelo
+    engine vetorizado. Percorre o banco central e todos os shards do
+    diretório, somando os deltas por usuário; todos abertos somente leitura.
+    """
+    
+    engine = OrcamentoEngineFabricaFinal(catalogo or obter_catalogo())
+    catalogo = engine.catalogo
+    
+    por_usuario: Dict[int, Dict] = {}
+    reprecificados = 0
+    ignorados = 0
+    
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        arquivos = arquivos_orcamentos(conn, db_path)
+    finally:
+        conn.close()
+    
+    for arquivo in arquivos:
+        conn = sqlite3.connect(f"file:{arquivo}?mode=ro", uri=True)
+        try:
+            for linhas in _ler_lotes(conn, tamanho_lote):
+                lote = _decodificar_lote(linhas, catalogo)
+                ignorados += lote['ignorados']
+                
+                if not len(lote['usuarios']):
+                    continue
+                
+                valores_novos = engine.precificar_colunas(
+                    lote['areas'], lote['codigos_tipo'], lote['indice_orcamento'],
+                    lote['codigos_material'], lote['codigos_complexidade'],
+                    lote['codigos_acessorios'], lote['margens_pct']
+                )
+                
+                validos = ~np.isnan(valores_novos)
+                ignorados += int((~validos).sum())
+                reprecificados += int(validos.sum())
+                
+                # Agregar por usuário dentro do lote
+                ids, inverso = np.unique(lote['usuarios'][validos], return_inverse=True)
+                contagens = np.bincount(inverso, minlength=len(ids))
+                somas_atuais = np.bincount(inverso, weights=lote['valores_atuais'][validos], minlength=len(ids))
+                somas_novas = np.bincount(inverso, weights=valores_novos[validos], minlength=len(ids))
+                
+                for usuario_id, contagem, atual, novo in zip(ids.tolist(), contagens.tolist(),
+                                                            somas_atuais.tolist(), somas_novas.tolist()):
+                    stats = por_usuario.setdefault(usuario_id, {'orcamentos': 0, 'valor_atual': 0.0, 'valor_novo': 0.0})
+                    stats['orcamentos'] += contagem
+                    stats['valor_atual'] += atual
+                    stats['valor_novo'] += novo
+        finally:
+            conn.close()
+    
+    for stats in por_usuario.values():
+        stats['delta'] = stats['valor_novo'] - stats['valor_atual']
+        stats['delta_pct'] = (stats['delta'] / stats['valor_atual']) * 100 if stats['valor_atual'] else 0
+    
+    valor_atual_total = sum(s['valor_atual'] for s in por_usuario.values())
+    valor_novo_total = sum(s['valor_novo'] for s in por_usuario.values())
+    delta_total = valor_novo_total - valor_atual_total
+    
+    return {
+        'versao_catalogo': catalogo.versao,
+        'arquivos': len(arquivos),
+        'reprecificados': reprecificados,
+        'ignorados': ignorados,
+        'valor_atual_total': valor_atual_total,
+        'valor_novo_total': valor_novo_total,
+        'delta_total': delta_total,
+        'delta_pct': (delta_total / valor_atual_total) * 100 if valor_atual_total else 0,
+        'por_usuario': por_usuario
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reprecifica o histórico de orçamentos contra um catálogo")
+    parser.add_argument('--db', default='usuarios.db', help="Banco SQLite com a tabela orcamentos")
+    parser.add_argument('--catalogo', help="Arquivo JSON do catálogo (padrão: catálogo em vigor)")
+    parser.add_argument('--lote', type=int, default=5000, help="Orçamentos por lote")
+    args = parser.parse_args()
+    
+    catalogo = carregar_catalogo(args.catalogo) if args.catalogo else None
+    resultado = reprecificar_historico(args.db, catalogo, args.lote)
+    
+    print(f"💰 Reprecificação - catálogo {resultado['versao_catalogo']}")
+    print("=" * 50)
+    print(f"📦 Orçamentos reprecificados: {resultado['reprecificados']} (ignorados: {resultado['ignorados']}) "
+          f"em {resultado['arquivos']} arquivo(s)")
+    print(f"🏷️ Valor atual: R$ {resultado['valor_atual_total']:,.2f}")
+    print(f"🆕 Valor novo: R$ {resultado['valor_novo_total']:,.2f}")
+    print(f"📈 Delta: R$ {resultado['delta_total']:,.2f} ({resultado['delta_pct']:+.1f}%)")
+    print("")
+    
+    for usuario_id, stats in sorted(resultado['por_usuario'].items()):
+        print(f"👤 Usuário {usuario_id}: {stats['orcamentos']} orçamentos, "
+              f"delta R$ {stats['delta']:,.2f} ({stats['delta_pct']:+.1f}%)")
@@ -0,0 +1,206 @@
+"""
+Hash de Senhas - Orca Interiores
+KDF com sal (scrypt ou PBKDF2, ambos da stdlib) executado num pool limitado
+de threads ou processos, para que um pico de logins não trave as threads
+do Streamlit; hashes SHA-256 legados são reconhecidos e atualizados no login
+
+Formatos armazenados:
+    scrypt$<n>$<r>$<p>$<sal base64>$<hash base64>
+    pbkdf2_sha256$<iterações>$<sal base64>$<hash base64>
+    <64 hex>   (SHA-256 sem sal, legado)
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional, Tuple, Union
+
+ALGORITMOS = ('scrypt', 'pbkdf2_sha256')
+
+# Custos nomeados: n do scrypt (r=8, p=1) e iterações do PBKDF2-SHA256.
+# 'padrao' fica perto de 50-250 ms por hash num núcleo atual
+CUSTOS_SCRYPT = {'baixo': 2 ** 12, 'padrao': 2 ** 14, 'alto': 2 ** 15}
+CUSTOS_PBKDF2 = {'baixo': 100_000, 'padrao': 600_000, 'alto': 1_200_000}
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+TAMANHO_SAL = 16
+TAMANHO_HASH = 32
+
+# Pool: KDFs simultâneos (o KDF libera o GIL, então threads usam vários
+# núcleos), pedidos aguardando na fila e espera máxima por uma vaga (segundos)
+TRABALHADORES_SENHA = min(4, os.cpu_count() or 1)
+FILA_MAXIMA_SENHA = 64
+TIMEOUT_SENHA = 10.0
+
+class ErroServicoSenhas(RuntimeError):
+    """Pool de hash saturado (fila cheia além do timeout)"""
+
+def _b64(dados: bytes) -> str:
+    return base64.b64encode(dados).decode('ascii')
+
+def _derivar(algoritmo: str, senha: str, sal: bytes, parametros: Tuple[int, ...]) -> bytes:
+    """Executa o KDF (função de módulo: roda também num pool de processos)"""
+    
+    if algoritmo == 'scrypt':
+        n, r, p = parametros
+        return hashlib.scrypt(senha.encode('utf-8'), salt=sal, n=n, r=r, p=p,
+                              maxmem=256 * r * (n + p), dklen=TAMANHO_HASH)
+    
+    (iteracoes,) = parametros
+    return hashlib.pbkdf2_hmac('sha256', senha.encode('utf-8'), sal, iteracoes, TAMANHO_HASH)
+
+def _gerar(algoritmo: str, senha: str, parametros: Tuple[int, ...]) -> str:
+    """Hash novo (sal aleatório) no formato armazenado"""
+    
+    sal = secrets.token_bytes(TAMANHO_SAL)
+    derivado = _derivar(algoritmo, senha, sal, parametros)
+    return '$'.join([algoritmo, *map(str, parametros), _b64(sal), _b64(derivado)])
+
+def _verificar(senha: str, senha_hash: str) -> bool:
+    """Compara a senha com um hash armazenado (qualquer formato conhecido)"""
+    
+    algoritmo, parametros, sal, esperado = decompor_hash(senha_hash)
+    
+    if algoritmo == 'sha256':
+        calculado = hashlib.sha256(senha.encode()).digest()
+    else:
+        calculado = _derivar(algoritmo, senha, sal, parametros)
+    
+    return hmac.compare_digest(calculado, esperado)
+
+def decompor_hash(senha_hash: str) -> Tuple[str, Tuple[int, ...], bytes, bytes]:
+    """(algoritmo, parâmetros, sal, hash) de um hash armazenado"""
+    
+    partes = senha_hash.split('$')
+    
+    if len(partes) == 1 and len(senha_hash) == 64:
+        return 'sha256', (), b'', bytes.fromhex(senha_hash)
+    
+    if partes[0] == 'scrypt' and len(partes) == 6:
+        return 'scrypt', tuple(int(v) for v in partes[1:4]), base64.b64decode(partes[4]), base64.b64decode(partes[5])
+    
+    if partes[0] == 'pbkdf2_sha256' and len(partes) == 4:
+        return 'pbkdf2_sha256', (int(partes[1]),), base64.b64decode(partes[2]), base64.b64decode(partes[3])
+    
+    raise ValueError("Formato de hash de senha desconhecido")
+
+class ServicoSenhas:
+    """Gera e verifica hashes de senha num pool limitado de trabalhadores"""
+    
+    def __init__(self, algoritmo: str = 'scrypt', custo: Union[str, int] = 'padrao',
+                 trabalhadores: int = TRABALHADORES_SENHA, processos: bool = False,
+                 fila_maxima: int = FILA_MAXIMA_SENHA):
+        """custo: nome em CUSTOS_SCRYPT/CUSTOS_PBKDF2 ou o valor direto (n ou iterações)"""
+        
+        if algoritmo not in ALGORITMOS:
+            raise ValueError(f"Algoritmo de senha desconhecido: {algoritmo}")
+        
+        custos = CUSTOS_SCRYPT if algoritmo == 'scrypt' else CUSTOS_PBKDF2
+        valor = custos[custo] if isinstance(custo, str) else int(custo)
+        
+        self.algoritmo = algoritmo
+        self.parametros = (valor, SCRYPT_R, SCRYPT_P) if algoritmo == 'scrypt' else (valor,)
+        
+        classe = ProcessPoolExecutor if processos else ThreadPoolExecutor
+        self._executor: Executor = classe(max_workers=trabalhadores)
+        
+        # Vagas = executando + aguardando; sem vaga em TIMEOUT_SENHA, o pedido falha
+        self._vagas = threading.BoundedSemaphore(trabalhadores + fila_maxima)
+        
+        # Hash de referência: e-mail inexistente custa o mesmo que senha errada
+        self._hash_ficticio = _gerar(self.algoritmo, secrets.token_urlsafe(16), self.parametros)
+    
+    def _submeter(self, funcao, *args) -> Future:
+        """Envia ao pool respeitando o limite de pedidos pendentes"""
+        
+        if not self._vagas.acquire(timeout=TIMEOUT_SENHA):
+            raise ErroServicoSenhas("Muitos logins simultâneos; tente novamente")
+        
+        try:
+            futuro = self._executor.submit(funcao, *args)
+        except Exception:
+            self._vagas.release()
+            raise
+        
+        futuro.add_done_callback(lambda _: self._vagas.release())
+        return futuro
+    
+    def gerar_hash_async(self, senha: str) -> Future:
+        """Future com o hash novo da senha"""
+        return self._submeter(_gerar, self.algoritmo, senha, self.parametros)
+    
+    def verificar_async(self, senha: str, senha_hash: Optional[str]) -> Future:
+        """Future com True se a senha confere (senha_hash None = usuário inexistente)"""
+        
+        if senha_hash is None:
+            futuro = self._submeter(_verificar, senha, self._hash_ficticio)
+            resultado = Future()
+            futuro.add_done_callback(lambda _: resultado.set_result(False))
+            return resultado
+        
+        return self._submeter(_verificar, senha, senha_hash)
+    
+    def gerar_hash(self, senha: str) -> str:
+        """Hash novo da senha (bloqueia só a thread chamadora)"""
+        return self.gerar_hash_async(senha).result()
+    
+    def verificar(self, senha: str, senha_hash: Optional[str]) -> bool:
+        """True se a senha confere com o hash armazenado"""
+        return self.verificar_async(senha, senha_hash).result()
+    
+    def precisa_atualizar(self, senha_hash: str) -> bool:
+        """Hash legado, de outro algoritmo ou com custo abaixo do atual"""
+        
+        try:
+            algoritmo, parametros, _, _ = decompor_hash(senha_hash)
+        except ValueError:
+            return True
+        
+        return algoritmo != self.algoritmo or parametros < self.parametros
+    
+    def fechar(self):
+        """Encerra o pool (espera os hashes em andamento)"""
+        self._executor.shutdown(wait=True)
+
+# Serviço compartilhado pelo processo (um pool só para todos os AuthManager)
+_servico_padrao: Optional[ServicoSenhas] = None
+_lock_servico = threading.Lock()
+
+def obter_servico_senhas() -> ServicoSenhas:
+    """ServicoSenhas padrão do processo (scrypt, custo 'padrao')"""
+    
+    global _servico_padrao
+    if _servico_padrao is None:
+        with _lock_servico:
+            if _servico_padrao is None:
+                _servico_padrao = ServicoSenhas()
+    return _servico_padrao
+
+if __name__ == "__main__":
+    import time
+    
+    print("🔑 Hash de Senhas - Orca Interiores")
+    print("=" * 50)
+    
+    legado = hashlib.sha256(b'demo123').hexdigest()
+    
+    for algoritmo, custos in (('scrypt', CUSTOS_SCRYPT), ('pbkdf2_sha256', CUSTOS_PBKDF2)):
+        for custo in custos:
+            servico = ServicoSenhas(algoritmo, custo)
+            inicio = time.perf_counter()
+            senha_hash = servico.gerar_hash('demo123')
+            duracao = (time.perf_counter() - inicio) * 1000
+            
+            print(f"{algoritmo:<14} {custo:<7} {duracao:7.1f} ms  "
+                  f"confere: {servico.verificar('demo123', senha_hash)}  "
+                  f"errada: {servico.verificar('outra', senha_hash)}")
+            servico.fechar()
+    
+    servico = obter_servico_senhas()
+    print(f"\n📜 Legado SHA-256 confere: {servico.verificar('demo123', legado)} "
+          f"(atualizar: {servico.precisa_atualizar(legado)})")
@@ -0,0 +1,255 @@
+"""
+Serialização Binária de Orçamentos - Orca Interiores
+Formato compacto e versionado: cabeçalho pequeno + componentes em colunas
+empacotadas, com compressão opcional (zlib, ou lz4 se instalado)
+
+Layout (little-endian):
+    'ORCQ' | versão (u8) | compressão (u8) | reservado (u16) | payload
+    payload = tamanho do cabeçalho (u32) | cabeçalho JSON | buffers das colunas
+"""
+
+import hashlib
+import json
+import struct
+import zlib
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # lz4 é opcional
+    lz4_frame = None
+
+# Metadados que mudam a cada geração do mesmo orçamento (fora do payload
+# canônico: o momento já fica em orcamentos.data_criacao)
+CHAVES_VOLATEIS = ('timestamp',)
+
+MAGICO = b'ORCQ'
+VERSAO_FORMATO = 1
+
+COMPRESSOES = {'nenhuma': 0, 'zlib': 1, 'lz4': 2}
+_COMPRESSAO_POR_CODIGO = {codigo: nome for nome, codigo in COMPRESSOES.items()}
+
+_PREAMBULO = struct.Struct('<4sBBH')
+_TAMANHO_CABECALHO = struct.Struct('<I')
+
+class ErroSerializacao(ValueError):
+    """Dados de orçamento binários inválidos ou de versão desconhecida"""
+
+def _eh_numero(valor) -> bool:
+    return isinstance(valor, (int, float)) and not isinstance(valor, bool)
+
+def _planejar_coluna(valores: List) -> str:
+    """Escolhe a codificação de uma coluna ('' = não colunar, vai para extras)"""
+    
+    if all(isinstance(v, int) and not isinstance(v, bool) and -2**63 <= v < 2**63 for v in valores):
+        return 'i8'
+    
+    if all(_eh_numero(v) or v is None for v in valores):
+        return 'f8'
+    
+    if all(isinstance(v, str) or v is None for v in valores):
+        distintos = len(set(valores))
+        return 'cat' if distintos <= 65535 and distintos <= max(16, len(valores) // 2) else 'str'
+    
+    return ''
+
+def _codificar_coluna(tipo: str, valores: List) -> Tuple[Dict, bytes]:
+    """Codifica uma coluna em bytes; retorna (metadados, buffer)"""
+    
+    if tipo == 'i8':
+        return {}, np.array(valores, dtype='<i8').tobytes()
+    
+    if tipo == 'f8':
+        nulos = [v is None for v in valores]
+        dados = np.array([np.nan if v is None else v for v in valores], dtype='<f8').tobytes()
+        if any(nulos):
+            return {'nulos': len(dados)}, dados + np.packbits(nulos).tobytes()
+        return {}, dados
+    
+    if tipo == 'cat':
+        categorias = list(dict.fromkeys(valores))
+        indice = {valor: i for i, valor in enumerate(categorias)}
+        dtype = '<u1' if len(categorias) <= 256 else '<u2'
+        return {'categorias': categorias, 'dtype': dtype}, np.array([indice[v] for v in valores], dtype=dtype).tobytes()
+    
+    # 'str': tamanhos (i4, -1 = None) + bytes UTF-8 concatenados
+    codificados = [None if v is None else v.encode('utf-8') for v in valores]
+    tamanhos = np.array([-1 if b is None else len(b) for b in codificados], dtype='<i4')
+    return {}, tamanhos.tobytes() + b''.join(b for b in codificados if b)
+
+def serializar_orcamento(orcamento: Dict, compressao: str = 'zlib') -> bytes:
+    """Serializa um orçamento no formato binário compacto"""
+    
+    if compressao not in COMPRESSOES:
+        raise ErroSerializacao(f"Compressão desconhecida: {compressao}")
+    if compressao == 'lz4' and lz4_frame is None:
+        raise ErroSerializacao("Compressão lz4 indisponível (pacote lz4 não instalado)")
+    
+    componentes = orcamento.get('componentes', []) or []
+    n = len(componentes)
+    
+    # Chaves presentes em todos os componentes viram colunas
+    chaves = list(componentes[0]) if componentes else []
+    chaves = [c for c in chaves if all(c in comp for comp in componentes)]
+    
+    colunas, buffers, offset = [], [], 0
+    colunares = set()
+    
+    for chave in chaves:
+        valores = [comp[chave] for comp in componentes]
+        tipo = _planejar_coluna(valores)
+        if not tipo:
+            continue
+        
+        metadados, buffer = _codificar_coluna(tipo, valores)
+        colunas.append({'nome': chave, 'tipo': tipo, 'offset': offset, 'tamanho': len(buffer), **metadados})
+        buffers.append(buffer)
+        offset += len(buffer)
+        colunares.add(chave)
+    
+    # O que não coube em colunas vai como JSON por componente
+    extras = [{k: v for k, v in comp.items() if k not in colunares} for comp in componentes]
+    
+    cabecalho = {
+        'orcamento': {k: v for k, v in orcamento.items() if k != 'componentes'},
+        'n_componentes': n,
+        'ordem_chaves': [list(comp) for comp in componentes] if any(list(comp) != chaves for comp in componentes) else None,
+        'chaves': chaves,
+        'colunas': colunas,
+        'extras': extras if any(extras) else None
+    }
+    cabecalho_bytes = json.dumps(cabecalho, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+    
+    payload = _TAMANHO_CABECALHO.pack(len(cabecalho_bytes)) + cabecalho_bytes + b''.join(buffers)
+    
+    if compressao == 'zlib':
+        payload = zlib.compress(payload, 6)
+    elif compressao == 'lz4':
+        payload = lz4_frame.compress(payload)
+    
+    return _PREAMBULO.pack(MAGICO, VERSAO_FORMATO, COMPRESSOES[compressao], 0) + payload
+
+def _abrir(dados: bytes) -> Tuple[Dict, memoryview]:
+    """Valida o preâmbulo, descomprime e separa cabeçalho e buffers"""
+    
+    if len(dados) < _PREAMBULO.size:
+        raise ErroSerializacao("Dados binários truncados")
+    
+    magico, versao, codigo_compressao, _ = _PREAMBULO.unpack_from(dados)
+    if magico != MAGICO:
+        raise ErroSerializacao("Dados não estão no formato binário de orçamento")
+    if versao != VERSAO_FORMATO:
+        raise ErroSerializacao(f"Versão de formato não suportada: {versao}")
+    
+    payload = memoryview(dados)[_PREAMBULO.size:]
+    compressao = _COMPRESSAO_POR_CODIGO.get(codigo_compressao)
+    
+    if compressao == 'zlib':
+        payload = memoryview(zlib.decompress(payload))
+    elif compressao == 'lz4':
+        if lz4_frame is None:
+            raise ErroSerializacao("Orçamento comprimido com lz4, mas o pacote lz4 não está instalado")
+        payload = memoryview(lz4_frame.decompress(payload))
+    elif compressao is None:
+        raise ErroSerializacao(f"Compressão desconhecida: {codigo_compressao}")
+    
+    (tamanho,) = _TAMANHO_CABECALHO.unpack_from(payload)
+    inicio = _TAMANHO_CABECALHO.size
+    cabecalho = json.loads(bytes(payload[inicio:inicio + tamanho]))
+    
+    return cabecalho, payload[inicio + tamanho:]
+
+def _decodificar_coluna(coluna: Dict, dados: memoryview, n: int):
+    """Decodifica uma coluna como array (i8/f8), (códigos, categorias) ou lista"""
+    
+    buffer = dados[coluna['offset']:coluna['offset'] + coluna['tamanho']]
+    tipo = coluna['tipo']
+    
+    if tipo in ('i8', 'f8'):
+        return np.frombuffer(buffer, dtype='<' + tipo, count=n)
+    
+    if tipo == 'cat':
+        return np.frombuffer(buffer, dtype=coluna['dtype'], count=n), coluna['categorias']
+    
+    tamanhos = np.frombuffer(buffer, dtype='<i4', count=n)
+    texto = bytes(buffer[4 * n:])
+    valores, pos = [], 0
+    for tamanho in tamanhos.tolist():
+        if tamanho < 0:
+            valores.append(None)
+        else:
+            valores.append(texto[pos:pos + tamanho].decode('utf-8'))
+            pos += tamanho
+    return valores
+
+def decodificar_colunas(dados: bytes) -> Tuple[Dict, Dict]:
+    """Decodifica só o cabeçalho e as colunas, sem montar dicts por componente
+    
+    Para análises em massa: colunas numéricas saem como arrays NumPy,
+    categóricas como (códigos, categorias) e textos como listas.
+    """
+    
+    cabecalho, buffers = _abrir(dados)
+    n = cabecalho['n_componentes']
+    colunas = {coluna['nome']: _decodificar_coluna(coluna, buffers, n) for coluna in cabecalho['colunas']}
+    return cabecalho, colunas
+
+def desserializar_orcamento(dados: Union[bytes, str]) -> Dict:
+    """Reconstrói o orçamento (aceita também o JSON legado)"""
+    
+    if isinstance(dados, str) or (dados[:1] in (b'{', b'[')):
+        return json.loads(dados)
+    
+    cabecalho, buffers = _abrir(dados)
+    n = cabecalho['n_componentes']
+    
+    valores_por_chave = {}
+    for coluna in cabecalho['colunas']:
+        valores = _decodificar_coluna(coluna, buffers, n)
+        
+        if coluna['tipo'] == 'cat':
+            codigos, categorias = valores
+            valores = [categorias[c] for c in codigos.tolist()]
+        elif coluna['tipo'] == 'f8':
+            lista = valores.tolist()
+            if 'nulos' in coluna:
+                inicio = coluna['offset'] + coluna['nulos']
+                nulos = np.unpackbits(np.frombuffer(buffers[inicio:coluna['offset'] + coluna['tamanho']], dtype=np.uint8), count=n)
+                lista = [None if nulo else v for v, nulo in zip(lista, nulos.tolist())]
+            valores = lista
+        elif coluna['tipo'] == 'i8':
+            valores = valores.tolist()
+        
+        valores_por_chave[coluna['nome']] = valores
+    
+    chaves = [chave for chave in cabecalho['chaves'] if chave in valores_por_chave]
+    componentes = [dict(zip(chaves, linha)) for linha in zip(*(valores_por_chave[c] for c in chaves))]
+    if not chaves:
+        componentes = [{} for _ in range(n)]
+    
+    # Chaves fora das colunas e ordem original das chaves
+    extras = cabecalho.get('extras')
+    ordem = cabecalho.get('ordem_chaves')
+    if extras or ordem:
+        for i, comp in enumerate(componentes):
+            if extras:
+                comp.update(extras[i])
+            if ordem:
+                componentes[i] = {chave: comp[chave] for chave in ordem[i]}
+    
+    orcamento = dict(cabecalho['orcamento'])
+    orcamento['componentes'] = componentes
+    return orcamento
+
+def orcamento_canonico(orcamento: Dict) -> Dict:
+    """Orçamento sem os metadados voláteis: o mesmo projeto orçado de novo
+    gera os mesmos bytes (e o mesmo hash no repositório de blobs)"""
+    
+    return {k: v for k, v in orcamento.items() if k not in CHAVES_VOLATEIS}
+
+def hash_conteudo(dados: bytes) -> bytes:
+    """Endereço do payload no repositório de blobs (SHA-256 dos bytes serializados)"""
+    
+    return hashlib.sha256(dados).digest()
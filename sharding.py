@@ -0,0 +1,268 @@
+"""
+Sharding dos Orçamentos - Orca Interiores
+Orçamentos (linhas, payloads, índice de busca e estatísticas) em arquivos
+SQLite separados por usuário; o banco central guarda usuários, planos,
+sessões e cota, e é o diretório que diz em qual arquivo está cada usuário
+
+Cada arquivo de shard tem seu próprio lock de escrita: a gravação em massa
+de um cliente não trava a dos outros. Atribuição por hash do id
+(orcamentos_NN.db) ou arquivo dedicado a um cliente (orcamentos_u<id>.db).
+
+Os orçamentos movidos recebem ids novos no arquivo de destino.
+
+Uso (com o app parado - processos em execução guardam o roteamento em cache):
+    python sharding.py dividir usuarios.db --shards 4       # divide o banco atual
+    python sharding.py dedicar usuarios.db --usuario 3      # arquivo só do usuário 3
+    python sharding.py status usuarios.db
+"""
+
+import os
+import sqlite3
+from contextlib import closing
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from migracoes import aplicar_migracoes, limpar_blobs_orfaos
+
+# Pasta dos arquivos de shard, relativa à pasta do banco central
+PASTA_SHARDS_PADRAO = 'shards'
+
+# Colunas copiadas de orcamentos ao mover usuários entre arquivos (o id
+# não: cada arquivo tem sua sequência, e o destino dá ids novos)
+COLUNAS_ORCAMENTOS = ('usuario_id', 'nome_arquivo', 'valor_final', 'area_total',
+                      'data_criacao', 'dados_json', 'dados_bin', 'dados_hash')
+
+def nome_shard_hash(usuario_id: int, num_shards: int, pasta: str = PASTA_SHARDS_PADRAO) -> str:
+    """Shard por hash do id (caminho relativo, como fica em usuarios.shard)"""
+    return os.path.join(pasta, f"orcamentos_{usuario_id % num_shards:02d}.db")
+
+def nome_shard_dedicado(usuario_id: int, pasta: str = PASTA_SHARDS_PADRAO) -> str:
+    """Arquivo exclusivo de um cliente (caminho relativo)"""
+    return os.path.join(pasta, f"orcamentos_u{usuario_id}.db")
+
+def resolver_shard(db_central: str, shard: Optional[str]) -> str:
+    """Caminho do arquivo de um shard (None = o próprio banco central)"""
+    
+    if not shard:
+        return db_central
+    return os.path.join(os.path.dirname(os.path.abspath(db_central)), shard)
+
+def arquivos_orcamentos(conn: sqlite3.Connection, db_central: str) -> List[str]:
+    """Todos os arquivos com orçamentos: o banco central e os shards existentes do diretório"""
+    
+    # Banco anterior ao diretório de shards: só o central
+    colunas = {linha[1] for linha in conn.execute("PRAGMA table_info(usuarios)")}
+    if 'shard' not in colunas:
+        return [db_central]
+    
+    shards = [linha[0] for linha in conn.execute(
+        "SELECT DISTINCT shard FROM usuarios WHERE shard IS NOT NULL ORDER BY shard"
+    )]
+    caminhos = [resolver_shard(db_central, shard) for shard in shards]
+    return [db_central] + [caminho for caminho in caminhos if os.path.exists(caminho)]
+
+def ler_configuracao(conn: sqlite3.Connection) -> Tuple[str, int]:
+    """(pasta, número de shards) gravados no banco central; 0 = sharding desligado"""
+    
+    configuracao = dict(conn.execute(
+        "SELECT chave, valor FROM configuracao WHERE chave IN ('pasta_shards', 'num_shards')"
+    ).fetchall())
+    return configuracao.get('pasta_shards') or PASTA_SHARDS_PADRAO, int(configuracao.get('num_shards') or 0)
+
+def gravar_configuracao(conn: sqlite3.Connection, pasta: str, num_shards: int):
+    """Liga o sharding por hash para os usuários ainda sem shard"""
+    
+    conn.executemany(
+        "INSERT INTO configuracao (chave, valor) VALUES (?, ?) ON CONFLICT (chave) DO UPDATE SET valor = excluded.valor",
+        [('pasta_shards', pasta), ('num_shards', str(num_shards))]
+    )
+
+def preparar_shard(caminho: str):
+    """Cria o arquivo do shard (e a pasta) com o schema em dia"""
+    
+    os.makedirs(os.path.dirname(os.path.abspath(caminho)), exist_ok=True)
+    with closing(sqlite3.connect(caminho)) as conn:
+        aplicar_migracoes(conn)
+
+def mover_orcamentos(conn_origem: sqlite3.Connection, caminho_destino: str, usuario_ids: Iterable[int],
+                     shard_diretorio: Optional[str] = None) -> int:
+    """Move os orçamentos dos usuários para outro arquivo; retorna quantos
+    
+    Linhas, payloads e índice de busca são copiados e a origem é apagada numa
+    única transação sobre os dois arquivos; as estatísticas se refazem pelos
+    gatilhos. Cada linha recebe um id novo do destino (a busca segue o id
+    novo), então linhas que o usuário já tenha lá não colidem nem se perdem.
+    
+    Transações com ATTACH só são atômicas entre arquivos fora do WAL: os dois
+    passam a journal_mode=DELETE durante a cópia e voltam ao modo anterior.
+    Isso exige o app parado (a troca de modo falha com o banco em uso).
+    
+    shard_diretorio (origem = banco central): grava o shard dos usuários no
+    diretório na mesma transação, então ninguém é roteado para um arquivo
+    que ainda não tem os seus orçamentos.
+    """
+    
+    preparar_shard(caminho_destino)
+    colunas = ', '.join(COLUNAS_ORCAMENTOS)
+    
+    conn_origem.commit()
+    conn_origem.execute("ATTACH DATABASE ? AS destino", (caminho_destino,))
+    modos = {banco: conn_origem.execute(f"PRAGMA {banco}.journal_mode").fetchone()[0]
+             for banco in ('main', 'destino')}
+    
+    try:
+        for banco in modos:
+            conn_origem.execute(f"PRAGMA {banco}.journal_mode=DELETE")
+        
+        cursor = conn_origem.cursor()
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS mover_usuarios (usuario_id INTEGER PRIMARY KEY)")
+        cursor.execute("DELETE FROM temp.mover_usuarios")
+        cursor.executemany("INSERT OR IGNORE INTO temp.mover_usuarios VALUES (?)", [(i,) for i in usuario_ids])
+        
+        filtro = "usuario_id IN (SELECT usuario_id FROM temp.mover_usuarios)"
+        ids = [linha[0] for linha in cursor.execute(f"SELECT id FROM main.orcamentos WHERE {filtro} ORDER BY id")]
+        
+        cursor.execute(f"""
+            INSERT OR IGNORE INTO destino.blobs_orcamento (hash, dados)
+            SELECT b.hash, b.dados FROM main.blobs_orcamento b
+            WHERE b.hash IN (SELECT dados_hash FROM main.orcamentos WHERE {filtro})
+        """)
+        
+        for id_origem in ids:
+            cursor.execute(f"INSERT INTO destino.orcamentos ({colunas}) SELECT {colunas} FROM main.orcamentos WHERE id = ?",
+                           (id_origem,))
+            cursor.execute("""
+                INSERT INTO destino.busca_orcamentos (rowid, nome_arquivo, componentes, tipos, usuario)
+                SELECT ?, nome_arquivo, componentes, tipos, usuario FROM main.busca_orcamentos WHERE rowid = ?
+            """, (cursor.lastrowid, id_origem))
+        
+        # Gatilhos da origem limpam busca e estatísticas
+        cursor.execute(f"DELETE FROM main.orcamentos WHERE {filtro}")
+        
+        if shard_diretorio is not None:
+            cursor.execute("UPDATE main.usuarios SET shard = ? WHERE id IN (SELECT usuario_id FROM temp.mover_usuarios)",
+                           (shard_diretorio,))
+        conn_origem.commit()
+        
+        return len(ids)
+    
+    except Exception:
+        conn_origem.rollback()
+        raise
+    
+    finally:
+        for banco, modo in modos.items():
+            conn_origem.execute(f"PRAGMA {banco}.journal_mode={modo}")
+        conn_origem.execute("DETACH DATABASE destino")
+
+def dividir(db_central: str, num_shards: int, pasta: str = PASTA_SHARDS_PADRAO) -> Dict[str, int]:
+    """Liga o sharding por hash e move os orçamentos do banco central para os shards
+    
+    Quem tem orçamentos no banco central só passa a apontar para o shard na
+    transação que os move: uma falha no meio deixa cada usuário inteiro num
+    lugar só (rodar de novo continua de onde parou).
+    """
+    
+    with closing(sqlite3.connect(db_central)) as conn:
+        aplicar_migracoes(conn)
+        gravar_configuracao(conn, pasta, num_shards)
+        
+        # Diretório: usuários sem shard e sem orçamentos recebem o do hash já
+        sem_orcamentos = [linha[0] for linha in conn.execute("""
+            SELECT u.id FROM usuarios u
+            WHERE u.shard IS NULL AND NOT EXISTS (SELECT 1 FROM orcamentos o WHERE o.usuario_id = u.id)
+        """)]
+        conn.executemany("UPDATE usuarios SET shard = ? WHERE id = ?",
+                         [(nome_shard_hash(i, num_shards, pasta), i) for i in sem_orcamentos])
+        conn.commit()
+        
+        for indice in range(num_shards):
+            preparar_shard(resolver_shard(db_central, nome_shard_hash(indice, num_shards, pasta)))
+        
+        # Usuários com orçamentos ainda no banco central, agrupados pelo shard de destino
+        grupos: Dict[str, list] = {}
+        for usuario_id, shard in conn.execute("""
+            SELECT u.id, u.shard FROM usuarios u
+            WHERE EXISTS (SELECT 1 FROM orcamentos o WHERE o.usuario_id = u.id)
+        """).fetchall():
+            grupos.setdefault(shard or nome_shard_hash(usuario_id, num_shards, pasta), []).append(usuario_id)
+        
+        movidos = {
+            shard: mover_orcamentos(conn, resolver_shard(db_central, shard), usuario_ids, shard_diretorio=shard)
+            for shard, usuario_ids in sorted(grupos.items())
+        }
+        
+        limpar_blobs_orfaos(conn.cursor())
+        conn.commit()
+    
+    return movidos
+
+def dedicar(db_central: str, usuario_id: int, pasta: str = PASTA_SHARDS_PADRAO) -> int:
+    """Move um cliente para um arquivo só dele; retorna quantos orçamentos moveu"""
+    
+    with closing(sqlite3.connect(db_central)) as conn:
+        aplicar_migracoes(conn)
+        linha = conn.execute("SELECT shard FROM usuarios WHERE id = ?", (usuario_id,)).fetchone()
+        if linha is None:
+            raise ValueError(f"Usuário {usuario_id} não existe")
+        
+        novo = nome_shard_dedicado(usuario_id, pasta)
+        if linha[0] == novo:
+            return 0
+        
+        with closing(sqlite3.connect(resolver_shard(db_central, linha[0]))) as origem:
+            aplicar_migracoes(origem)
+            movidos = mover_orcamentos(origem, resolver_shard(db_central, novo), [usuario_id])
+            limpar_blobs_orfaos(origem.cursor())
+            origem.commit()
+        
+        conn.execute("UPDATE usuarios SET shard = ? WHERE id = ?", (novo, usuario_id))
+        conn.commit()
+    
+    return movidos
+
+def status(db_central: str) -> Dict[str, Dict]:
+    """Usuários e orçamentos por arquivo (banco central incluído)"""
+    
+    resultado = {}
+    
+    with closing(sqlite3.connect(db_central)) as conn:
+        usuarios = dict(conn.execute("SELECT COALESCE(shard, ''), COUNT(*) FROM usuarios GROUP BY 1").fetchall())
+    
+    for shard in sorted(set(usuarios) | {''}):
+        caminho = resolver_shard(db_central, shard)
+        orcamentos = 0
+        if os.path.exists(caminho):
+            with closing(sqlite3.connect(caminho)) as conn:
+                orcamentos = conn.execute("SELECT COUNT(*) FROM orcamentos").fetchone()[0]
+        resultado[shard or '(central)'] = {'usuarios': usuarios.get(shard, 0), 'orcamentos': orcamentos}
+    
+    return resultado
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Divide os orçamentos em arquivos SQLite por usuário")
+    parser.add_argument('comando', choices=('dividir', 'dedicar', 'status'))
+    parser.add_argument('db', nargs='?', default='usuarios.db', help="Banco central")
+    parser.add_argument('--shards', type=int, default=4, help="Número de shards por hash (dividir)")
+    parser.add_argument('--usuario', type=int, help="Usuário a dedicar (dedicar)")
+    parser.add_argument('--pasta', default=PASTA_SHARDS_PADRAO, help="Pasta dos shards, relativa ao banco central")
+    args = parser.parse_args()
+    
+    print(f"🧩 Sharding - {args.db}")
+    print("=" * 50)
+    
+    if args.comando == 'dividir':
+        movidos = dividir(args.db, args.shards, args.pasta)
+        for shard, quantidade in movidos.items():
+            print(f"📦 {shard}: {quantidade} orçamentos")
+        print(f"✅ {sum(movidos.values())} orçamentos movidos para {args.shards} shards")
+    
+    elif args.comando == 'dedicar':
+        if args.usuario is None:
+            parser.error("dedicar exige --usuario")
+        print(f"✅ {dedicar(args.db, args.usuario, args.pasta)} orçamentos movidos para "
+              f"{nome_shard_dedicado(args.usuario, args.pasta)}")
+    
+    for shard, info in status(args.db).items():
+        print(f"🗄️ {shard}: {info['usuarios']} usuários, {info['orcamentos']} orçamentos")